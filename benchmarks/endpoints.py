@@ -0,0 +1,424 @@
+"""Offline load test for the DiabeGuide endpoints.
+
+    python benchmarks/endpoints.py --users 10000 --readings 1000 --chat-messages 1000
+    python benchmarks/endpoints.py --readings 1000,100000,1000000 --scenarios tracker_get,dashboard
+    python benchmarks/endpoints.py --json before.json   # ...change code...
+    python benchmarks/endpoints.py --baseline before.json --max-slowdown 1.5
+
+Drives the app in-process through Flask's test client, with the fake Gemini
+model and a local SMTP sink, against synthetic users and history created in
+a scratch directory. Reports p50/p99 latency, throughput and memory per
+endpoint. Given several sizes it runs each one in a fresh process and prints
+how every endpoint scales, which is where O(history) or O(users) work in the
+request path shows up.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+PASSWORD = 'benchmark-password'
+NOTES = ['before breakfast', 'after lunch', 'after dinner', 'bedtime', 'felt shaky', 'after a walk']
+
+
+class Context:
+    """Everything the scenarios need: the app, its settings and logged-in clients"""
+
+    def __init__(self, app, args):
+        self.app = app
+        self.args = args
+        self.user_count = args.users
+        self._clients = []
+        self._signups = itertools.count()
+
+    def logged_in_client(self, index):
+        """Client logged in as user1, the user that owns the synthetic history"""
+        while len(self._clients) <= index:
+            client = self.app.test_client()
+            expect(client.post('/login', data={'username_or_email': 'user1', 'password': PASSWORD}), 302)
+            self._clients.append(client)
+        return self._clients[index]
+
+    def next_signup(self):
+        return next(self._signups)
+
+
+class Failed(Exception):
+    pass
+
+
+def expect(response, *statuses):
+    if response.status_code not in statuses:
+        raise Failed(f'{response.request.path} -> {response.status_code}')
+    return response
+
+
+# --- Scenarios: (needs a logged-in client, fn(ctx, client, i)) ---
+def login(ctx, client, i):
+    # A fresh anonymous client each time, cycling through the synthetic users
+    user = f'user{i % ctx.user_count + 1}'
+    expect(ctx.app.test_client().post('/login', data={'username_or_email': user, 'password': PASSWORD}), 302)
+
+
+def signup_otp(ctx, client, i):
+    client = ctx.app.test_client()
+    name = f'signup{os.getpid()}_{ctx.next_signup()}'
+    expect(client.post('/signup', data={'username': name, 'email': f'{name}@bench.test', 'password': PASSWORD}), 200)
+    with client.session_transaction() as session:
+        otp = session['signup_otp']
+    expect(client.post('/signup', data={'verify_otp': 'true', 'otp': otp}), 302)
+
+
+def tracker_post(ctx, client, i):
+    now = datetime.now()
+    reading = {'sugar_level': str(80 + i % 150), 'note': 'benchmark', 'month': f'{now.month:02d}', 'year': str(now.year)}
+    expect(client.post('/api/tracker', json=reading), 200)
+
+
+def tracker_get(ctx, client, i):
+    expect(client.get('/api/tracker?limit=200'), 200)
+
+
+def tracker_get_full(ctx, client, i):
+    expect(client.get('/api/tracker'), 200)
+
+
+def tracker_summary(ctx, client, i):
+    expect(client.get('/api/tracker/summary'), 200)
+
+
+def dashboard(ctx, client, i):
+    expect(client.get('/'), 200)
+
+
+def download(ctx, client, i):
+    expect(client.get('/api/download'), 200)
+
+
+def chat(ctx, client, i):
+    # A new question every time so the response cache doesn't answer it
+    expect(client.post('/api/chat', json={'message': f'benchmark question {os.getpid()} {i}'}), 200)
+
+
+def chat_stream(ctx, client, i):
+    response = expect(client.post('/api/chat/stream', json={'message': f'benchmark stream {os.getpid()} {i}'}), 200)
+    response.get_data()
+
+
+def history(ctx, client, i):
+    expect(client.get('/api/chat/history?limit=50'), 200)
+
+
+def history_full(ctx, client, i):
+    expect(client.get('/api/chat/history'), 200)
+
+
+SCENARIOS = {
+    'login': (False, login),
+    'signup_otp': (False, signup_otp),
+    'tracker_post': (True, tracker_post),
+    'tracker_get': (True, tracker_get),
+    'tracker_get_full': (True, tracker_get_full),
+    'tracker_summary': (True, tracker_summary),
+    'dashboard': (True, dashboard),
+    'download': (True, download),
+    'chat': (True, chat),
+    'chat_stream': (True, chat_stream),
+    'history': (True, history),
+    'history_full': (True, history_full),
+}
+
+
+# --- Synthetic data ---
+def synthetic_users(count, password_hash):
+    for i in range(1, count + 1):
+        yield {
+            'id': str(i), 'username': f'user{i}', 'password_hash': password_hash,
+            'email': f'user{i}@bench.test', 'weight': '70', 'height': '170', 'age': str(20 + i % 60),
+            'diabetes_type': 'Type 1' if i % 5 == 0 else 'Type 2', 'email_verified': True,
+        }
+
+
+def synthetic_tracker(readings, rng):
+    """{month_year: [entries]} with readings spread over about five years up to now"""
+    step = max(60, int(5 * 365 * 86400 / max(readings, 1)))
+    start = datetime.now() - timedelta(seconds=step * readings)
+    tracker = {}
+    for i in range(readings):
+        when = start + timedelta(seconds=step * i)
+        tracker.setdefault(when.strftime('%m-%Y'), []).append({
+            'sugar_level': str(rng.randint(55, 280)),
+            'note': rng.choice(NOTES),
+            'timestamp': when.isoformat(timespec='seconds'),
+        })
+    return tracker
+
+
+def synthetic_chat(messages):
+    return [
+        {'role': 'user', 'message': f'Question {i // 2} about my readings?'} if i % 2 == 0
+        else {'role': 'bot', 'message': f'Answer {i // 2}: keep tracking and stay hydrated.'}
+        for i in range(messages)
+    ]
+
+
+def seed(args, password_hash):
+    from diabeGuide import data
+
+    started = time.perf_counter()
+    if args.user_store == 'sqlite':
+        users = synthetic_users(args.users, password_hash)
+        while True:
+            batch = list(itertools.islice(users, 50000))
+            if not batch:
+                break
+            data.user_repository.import_records(batch)
+    rng = random.Random(42)
+    data.save_user_data('1', synthetic_tracker(args.readings, rng))
+    data.save_user_archived_chat_history('1', synthetic_chat(args.chat_messages))
+    print(f"Seeded {args.users} users, {args.readings} readings and {args.chat_messages} chat messages "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+def configure_environment(args, workdir, smtp_port):
+    os.makedirs(os.path.join(workdir, 'diabeGuide', 'user_data'), exist_ok=True)
+    os.environ.update({
+        'GEMINI_FAKE_MODEL': '1',
+        'FAKE_MODEL_LATENCY': str(args.model_latency),
+        'SMTP_SERVER': '127.0.0.1',
+        'SMTP_PORT': str(smtp_port),
+        'SMTP_STARTTLS': '0',
+        'SMTP_AUTH': '0',
+        'FROM_EMAIL': 'bench@diabeguide.test',
+        'USER_STORE': args.user_store,
+        'MODEL_PER_USER': str(max(1, args.concurrency)),
+        'MODEL_MAX_PENDING': str(max(16, args.concurrency * 2)),
+        'LOGIN_MAX_ATTEMPTS': str(10 ** 9),
+        'LOGIN_MAX_ATTEMPTS_PER_IP': str(10 ** 9),
+        'CHAT_CACHE': '1',
+    })
+    if args.hash_method:
+        os.environ['PASSWORD_HASH_METHOD'] = args.hash_method
+
+
+# --- Measurement ---
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def peak_memory(fn):
+    """Peak Python allocations (bytes) while running fn once"""
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        fn()
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+
+def max_rss_mb():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage / (1024 * 1024) if sys.platform == 'darwin' else usage / 1024
+
+
+def run_scenario(ctx, name, requests, concurrency, warmup):
+    authenticated, fn = SCENARIOS[name]
+    clients = [ctx.logged_in_client(n) if authenticated else None for n in range(concurrency)]
+    for i in range(warmup):
+        fn(ctx, clients[0], i)
+
+    latencies, errors = [], []
+    lock = threading.Lock()
+    counter = itertools.count(warmup)
+
+    def worker(client):
+        while True:
+            i = next(counter)
+            if i >= warmup + requests:
+                return
+            start = time.perf_counter()
+            try:
+                fn(ctx, client, i)
+            except Failed as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    memory = peak_memory(lambda: fn(ctx, clients[0], warmup + requests))
+    result = {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        'throughput': round(len(latencies) / wall, 1) if wall else None,
+        'peak_alloc_kb': round(memory / 1024, 1),
+        'max_rss_mb': round(max_rss_mb(), 1) if resource else None,
+    }
+    if errors:
+        result['first_error'] = errors[0]
+    return result
+
+
+def print_results(results):
+    print(f"\n{'endpoint':<18}{'ok':>7}{'err':>5}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>9}{'peak KB/req':>13}{'max RSS MB':>12}")
+    for name, r in results.items():
+        print(f"{name:<18}{r['requests']:>7}{r['errors']:>5}{r['p50_ms'] or 0:>10.2f}{r['p99_ms'] or 0:>10.2f}"
+              f"{r['throughput'] or 0:>9.1f}{r['peak_alloc_kb']:>13.1f}{r['max_rss_mb'] or 0:>12.1f}")
+        if r.get('first_error'):
+            print(f"  first error: {r['first_error']}")
+
+
+def compare(results, baseline_path, max_slowdown):
+    """Names of endpoints whose p50 grew by more than max_slowdown times"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+    regressions = []
+    print(f"\nCompared with {baseline_path} (p50):")
+    for name, r in results.items():
+        before = baseline.get(name, {}).get('p50_ms')
+        if not before or r['p50_ms'] is None:
+            continue
+        ratio = r['p50_ms'] / before
+        flag = '  REGRESSION' if ratio > max_slowdown else ''
+        print(f"  {name:<18}{before:>10.2f} -> {r['p50_ms']:>10.2f} ms  x{ratio:.2f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def run_once(args):
+    from diabeGuide.utils.smtp_sink import SmtpSink
+
+    workdir = tempfile.mkdtemp(prefix='diabeguide-bench-')
+    sink = SmtpSink(('127.0.0.1', 0), quiet=True)
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+    configure_environment(args, workdir, sink.server_address[1])
+    os.chdir(workdir)
+    try:
+        from werkzeug.security import generate_password_hash
+        password_hash = generate_password_hash(PASSWORD, args.hash_method or 'scrypt')
+        if args.user_store == 'json':
+            with open(os.path.join('diabeGuide', 'users.json'), 'w') as f:
+                json.dump({u.pop('id'): u for u in synthetic_users(args.users, password_hash)}, f)
+
+        from diabeGuide.app import create_app
+        app = create_app()
+        app.config['TESTING'] = True
+        seed(args, password_hash)
+
+        ctx = Context(app, args)
+        results = {}
+        for name in args.scenarios:
+            print(f"Running {name}...", flush=True)
+            results[name] = run_scenario(ctx, name, args.requests, args.concurrency, args.warmup)
+        return {
+            'config': {'users': args.users, 'readings': args.readings, 'chat_messages': args.chat_messages,
+                       'concurrency': args.concurrency, 'model_latency': args.model_latency},
+            'results': results,
+            'mail_delivered': sink.received,
+        }
+    finally:
+        sink.shutdown()
+        os.chdir(ROOT)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def sweep(args, users_sizes, readings_sizes):
+    """Run every size combination in its own process and tabulate p50 by size"""
+    runs = []
+    for users, readings in itertools.product(users_sizes, readings_sizes):
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            out = f.name
+        command = [sys.executable, os.path.abspath(__file__), '--users', str(users), '--readings', str(readings),
+                   '--chat-messages', str(args.chat_messages), '--requests', str(args.requests),
+                   '--concurrency', str(args.concurrency), '--warmup', str(args.warmup),
+                   '--model-latency', str(args.model_latency), '--user-store', args.user_store,
+                   '--scenarios', ','.join(args.scenarios), '--json', out]
+        if args.hash_method:
+            command += ['--hash-method', args.hash_method]
+        print(f"\n### users={users} readings={readings}", flush=True)
+        subprocess.run(command, check=True)
+        with open(out) as f:
+            runs.append(((users, readings), json.load(f)['results']))
+        os.unlink(out)
+
+    print("\np50 ms by size (users x readings):")
+    labels = [f'{u}x{r}' for (u, r), _ in runs]
+    print(f"{'endpoint':<18}" + ''.join(f'{label:>16}' for label in labels))
+    for name in args.scenarios:
+        print(f"{name:<18}" + ''.join(f"{(results[name]['p50_ms'] or 0):>16.2f}" for _, results in runs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', default='10000', help='Synthetic users (comma-separated to sweep)')
+    parser.add_argument('--readings', default='1000', help='Tracker readings for the benchmark user (comma-separated to sweep)')
+    parser.add_argument('--chat-messages', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=100, help='Measured requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=1, help='Client threads per endpoint')
+    parser.add_argument('--model-latency', type=float, default=0.05, help='Fake Gemini latency in seconds')
+    parser.add_argument('--hash-method', help="Password hash method, e.g. 'pbkdf2:sha256:1000' for fast logins")
+    parser.add_argument('--user-store', choices=['sqlite', 'json'], default='sqlite')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"Comma-separated; any of {', '.join(SCENARIOS)}")
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--baseline', help='Results file from an earlier run to compare against')
+    parser.add_argument('--max-slowdown', type=float, default=1.5, help='p50 ratio that counts as a regression')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch directory')
+    args = parser.parse_args()
+
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    users_sizes = [int(n) for n in args.users.split(',')]
+    readings_sizes = [int(n) for n in args.readings.split(',')]
+    if len(users_sizes) > 1 or len(readings_sizes) > 1:
+        sweep(args, users_sizes, readings_sizes)
+        return
+    args.users, args.readings = users_sizes[0], readings_sizes[0]
+
+    report = run_once(args)
+    print_results(report['results'])
+    print(f"\nOTP emails delivered to the SMTP sink: {report['mail_delivered']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline and compare(report['results'], args.baseline, args.max_slowdown):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
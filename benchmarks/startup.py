@@ -0,0 +1,101 @@
+"""Measure DiabeGuide worker start-up: import time per module and create_app() time.
+
+    python benchmarks/startup.py [--top 20] [--mode deferred|eager|both]
+
+Each mode runs in a fresh interpreter under `python -X importtime`, the same
+work a gunicorn worker does on boot (or the master, with preload_app). Run it
+from the repository root so the app finds its data files.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Written to stderr between boot and the first model build, so imports can be split
+MARKER = '-- first chat --'
+
+CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+from diabeGuide.app import create_app
+t1 = time.perf_counter()
+app = create_app(defer_imports={defer})
+t2 = time.perf_counter()
+first_model = None
+print({marker!r}, file=sys.stderr, flush=True)
+if hasattr(app.model, 'get'):
+    app.model.get()
+    first_model = time.perf_counter() - t2
+print(json.dumps({{'import_app': t1 - t0, 'create_app': t2 - t1, 'first_model': first_model}}))
+"""
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us, depth)] from -X importtime output,
+    split into imports made while booting and those made by the first chat"""
+    boot, rows = None, []
+    for line in stderr.splitlines():
+        if line == MARKER:
+            boot, rows = rows, []
+            continue
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return boot, rows
+
+
+def run(defer):
+    env = dict(os.environ, GEMINI_API_KEY=os.getenv('GEMINI_API_KEY', 'benchmark'))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD.format(defer=defer, marker=MARKER)],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    return timings, *parse_importtime(result.stderr)
+
+
+def report(mode, timings, rows, first_chat_rows, top):
+    by_package = defaultdict(int)
+    for name, self_us, _, _ in rows:
+        by_package[name.split('.')[0]] += self_us
+    total_us = sum(by_package.values())
+
+    print(f"\n=== {mode} ===")
+    print(f"import diabeGuide.app  {timings['import_app'] * 1000:8.1f} ms")
+    print(f"create_app()           {timings['create_app'] * 1000:8.1f} ms")
+    print(f"modules imported       {len(rows):8d}   ({total_us / 1000:.1f} ms in import)")
+    if timings['first_model'] is not None:
+        print(f"first chat model init  {timings['first_model'] * 1000:8.1f} ms"
+              f"   ({len(first_chat_rows)} more modules)")
+
+    print(f"\nTop {top} packages by import time at boot:")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {self_us / 1000:8.1f} ms  {package}")
+
+    print(f"\nTop {top} modules by cumulative import time at boot:")
+    for name, _, cumulative_us, depth in sorted(rows, key=lambda row: -row[2])[:top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {'  ' * depth}{name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--mode', choices=['deferred', 'eager', 'both'], default='both')
+    args = parser.parse_args()
+
+    modes = ['deferred', 'eager'] if args.mode == 'both' else [args.mode]
+    for mode in modes:
+        timings, rows, first_chat_rows = run(defer=mode == 'deferred')
+        report(mode, timings, rows, first_chat_rows, args.top)
+
+
+if __name__ == '__main__':
+    main()
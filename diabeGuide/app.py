@@ -1,28 +1,192 @@
+import logging
 import os
-from flask import Flask, redirect, url_for
-import google.generativeai as genai
+import time
+from flask import Flask, redirect, url_for, request, g
 from dotenv import load_dotenv
 from flask_login import LoginManager, login_required, current_user
-from .data import get_user_by_id
+from werkzeug.middleware.proxy_fix import ProxyFix
+from . import data
+from .data import get_user_by_id, load_users, reload_users
+from .utils.fake_model import FakeModel
+from .utils import mail_queue
+from .utils.model_loader import LazyModel, gemini_factory, import_sdk
+from .utils.metrics import REQUEST_SECONDS, flush as flush_metrics, register_collector, start_profile, finish_profile
+from .utils.model_client import CircuitBreaker, ModelClient, UserQuota
+from .utils.model_pool import ModelCallPool
+from .utils.passwords import LoginThrottle, PasswordHasher
+from .utils.response_cache import ResponseCache
+from .utils.analytics import AnalyticsCache
 
-def create_app():
+def warm_up():
+    """Import the heavy modules and fill the user cache ahead of the first request"""
+    import_sdk()
+    import numpy  # noqa: F401  (tracker summaries)
+    load_users()
+
+def runtime_stats(app):
+    """Gauges for /metrics: response, analytics and loader caches, model pool and client, hashing pool, mail outbox"""
+    stats = []
+    if app.response_cache:
+        for name, value in app.response_cache.stats().items():
+            stats.append((f'diabeguide_chat_cache_{name}', 'Chatbot response cache statistics (this worker)', {}, value))
+    pool = app.model_pool.stats()
+    stats.append(('diabeguide_model_calls_pending', 'Model calls running or queued', {}, pool['pending']))
+    stats.append(('diabeguide_model_users_pending', 'Users with a model call in flight', {}, pool['users']))
+    for name, value in app.model_client.stats().items():
+        stats.append((f'diabeguide_model_client_{name}', 'Model client retries, coalescing, refusals and circuit state (this worker)', {}, value))
+    stats.append(('diabeguide_password_hashes_pending', 'Password hashes running or queued', {}, app.password_hasher.pending))
+    for name, value in app.analytics_cache.stats().items():
+        stats.append((f'diabeguide_analytics_cache_{name}', 'Glucose analytics cache statistics (this worker)', {}, value))
+    for name, value in data.loader_cache.stats().items():
+        stats.append((f'diabeguide_loader_cache_{name}', 'Tracker/chat loader cache statistics (this worker)', {}, value))
+    sender = mail_queue.current_sender()
+    if sender is not None:
+        for status, count in sender.outbox.stats().items():
+            stats.append(('diabeguide_mail_outbox_messages', 'Messages in the mail outbox', {'status': status}, count))
+    return stats
+
+def create_app(defer_imports=None):
+    """Build the Flask app.
+
+    With defer_imports (the default, or APP_DEFER_IMPORTS=1) the Gemini SDK
+    and the user cache are loaded on first use. Pass False when the app is
+    preloaded in the gunicorn master, so that work is done once before fork.
+    """
     load_dotenv()
+    if defer_imports is None:
+        defer_imports = os.getenv('APP_DEFER_IMPORTS', '1') == '1'
+    if not defer_imports:
+        warm_up()
 
     app = Flask(__name__)
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'a_very_secret_key') # Set a secret key
 
+    # Behind a reverse proxy every client shares the proxy's address. With
+    # TRUSTED_PROXIES=n the client address and scheme are taken from the
+    # X-Forwarded-* headers set by the last n proxies, so per-IP login
+    # throttling sees real clients.
+    trusted_proxies = int(os.getenv('TRUSTED_PROXIES', 0))
+    if trusted_proxies > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies, x_proto=trusted_proxies)
+
+    # LOG_LEVEL=DEBUG also logs chatbot prompts and replies
+    logging.getLogger('diabeGuide').setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
+    # Time every request for /metrics. With PROFILE_REQUESTS=1, adding
+    # ?profile=1 to a URL logs a cProfile report for that request (and saves
+    # it under PROFILE_DIR when set).
+    profile_requests = os.getenv('PROFILE_REQUESTS') == '1'
+    profile_dir = os.getenv('PROFILE_DIR')
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        if profile_requests and request.args.get('profile') == '1':
+            g.profiler = start_profile()
+
+    @app.after_request
+    def record_timing(response):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            finish_profile(profiler, request.endpoint or request.path, profile_dir)
+        start = g.pop('request_start', None)
+        if start is not None:
+            labels = {'endpoint': request.endpoint or 'unmatched', 'method': request.method,
+                      'status': response.status_code}
+
+            def observe():
+                REQUEST_SECONDS.observe(time.perf_counter() - start, **labels)
+                flush_metrics()
+
+            if response.is_streamed:
+                # Streamed bodies (chat SSE) are produced after this hook;
+                # time them until the response is closed
+                response.call_on_close(observe)
+            else:
+                observe()
+        return response
+
     # Configure Flask-Login
     login_manager = LoginManager()
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login' # Specify the login view
 
+    @app.before_request
+    def sync_users():
+        # Pick up account/profile changes made by other gunicorn workers
+        reload_users()
+
     @login_manager.user_loader
     def load_user(user_id):
         return get_user_by_id(user_id)
 
-    # Configure the Gemini API
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-    app.model = genai.GenerativeModel('gemini-2.5-flash')
+    # Configure the Gemini API (or the offline stand-in for load tests)
+    if os.getenv('GEMINI_FAKE_MODEL') == '1':
+        app.model = FakeModel(
+            latency=float(os.getenv('FAKE_MODEL_LATENCY', 2.0)),
+            latency_jitter=float(os.getenv('FAKE_MODEL_LATENCY_JITTER', 0)),
+            error_rate=float(os.getenv('FAKE_MODEL_ERROR_RATE', 0))
+        )
+    else:
+        # Built on the first chat, in the worker that serves it
+        app.model = LazyModel(gemini_factory(os.getenv("GEMINI_API_KEY")))
+
+    # Bounded pool for model calls so slow Gemini replies can't take every thread
+    app.model_pool = ModelCallPool(
+        max_workers=int(os.getenv('MODEL_MAX_WORKERS', 4)),
+        max_pending=int(os.getenv('MODEL_MAX_PENDING', 16)),
+        per_user=int(os.getenv('MODEL_PER_USER', 1))
+    )
+    app.config['MODEL_TIMEOUT'] = float(os.getenv('MODEL_TIMEOUT', 60))
+
+    # Deadlines, retries, circuit breaker, coalescing and per-user quotas around the pool
+    quota = None
+    if int(os.getenv('MODEL_USER_QUOTA', 60)) > 0:
+        quota = UserQuota(
+            os.getenv('MODEL_QUOTA_DB', 'diabeGuide/model_quota.db'),
+            limit=int(os.getenv('MODEL_USER_QUOTA', 60)),
+            window=int(os.getenv('MODEL_USER_QUOTA_WINDOW', 3600))
+        )
+    app.model_client = ModelClient(
+        app.model_pool,
+        timeout=app.config['MODEL_TIMEOUT'],
+        retries=int(os.getenv('MODEL_RETRIES', 2)),
+        backoff=float(os.getenv('MODEL_RETRY_BACKOFF', 0.5)),
+        breaker=CircuitBreaker(
+            threshold=int(os.getenv('MODEL_BREAKER_THRESHOLD', 5)),
+            reset_timeout=float(os.getenv('MODEL_BREAKER_RESET', 30))
+        ),
+        quota=quota
+    )
+
+    # Password hashing off the request thread, with per-account login throttling
+    app.password_hasher = PasswordHasher(
+        method=os.getenv('PASSWORD_HASH_METHOD', 'scrypt'),
+        max_workers=int(os.getenv('PASSWORD_HASH_WORKERS', 2)),
+        max_pending=int(os.getenv('PASSWORD_HASH_MAX_PENDING', 8))
+    )
+    app.login_throttle = LoginThrottle(
+        os.getenv('LOGIN_THROTTLE_DB', 'diabeGuide/login_throttle.db'),
+        max_attempts=int(os.getenv('LOGIN_MAX_ATTEMPTS', 10)),
+        max_attempts_per_ip=int(os.getenv('LOGIN_MAX_ATTEMPTS_PER_IP', 50)),
+        window=int(os.getenv('LOGIN_ATTEMPT_WINDOW', 300))
+    )
+
+    # Replies to repeated questions, shared by all workers through SQLite
+    app.response_cache = None
+    if os.getenv('CHAT_CACHE', '1') == '1':
+        app.response_cache = ResponseCache(
+            os.getenv('CHAT_CACHE_DB', 'diabeGuide/response_cache.db'),
+            ttl=int(os.getenv('CHAT_CACHE_TTL', 86400)),
+            max_entries=int(os.getenv('CHAT_CACHE_MAX_ENTRIES', 10000))
+        )
+
+    # Users' readings as NumPy arrays plus finished analytics reports
+    app.analytics_cache = AnalyticsCache(
+        max_readings=int(os.getenv('ANALYTICS_CACHE_READINGS', 2000000))
+    )
+
+    register_collector(lambda: runtime_stats(app))
 
     with app.app_context():
         # Import and register blueprints
@@ -34,6 +198,7 @@ def create_app():
         from .routes.profile import profile_bp # Import profile blueprint
         from .routes.welcome import welcome_bp # Import welcome blueprint
         from .routes.about import about_bp
+        from .routes.metrics import metrics_bp
 
         app.register_blueprint(dashboard_bp)
         app.register_blueprint(tracker_bp)
@@ -43,6 +208,7 @@ def create_app():
         app.register_blueprint(profile_bp) # Register profile blueprint
         app.register_blueprint(welcome_bp) # Register welcome blueprint
         app.register_blueprint(about_bp)
+        app.register_blueprint(metrics_bp)
 
         # Protect routes that require login
         @app.route('/')
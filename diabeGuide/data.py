@@ -1,124 +1,271 @@
 import json
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask_login import UserMixin
+import math
+import sys
+from dotenv import load_dotenv
 import os
+from .storage.atomic import atomic_write_json
+from .storage.chat_index import ChatIndex
+from .storage.chat_log import ChatLog
+from .storage.locks import FileLock
+from .storage.session_chat import SessionChatStore
+from .storage.tracker_arrays import TrackerArrays
+from .storage.tracker_log import TrackerLog
+from .storage.tracker_summary import TrackerSummary
+from .storage.users import USER_FIELDS, JsonUserRepository, create_user_repository
+from .utils.loader_cache import LoaderCache
+from .utils.metrics import timed
+
+load_dotenv()
 
 # Base directories for user-specific data
 USER_DATA_DIR = 'diabeGuide/user_data'
 USERS_FILE = 'diabeGuide/users.json'
+USERS_DB_FILE = os.getenv('USERS_DB_FILE', 'diabeGuide/users.db')
+# 'sqlite' (default) or 'json' for the original whole-file users.json store
+USER_STORE = os.getenv('USER_STORE', 'sqlite')
 
 # Ensure user data directory exists
 if not os.path.exists(USER_DATA_DIR):
     os.makedirs(USER_DATA_DIR)
 
 # --- User Management ---
-class User(UserMixin):
+def _blank_to_none(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+def _number(value):
+    """Profile numbers as int/float (None if blank or not a number)"""
+    value = _blank_to_none(value)
+    if value is None:
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    if math.isnan(number) or math.isinf(number):
+        return None
+    return int(number) if number.is_integer() else number
+
+class User:
+    """A cached account.
+
+    Slotted, so a worker holding many users pays for the fields only (no
+    per-instance __dict__). Profile fields are normalized when assigned and
+    the profile-complete flag is updated then too, instead of on every
+    request that checks it. Implements what Flask-Login expects of a user
+    directly, as UserMixin would bring a __dict__ back.
+    """
+
+    __slots__ = ('id', 'username', 'password_hash', '_email', 'email_verified',
+                 '_weight', '_height', '_age', '_diabetes_type', '_profile_complete')
+
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+
     def __init__(self, id, username, password_hash, email=None, weight=None, height=None, age=None, diabetes_type=None, email_verified=False):
-        self.id = id
+        self.id = str(id)
         self.username = username
         self.password_hash = password_hash
+        self._weight = _number(weight)
+        self._height = _number(height)
+        self._age = _number(age)
+        diabetes_type = _blank_to_none(diabetes_type)
+        # Only a handful of distinct values, so share one string per value
+        self._diabetes_type = sys.intern(diabetes_type) if diabetes_type else None
         self.email = email
-        self.weight = weight
-        self.height = height
-        self.age = age
-        self.diabetes_type = diabetes_type
-        self.email_verified = email_verified
+        self.email_verified = bool(email_verified)
+        self._update_profile_complete()
+
+    def _update_profile_complete(self):
+        self._profile_complete = None not in (self._weight, self._height, self._age, self._diabetes_type)
+
+    @property
+    def email(self):
+        return self._email
+
+    @email.setter
+    def email(self, value):
+        self._email = _blank_to_none(value)
+
+    @property
+    def weight(self):
+        return self._weight
+
+    @weight.setter
+    def weight(self, value):
+        self._weight = _number(value)
+        self._update_profile_complete()
+
+    @property
+    def height(self):
+        return self._height
+
+    @height.setter
+    def height(self, value):
+        self._height = _number(value)
+        self._update_profile_complete()
+
+    @property
+    def age(self):
+        return self._age
+
+    @age.setter
+    def age(self, value):
+        self._age = _number(value)
+        self._update_profile_complete()
+
+    @property
+    def diabetes_type(self):
+        return self._diabetes_type
+
+    @diabetes_type.setter
+    def diabetes_type(self, value):
+        value = _blank_to_none(value)
+        self._diabetes_type = sys.intern(value) if value else None
+        self._update_profile_complete()
 
     def get_id(self):
-        return str(self.id)
+        return self.id
+
+    def __eq__(self, other):
+        if isinstance(other, User):
+            return self.id == other.id
+        return NotImplemented
+
+    __hash__ = object.__hash__
 
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
-    
     def is_profile_complete(self):
         """Check if user profile is complete (has weight, height, age, and diabetes_type)"""
-        # Check if all required fields are filled (not None, not empty string)
-        weight_ok = self.weight is not None and str(self.weight).strip() != ''
-        height_ok = self.height is not None and str(self.height).strip() != ''
-        age_ok = self.age is not None and str(self.age).strip() != ''
-        diabetes_type_ok = self.diabetes_type is not None and str(self.diabetes_type).strip() != ''
-        
-        return weight_ok and height_ok and age_ok and diabetes_type_ok
-
-# In-memory storage for users for now
+        return self._profile_complete
+
+# Users that have been loaded in this worker, keyed by id. The repository is
+# the source of truth; this only saves a round trip for repeat lookups.
 users = {}
-next_user_id = 1
+# The same cached users by username and by lowercased email
+users_by_username = {}
+users_by_email = {}
+# Store version the cache was last synced to (see reload_users)
+users_version = None
+
+user_repository = create_user_repository(USER_STORE, USERS_FILE, USERS_DB_FILE)
+
+def _user_from_record(record):
+    return User(
+        record['id'],
+        record['username'],
+        record['password_hash'],
+        record.get('email'),
+        record.get('weight'),
+        record.get('height'),
+        record.get('age'),
+        record.get('diabetes_type'),
+        record.get('email_verified', False)
+    )
+
+def _user_to_record(user):
+    return {
+        'id': user.id,
+        'username': user.username,
+        'password_hash': user.password_hash,
+        'email': user.email,
+        'weight': user.weight,
+        'height': user.height,
+        'age': user.age,
+        'diabetes_type': user.diabetes_type,
+        'email_verified': user.email_verified
+    }
+
+def _email_key(email):
+    key = email.lower()
+    # Reuse the user's own string when it is already lowercase
+    return email if key == email else key
+
+def _index_user(user):
+    users[user.id] = user
+    users_by_username[user.username] = user
+    if user.email:
+        users_by_email[_email_key(user.email)] = user
+
+def _unindex_user(user):
+    users.pop(user.id, None)
+    if users_by_username.get(user.username) is user:
+        del users_by_username[user.username]
+    if user.email and users_by_email.get(_email_key(user.email)) is user:
+        del users_by_email[_email_key(user.email)]
+
+def _refresh_user(user, record):
+    """Patch a cached user in place, moving its index entries if needed"""
+    _unindex_user(user)
+    fresh = _user_from_record(record)
+    for field in USER_FIELDS:
+        setattr(user, field, getattr(fresh, field))
+    _index_user(user)
+
+def _cache_user(record):
+    if record is None:
+        return None
+    user = users.get(str(record['id']))
+    if user is None:
+        user = _user_from_record(record)
+        _index_user(user)
+    else:
+        _refresh_user(user, record)
+    return user
 
 def load_users():
-    global users, next_user_id
-    try:
-        with open(USERS_FILE, 'r') as f:
-            users_data = json.load(f)
-            users.clear()  # Clear existing users to avoid duplicates
-            for user_id, user_info in users_data.items():
-                # Handle None, empty string, or missing values
-                weight = user_info.get('weight')
-                height = user_info.get('height')
-                age = user_info.get('age')
-                diabetes_type = user_info.get('diabetes_type')
-                
-                # Convert empty strings to None
-                if weight == '':
-                    weight = None
-                if height == '':
-                    height = None
-                if age == '':
-                    age = None
-                if diabetes_type == '':
-                    diabetes_type = None
-                
-                email = user_info.get('email')
-                email_verified = user_info.get('email_verified', False)
-                if email == '':
-                    email = None
-                
-                users[user_id] = User(
-                    user_id,
-                    user_info['username'],
-                    user_info['password_hash'],
-                    email,
-                    weight,
-                    height,
-                    age,
-                    diabetes_type,
-                    email_verified
-                )
-            if users:
-                next_user_id = max([int(uid) for uid in users.keys()]) + 1
-    except (FileNotFoundError, json.JSONDecodeError):
-        users = {}
-        next_user_id = 1
+    """Reset the worker's user cache (the JSON store is read back in full)"""
+    global users_version
+    users.clear()
+    users_by_username.clear()
+    users_by_email.clear()
+    users_version = user_repository.version()
+    if isinstance(user_repository, JsonUserRepository):
+        for record in user_repository.load_all().values():
+            _cache_user(record)
 
 def save_users():
-    users_data = {}
-    for user in users.values():
-        users_data[user.id] = {
-            'username': user.username,
-            'password_hash': user.password_hash,
-            'email': user.email,
-            'weight': user.weight,
-            'height': user.height,
-            'age': user.age,
-            'diabetes_type': user.diabetes_type,
-            'email_verified': user.email_verified
-        }
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users_data, f, indent=4)
+    """Write every cached user back to the store"""
+    user_repository.update_many([_user_to_record(user) for user in users.values()])
+
+def save_user(user):
+    """Write a single user back to the store and re-index the cached copy.
+
+    The caller may have changed the username or email on the cached object
+    itself, so the index entries under the stored values are dropped first.
+    """
+    previous = user_repository.get(user.id)
+    record = _user_to_record(user)
+    user_repository.update(user.id, record)
+    if previous is not None:
+        if users_by_username.get(previous['username']) == user:
+            del users_by_username[previous['username']]
+        email = previous.get('email')
+        if email and users_by_email.get(_email_key(email)) == user:
+            del users_by_email[_email_key(email)]
+    _cache_user(record)
 
 def get_user_by_id(user_id):
-    return users.get(str(user_id))
+    user = users.get(str(user_id))
+    if user is None:
+        user = _cache_user(user_repository.get(user_id))
+    return user
 
 def get_user_by_username(username):
-    for user in users.values():
-        if user.username == username:
-            return user
-    return None
+    user = users_by_username.get(username)
+    if user is None:
+        user = _cache_user(user_repository.get_by_username(username))
+    return user
 
 def get_user_by_email(email):
-    for user in users.values():
-        if user.email and user.email.lower() == email.lower():
-            return user
-    return None
+    if not email:
+        return None
+    user = users_by_email.get(email.lower())
+    if user is None:
+        user = _cache_user(user_repository.get_by_email(email))
+    return user
 
 def get_user_by_username_or_email(identifier):
     """Get user by username or email"""
@@ -127,58 +274,198 @@ def get_user_by_username_or_email(identifier):
         user = get_user_by_email(identifier)
     return user
 
+@timed('reload_users')
 def reload_users():
-    """Reload users from file - call this when user data might have changed"""
-    load_users()
-
-def create_user(username, password_hash, email=None):
-    global next_user_id
-    if get_user_by_username(username):
-        return None # User already exists
-    if email and get_user_by_email(email):
-        return None # Email already exists
+    """Bring cached users up to date with writes made by other workers.
 
-    user = User(str(next_user_id), username, password_hash, email=email, email_verified=False)
-    users[user.id] = user
-    next_user_id += 1
-    save_users()
-    return user
+    Only a version check when nothing changed; otherwise just the changed
+    users are patched in place, so existing User objects stay valid.
+    """
+    global users_version
+    version, changed = user_repository.changes_since(users_version)
+    if changed is None:
+        load_users()
+        return
+    for record in changed:
+        user = users.get(str(record['id']))
+        if user is not None:
+            _refresh_user(user, record)
+    users_version = version
 
-# Load users when the module is imported
-load_users()
+def create_user(username, password_hash, email=None, email_verified=False):
+    record = {
+        'username': username,
+        'password_hash': password_hash,
+        'email': email,
+        'email_verified': email_verified
+    }
+    user_id = user_repository.insert(record)
+    if user_id is None:
+        return None # Username or email already exists
+    return _cache_user(dict(record, id=user_id))
 
 # --- User-specific Data Loading ---
+# Loader results memoized per request and, keyed on the data's version, per worker
+loader_cache = LoaderCache(
+    ttl=float(os.getenv('LOADER_CACHE_TTL', 30)),
+    max_entries=int(os.getenv('LOADER_CACHE_SIZE', 256))
+)
+# Larger full reads (readings or chat messages) are only kept for the request
+LOADER_CACHE_MAX_ITEMS = int(os.getenv('LOADER_CACHE_MAX_ITEMS', 5000))
+
+def user_lock(user_id):
+    """Advisory lock serializing one user's multi-file writes across workers.
+
+    Each user has their own lock file, so writes for different users never
+    wait on each other. Take it before any per-file log lock, never after.
+    """
+    return FileLock(os.path.join(USER_DATA_DIR, f'user_{user_id}.lock'))
+
 def get_user_tracker_data_file(user_id):
     return os.path.join(USER_DATA_DIR, f'tracker_data_{user_id}.json')
 
 def get_user_chat_history_file(user_id):
     return os.path.join(USER_DATA_DIR, f'chat_history_{user_id}.json')
 
-def load_user_data(user_id):
-    data_file = get_user_tracker_data_file(user_id)
+def get_user_tracker_log_file(user_id):
+    return os.path.join(USER_DATA_DIR, f'tracker_{user_id}.jsonl')
+
+def get_user_tracker_log(user_id):
+    """Return the user's append-only tracker log, seeding it from the old
+    tracker_data_{id}.json file the first time it is used"""
+    log = TrackerLog(get_user_tracker_log_file(user_id))
+    if not log.exists():
+        try:
+            with open(get_user_tracker_data_file(user_id), 'r') as f:
+                legacy_data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            legacy_data = None
+        if legacy_data:
+            log.import_legacy(legacy_data)
+    return log
+
+def tracker_version(user_id):
+    """The user's tracker log version, read once per request"""
+    return loader_cache.request_value(('tracker_version', str(user_id)), lambda: get_user_tracker_log(user_id).version())
+
+@timed('load_user_data')
+def load_user_data(user_id, months=None):
+    """Return {month_year: [entries]}, optionally only for the given months"""
+    key = ('tracker', str(user_id), None if months is None else tuple(sorted(months)))
+    return loader_cache.get(key, tracker_version(user_id), lambda: get_user_tracker_log(user_id).read(months),
+                            keep=lambda tracker_data: sum(map(len, tracker_data.values())) <= LOADER_CACHE_MAX_ITEMS)
+
+def get_user_tracker_summary(user_id):
+    path = os.path.join(USER_DATA_DIR, f'tracker_summary_{user_id}.db')
+    return TrackerSummary(path, get_user_tracker_log(user_id))
+
+def load_tracker_summary(user_id, days=None):
+    """The user's up-to-date tracker summary buckets, with the day buckets
+    between the (first, last) `days` bounds if asked for"""
+    version = tracker_version(user_id)
+    return loader_cache.get(('tracker_summary', str(user_id), days), version,
+                            lambda: get_user_tracker_summary(user_id).get(version, days))
+
+def get_user_tracker_arrays(user_id):
+    path = os.path.join(USER_DATA_DIR, f'tracker_arrays_{user_id}.npz')
+    return TrackerArrays(path, get_user_tracker_log(user_id))
+
+def append_user_data(user_id, month_year, entry):
+    """Log one reading without rewriting the user's history"""
+    with user_lock(user_id):
+        seq = get_user_tracker_log(user_id).append(month_year, entry)
+        get_user_tracker_summary(user_id).record(seq, month_year, entry)
+    loader_cache.forget(str(user_id))
+    return seq
+
+@timed('append_user_data_batch')
+def append_user_data_batch(user_id, readings, compact=True):
+    """Log a batch of (month_year, entry) readings with one append"""
+    with user_lock(user_id):
+        seq = get_user_tracker_log(user_id).append_many(readings, compact=compact)
+        if readings:
+            get_user_tracker_summary(user_id).record_many(seq, readings)
+    loader_cache.forget(str(user_id))
+    return seq
+
+def get_user_import_status_file(user_id):
+    return os.path.join(USER_DATA_DIR, f'tracker_import_{user_id}.json')
+
+def load_import_status(user_id):
     try:
-        with open(data_file, 'r') as f:
+        with open(get_user_import_status_file(user_id), 'r') as f:
             return json.load(f)
     except (FileNotFoundError, json.JSONDecodeError):
-        return {}
+        return None
+
+def save_import_status(user_id, status):
+    """Progress of the user's latest bulk import, readable from any worker"""
+    atomic_write_json(get_user_import_status_file(user_id), status, fsync=False)
 
+@timed('save_user_data')
 def save_user_data(user_id, data):
-    data_file = get_user_tracker_data_file(user_id)
-    with open(data_file, 'w') as f:
-        json.dump(data, f, indent=4)
+    with user_lock(user_id):
+        get_user_tracker_log(user_id).replace(data)
+    loader_cache.forget(str(user_id))
+
+def get_user_chat_log(user_id):
+    """Return the user's append-only chat archive, seeding it from the old
+    chat_history_{id}.json file the first time it is used"""
+    log = ChatLog(os.path.join(USER_DATA_DIR, f'chat_{user_id}.jsonl'))
+    if not log.exists():
+        try:
+            with open(get_user_chat_history_file(user_id), 'r') as f:
+                legacy_history = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            legacy_history = None
+        if legacy_history:
+            log.import_legacy(legacy_history)
+    return log
 
 def load_user_archived_chat_history(user_id):
-    chat_file = get_user_chat_history_file(user_id)
-    try:
-        with open(chat_file, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
+    log = get_user_chat_log(user_id)
+    version = loader_cache.request_value(('chat_version', str(user_id)), log.version)
+    return loader_cache.get(('chat_history', str(user_id)), version, log.read,
+                            keep=lambda history: len(history) <= LOADER_CACHE_MAX_ITEMS)
+
+def append_user_archived_chat_history(user_id, messages):
+    """Add messages to the archive without rewriting it"""
+    log = get_user_chat_log(user_id)
+    count = log.append(messages)
+    loader_cache.forget(str(user_id))
+    # Keep an existing search index current; a missing one is built on first search
+    index = get_user_chat_index(user_id)
+    if index.exists():
+        index.sync(log)
+    return count
 
 def save_user_archived_chat_history(user_id, history):
-    chat_file = get_user_chat_history_file(user_id)
-    with open(chat_file, 'w') as f:
-        json.dump(history, f, indent=4)
+    with user_lock(user_id):
+        get_user_chat_log(user_id).replace(history)
+        get_user_chat_index(user_id).clear()
+    loader_cache.forget(str(user_id))
+
+def get_user_chat_index(user_id):
+    return ChatIndex(os.path.join(USER_DATA_DIR, f'chat_index_{user_id}.db'))
+
+def search_user_chat_history(user_id, query, limit=20, offset=0):
+    """(results, total) for a full-text search of the user's chat archive"""
+    index = get_user_chat_index(user_id)
+    index.sync(get_user_chat_log(user_id))
+    return index.search(query, limit, offset)
+
+# --- Current session chat (shared by all workers, cleared on logout) ---
+session_chat = SessionChatStore(
+    os.getenv('SESSION_CHAT_DB', 'diabeGuide/session_chat.db'),
+    max_messages=int(os.getenv('SESSION_CHAT_MAX_MESSAGES', 100)),
+    idle_ttl=int(os.getenv('SESSION_CHAT_IDLE_TTL', 12 * 3600))
+)
+
+def get_current_session_chat(user_id):
+    return session_chat.get(user_id)
+
+def append_current_session_chat(user_id, messages):
+    session_chat.append(user_id, messages)
 
-# Global variables for current session chat (will be cleared on logout)
-current_session_chat = {}
+def clear_current_session_chat(user_id):
+    session_chat.clear(user_id)
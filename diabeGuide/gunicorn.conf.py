@@ -1,7 +1,44 @@
 # gunicorn.conf.py
 import multiprocessing
+import os
 
 bind = "0.0.0.0:5000"
 workers = multiprocessing.cpu_count() * 2 + 1
 accesslog = '-'
 errorlog = '-'
+
+# Worker model: 'sync' (default), 'gthread' or 'gevent'. Chat requests spend
+# seconds waiting on Gemini; with 'gthread' or 'gevent' that wait no longer
+# holds a whole process, so logins and tracker writes keep flowing.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+if worker_class == 'gthread':
+    threads = int(os.getenv('GUNICORN_THREADS', 8))
+elif worker_class == 'gevent':
+    worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 100))
+
+# GUNICORN_PRELOAD=1 imports the app, the Gemini SDK and the user cache once
+# in the master; workers inherit them on fork instead of each loading their
+# own. Not used with gevent, whose monkey-patching has to happen before the
+# app is imported.
+preload_app = os.getenv('GUNICORN_PRELOAD', '0') == '1' and worker_class != 'gevent'
+if preload_app:
+    os.environ.setdefault('APP_DEFER_IMPORTS', '0')
+
+# Streamed chat replies can outlast the 30s default
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+
+def post_worker_init(worker):
+    if worker_class == 'gevent':
+        # Let grpc (used by the Gemini SDK) cooperate with gevent's event loop.
+        # Runs after GeventWorker.init_process() has monkey-patched the stdlib,
+        # which grpc requires.
+        from grpc.experimental import gevent as grpc_gevent
+        grpc_gevent.init_gevent()
+    # Deliver mail left in the outbox by a previous run without waiting for new mail
+    from diabeGuide.utils.email_utils import resume_mail_sender
+    resume_mail_sender()
+
+def worker_exit(server, worker):
+    # Drop the worker's metrics snapshot so /metrics stops adding in its counters
+    from diabeGuide.utils.metrics import remove_worker_file
+    remove_worker_file(worker.pid)
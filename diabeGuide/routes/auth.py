@@ -1,6 +1,6 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, session, jsonify
 from flask_login import login_user, logout_user, login_required, current_user
-from ..data import get_user_by_username, create_user, get_user_by_id, reload_users, get_user_by_email, get_user_by_username_or_email
+from ..data import get_user_by_username, create_user, get_user_by_id, get_user_by_email, get_user_by_username_or_email, clear_current_session_chat
 from ..utils.email_utils import generate_otp, send_otp_email
 import re
 from datetime import datetime, timedelta
@@ -17,10 +17,10 @@ def is_valid_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
 
-from flask import Blueprint, render_template, redirect, url_for, flash, request, session, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, session, jsonify, current_app
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash
-from ..data import get_user_by_username, create_user, get_user_by_id, reload_users, get_user_by_email, get_user_by_username_or_email
+from ..data import get_user_by_username, create_user, get_user_by_id, get_user_by_email, get_user_by_username_or_email, clear_current_session_chat, save_user
+from ..utils.passwords import HashingBusy
 from ..utils.email_utils import generate_otp, send_otp_email
 import re
 from datetime import datetime, timedelta
@@ -53,8 +53,6 @@ def signup():
                 return render_template('signup.html', email=email, username=username, show_otp=True)
             
             if entered_otp == stored_otp:
-                reload_users()
-                
                 # Final check for username/email existence
                 if get_user_by_username(username):
                     flash('That username has just been taken. Please choose another.', 'danger')
@@ -64,12 +62,8 @@ def signup():
                     return render_template('signup.html', username=username, show_otp=False)
                 
                 # Create user with pre-hashed password
-                new_user = create_user(username, password_hash, email=email)
+                new_user = create_user(username, password_hash, email=email, email_verified=True)
                 if new_user:
-                    new_user.email_verified = True
-                    from ..data import save_users
-                    save_users()
-                    
                     # Log in the new user
                     login_user(new_user, remember=True)
                     session.clear()
@@ -99,7 +93,6 @@ def signup():
                 flash('Please enter a valid email address.', 'danger')
                 return render_template('signup.html', username=username, email=email, show_otp=False)
             
-            reload_users()
             if get_user_by_username(username):
                 flash('Username already exists.', 'danger')
                 return render_template('signup.html', email=email, show_otp=False)
@@ -108,7 +101,11 @@ def signup():
                 return render_template('signup.html', username=username, show_otp=False)
             
             # Hash password before storing in session
-            password_hash = generate_password_hash(password)
+            try:
+                password_hash = current_app.password_hasher.hash(password)
+            except HashingBusy as e:
+                flash(str(e), 'danger')
+                return render_template('signup.html', username=username, email=email, show_otp=False), 503, {'Retry-After': str(e.retry_after)}
             
             otp = generate_otp()
             if send_otp_email(email, otp):
@@ -153,13 +150,31 @@ def login():
         identifier = request.form.get('username_or_email')  # Changed field name
         password = request.form.get('password')
 
-        # Reload users to get latest data
-        reload_users()
-        
+        # Turn away bursts against an account before paying for a hash
+        wait = current_app.login_throttle.hit(identifier, request.remote_addr)
+        if wait:
+            flash(f'Too many login attempts. Please try again in {max(1, wait // 60)} minute(s).', 'danger')
+            return render_template('login.html'), 429, {'Retry-After': str(wait)}
+
         # Try to get user by username or email
         user = get_user_by_username_or_email(identifier)
-        
-        if user and user.check_password(password):
+        hasher = current_app.password_hasher
+
+        try:
+            valid = bool(user and password and hasher.verify(user.password_hash, password))
+        except HashingBusy as e:
+            flash(str(e), 'danger')
+            return render_template('login.html'), 503, {'Retry-After': str(e.retry_after)}
+
+        if valid:
+            current_app.login_throttle.reset(identifier)
+            # Upgrade hashes made with an older algorithm or cost
+            if hasher.needs_rehash(user.password_hash):
+                try:
+                    user.password_hash = hasher.hash(password)
+                    save_user(user)
+                except HashingBusy:
+                    pass  # try again next login
             login_user(user, remember=True)
             flash('Logged in successfully!', 'success')
             
@@ -179,6 +194,7 @@ def login():
 @auth_bp.route('/logout')
 @login_required
 def logout():
+    clear_current_session_chat(current_user.id)
     logout_user()
     flash('You have been logged out.', 'info')
     return redirect(url_for('auth.login'))
@@ -1,39 +1,56 @@
-from flask import Blueprint, request, jsonify, render_template, current_app
+from flask import Blueprint, request, jsonify, render_template, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
-from google.api_core import exceptions as google_exceptions
+import json
+import logging
 import re
+import time
 from .. import data
+from ..utils.chat_context import build_tracker_context
+from ..utils.model_loader import cancel_stream, is_permission_denied
+from ..utils.metrics import PHASE_SECONDS
+from ..utils.model_pool import ModelBusy
+from ..utils.profile_utils import age_band
+from ..utils.response_cache import cache_key, is_generic
 
 chatbot_bp = Blueprint('chatbot', __name__)
+logger = logging.getLogger(__name__)
 
-# current_session_chat will now be a dictionary keyed by user_id
-# This ensures each user has their own temporary chat history
-# It will be cleared on logout or browser close
-data.current_session_chat = {}
+HISTORY_PAGE_LIMIT = 50
+MAX_HISTORY_PAGE_LIMIT = 200
+SEARCH_PAGE_LIMIT = 20
+MAX_SEARCH_PAGE_LIMIT = 100
 
 @chatbot_bp.route('/chatbot')
 @login_required
 def chatbot():
-    return render_template("chatbot.html")
+    # The open conversation goes in the page, so chatbot.js needn't fetch it
+    bootstrap = {'current_session': data.get_current_session_chat(current_user.id)}
+    return render_template("chatbot.html", bootstrap=bootstrap)
 
-@chatbot_bp.route('/api/chat', methods=['POST'])
-@login_required
-def chat():
-    req_data = request.get_json()
-    user_message = req_data.get('message')
-    print(f"Received message: {user_message}")
-    if not user_message:
-        return jsonify({'error': 'No message provided'}), 400
+def prompt_inputs(user, user_message):
+    """The user-specific parts of the prompt (profile line and tracker
+    context) and the response cache key.
 
-    try:
-        # Get user-specific tracker data
-        user_tracker_data = data.load_user_data(current_user.id)
-        context = "\n".join([f"{month_year}: {entries}" for month_year, entries in user_tracker_data.items()])
+    Generic questions only get the coarse profile - diabetes type and age
+    band - and no tracker data, so one cached reply serves everyone with
+    that profile. Anything else is answered from the user's own data and
+    cached per user and per data version.
+    """
+    if is_generic(user_message):
+        user_profile = f"User Profile: Diabetes Type={user.diabetes_type}, Age Group={age_band(user.age)}"
+        context = "Not needed for this general question."
+        return user_profile, context, cache_key(user_message, user_profile)
+
+    # Get user profile information
+    user_profile = f"User Profile: Weight={user.weight}, Height={user.height}, Age={user.age}, Diabetes Type={user.diabetes_type}"
 
-        # Get user profile information
-        user_profile = f"User Profile: Weight={current_user.weight}, Height={current_user.height}, Age={current_user.age}, Diabetes Type={current_user.diabetes_type}"
+    # Summarized, token-budgeted view of the user's tracker data
+    context = build_tracker_context(user.id)
+    return user_profile, context, cache_key(user_message, user_profile, context)
 
-        prompt = f"""You are DiabeGuide, a friendly and knowledgeable assistant for diabetes management.
+def build_prompt(user_profile, context, user_message):
+    """Assemble the Gemini prompt from the user's profile and tracker data"""
+    return f"""You are DiabeGuide, a friendly and knowledgeable assistant for diabetes management.
         Your goal is to provide comprehensive, helpful, and encouraging advice to users.
         Do not mention that you are an AI model.
         Provide detailed and actionable suggestions based on the user's message, their tracker data, and their profile information.
@@ -45,47 +62,223 @@ def chat():
         Tracker data:
         {context}
         """
-        print(f"Generated prompt: {prompt}")
 
-        response = current_app.model.generate_content(prompt)
-        print(f"Received response from Gemini: {response.text}")
+def record_turn(user_id, user_message, reply):
+    """Save a question/answer pair to the current session and the archive"""
+    # Save user and bot messages to current session chat and archived chat history
+    turn = [{'role': 'user', 'message': user_message}, {'role': 'bot', 'message': reply}]
+    data.append_current_session_chat(user_id, turn)
+    data.append_user_archived_chat_history(user_id, turn)
 
-        # Get user-specific archived chat history
-        user_archived_chat_history = data.load_user_archived_chat_history(current_user.id)
+def error_message(e):
+    if is_permission_denied(e):
+        return 'Invalid API key. Please check your API key and make sure it is enabled for the Gemini API.'
+    return str(e)
+
+def busy_response(e):
+    return jsonify({'error': str(e)}), e.status, {'Retry-After': str(e.retry_after)}
+
+@chatbot_bp.route('/api/chat', methods=['POST'])
+@login_required
+def chat():
+    req_data = request.get_json()
+    user_message = req_data.get('message')
+    logger.debug("Received message: %s", user_message)
+    if not user_message:
+        return jsonify({'error': 'No message provided'}), 400
+
+    try:
+        user_profile, context, key = prompt_inputs(current_user, user_message)
+        cache = current_app.response_cache
+        reply = cache.get(key) if cache else None
+
+        if reply is None:
+            prompt = build_prompt(user_profile, context, user_message)
+            logger.debug("Generated prompt: %s", prompt)
+
+            with PHASE_SECONDS.time(phase='model_call'):
+                response = current_app.model_client.generate(current_user.id, current_app.model, prompt)
+            reply = response.text
+            logger.debug("Received response from Gemini: %s", reply)
+            if cache:
+                cache.put(key, reply)
+
+        record_turn(current_user.id, user_message, reply)
 
-        # Initialize current session chat for the user if it doesn't exist
-        if current_user.id not in data.current_session_chat:
-            data.current_session_chat[current_user.id] = []
-
-        # Save user and bot messages to current session chat and archived chat history
-        data.current_session_chat[current_user.id].append({'role': 'user', 'message': user_message})
-        data.current_session_chat[current_user.id].append({'role': 'bot', 'message': response.text})
-        user_archived_chat_history.append({'role': 'user', 'message': user_message})
-        user_archived_chat_history.append({'role': 'bot', 'message': response.text})
-        data.save_user_archived_chat_history(current_user.id, user_archived_chat_history)
-
-        return jsonify({'reply': response.text})
-    except google_exceptions.PermissionDenied as e:
-        print(f"A permission error occurred: {e}")
-        return jsonify({'error': 'Invalid API key. Please check your API key and make sure it is enabled for the Gemini API.'}), 500
+        return jsonify({'reply': reply})
+    except ModelBusy as e:
+        return busy_response(e)
+    except TimeoutError:
+        return jsonify({'error': 'The assistant took too long to reply. Please try again.'}), 504
     except Exception as e:
-        print(f"An error occurred: {e}")
-        return jsonify({'error': str(e)}), 500
+        if is_permission_denied(e):
+            logger.error("A permission error occurred: %s", e)
+        else:
+            logger.exception("An error occurred: %s", e)
+        return jsonify({'error': error_message(e)}), 500
+
+def sse(payload, event=None):
+    """Format one Server-Sent Events message"""
+    message = f"data: {json.dumps(payload)}\n\n"
+    return f"event: {event}\n{message}" if event else message
+
+@chatbot_bp.route('/api/chat/stream', methods=['POST'])
+@login_required
+def chat_stream():
+    """Like /api/chat, but forwards Gemini's reply chunk by chunk over SSE.
+
+    When the browser aborts the request the generator is closed and the
+    upstream call is cancelled, so Gemini stops generating and its
+    connection is released; whatever was generated so far is kept.
+    """
+    req_data = request.get_json()
+    user_message = req_data.get('message')
+    if not user_message:
+        return jsonify({'error': 'No message provided'}), 400
+
+    user_id = current_user.id
+    user_profile, context, key = prompt_inputs(current_user, user_message)
+    cache = current_app.response_cache
+    cached_reply = cache.get(key) if cache else None
+    if cached_reply is not None:
+        record_turn(user_id, user_message, cached_reply)
+        response = Response(sse({'text': cached_reply}) + sse({}, event='done'), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    prompt = build_prompt(user_profile, context, user_message)
+    model = current_app.model
+    pool = current_app.model_pool
+    client = current_app.model_client
+    try:
+        # Streams run in the request thread but still count against the
+        # quota, the circuit breaker and the pool's limits. They are not
+        # retried: part of the reply may already be on screen.
+        pool.acquire(user_id)
+    except ModelBusy as e:
+        return busy_response(e)
+    try:
+        client.admit(user_id)
+    except ModelBusy as e:
+        pool.release(user_id)
+        return busy_response(e)
+    deadline = time.monotonic() + client.timeout
+
+    released, recorded = [], []
+    def record(error=None):
+        recorded.append(True)
+        client.record(error)
+
+    def release():
+        # Called when the stream ends and again when the response is closed
+        # (which also covers clients that disconnect before it starts)
+        if not released:
+            released.append(True)
+            pool.release(user_id)
+            if not recorded:
+                # Admitted but never reported back: free the circuit-breaker
+                # trial slot it may hold (once reported, the slot is settled
+                # and may belong to another call by now)
+                client.release()
+
+    def generate():
+        chunks = []
+        stream = None
+        start = time.perf_counter()
+        try:
+            stream = model.generate_content(prompt, stream=True, request_options=client.request_options(deadline))
+            for chunk in stream:
+                if chunk.text:
+                    if not chunks:
+                        PHASE_SECONDS.observe(time.perf_counter() - start, phase='model_first_chunk')
+                    chunks.append(chunk.text)
+                    yield sse({'text': chunk.text})
+            # Only complete replies are worth serving to the next asker
+            if cache and chunks:
+                cache.put(key, ''.join(chunks))
+            record()
+            yield sse({}, event='done')
+        except GeneratorExit:
+            logger.info("Chat stream for user %s cancelled by the client", user_id)
+            if stream is not None:
+                cancel_stream(stream)
+            if chunks and not recorded:
+                # The upstream was answering; the client just left
+                record()
+            raise
+        except Exception as e:
+            record(e)
+            logger.exception("An error occurred: %s", e)
+            yield sse({'error': error_message(e)}, event='error')
+        finally:
+            # Finished or cancelled by now; drop our reference to the response
+            stream = None
+            PHASE_SECONDS.observe(time.perf_counter() - start, phase='model_stream')
+            release()
+            if chunks:
+                record_turn(user_id, user_message, ''.join(chunks))
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.call_on_close(release)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@chatbot_bp.route('/api/chat/cache/stats', methods=['GET'])
+@login_required
+def chat_cache_stats():
+    cache = current_app.response_cache
+    return jsonify(cache.stats() if cache else {'enabled': False})
 
 @chatbot_bp.route('/api/chat/history', methods=['GET'])
 @login_required
 def get_archived_chat_history():
-    user_archived_chat_history = data.load_user_archived_chat_history(current_user.id)
-    return jsonify(user_archived_chat_history)
+    if 'before' not in request.args and 'limit' not in request.args:
+        user_archived_chat_history = data.load_user_archived_chat_history(current_user.id)
+        return jsonify(user_archived_chat_history)
+
+    # Paginated: newest `limit` messages before position `before`
+    try:
+        before = int(request.args['before']) if 'before' in request.args else None
+        limit = max(1, min(int(request.args.get('limit', HISTORY_PAGE_LIMIT)), MAX_HISTORY_PAGE_LIMIT))
+    except ValueError:
+        return jsonify({'error': 'before and limit must be whole numbers'}), 400
+    log = data.get_user_chat_log(current_user.id)
+    messages, start = log.page(before, limit)
+    return jsonify({
+        'messages': [dict(message, id=start + i) for i, message in enumerate(messages)],
+        'before': start if start > 0 else None,
+        'total': log.count()
+    })
+
+@chatbot_bp.route('/api/chat/search', methods=['GET'])
+@login_required
+def search_chat_history():
+    """Ranked full-text search of the archive: ?q=words (word* for a prefix),
+    paginated with ?limit=&offset="""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing search query'}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', SEARCH_PAGE_LIMIT)), MAX_SEARCH_PAGE_LIMIT))
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be whole numbers'}), 400
+    results, total = data.search_user_chat_history(current_user.id, query, limit, offset)
+    return jsonify({
+        'query': query,
+        'results': results,
+        'total': total,
+        'next_offset': offset + limit if offset + limit < total else None
+    })
 
 @chatbot_bp.route('/api/chat/current_session', methods=['GET'])
 @login_required
 def get_current_session_chat():
-    return jsonify(data.current_session_chat.get(current_user.id, []))
+    return jsonify(data.get_current_session_chat(current_user.id))
 
 @chatbot_bp.route('/api/chat/current_session', methods=['DELETE'])
 @login_required
 def clear_current_session_chat():
-    if current_user.id in data.current_session_chat:
-        data.current_session_chat[current_user.id].clear()
+    data.clear_current_session_chat(current_user.id)
     return jsonify({'success': True})
@@ -1,6 +1,9 @@
-from flask import Blueprint, jsonify, render_template
+from flask import Blueprint, jsonify, render_template, request, Response
 from flask_login import login_required, current_user
 from .. import data
+from ..utils.export import EXPORT_FORMATS, export_stream
+from ..utils.http_utils import make_etag, not_modified
+from .tracker import requested_months, summary_payload
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
@@ -11,13 +14,41 @@ def dashboard():
     if not current_user.is_profile_complete():
         from flask import redirect, url_for
         return redirect(url_for('welcome.welcome'))
-    # Pass user-specific tracker data to the dashboard template
-    user_tracker_data = data.load_user_data(current_user.id)
-    return render_template("dashboard.html", tracker_data=user_tracker_data)
+    # The chart's data goes in the page, so dashboard.js needn't fetch it
+    bootstrap = {'tracker_summary': summary_payload(current_user.id)}
+    return render_template("dashboard.html", bootstrap=bootstrap)
 
 @dashboard_bp.route('/api/download')
 @login_required
 def download_data():
-    # Return user-specific tracker data
-    user_tracker_data = data.load_user_data(current_user.id)
-    return jsonify(user_tracker_data)
+    """Stream the user's tracker data, optionally limited with ?from=&to=.
+
+    ?format=json (default, {month_year: [entries]}), ndjson or csv;
+    ?compress=gzip for a .gz file; ?download=1 to save it as a file.
+    Rows are written as they are read, so memory use doesn't grow with
+    the size of the history.
+    """
+    fmt = request.args.get('format', 'json')
+    compress = request.args.get('compress') == 'gzip'
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+
+    log = data.get_user_tracker_log(current_user.id)
+    etag = make_etag(current_user.id, data.tracker_version(current_user.id))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    try:
+        months = requested_months(log)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    if compress:
+        mimetype, extension = 'application/gzip', extension + '.gz'
+    response = Response(export_stream(log, months, fmt, compress), mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    if request.args.get('download') == '1' or compress:
+        response.headers['Content-Disposition'] = f'attachment; filename="diabeguide_data.{extension}"'
+    return response
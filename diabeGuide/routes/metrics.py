@@ -0,0 +1,25 @@
+import hmac
+import os
+from flask import Blueprint, Response, request
+from ..utils.metrics import render
+
+metrics_bp = Blueprint('metrics', __name__)
+
+# Bearer token for scrapers. Without one, /metrics only answers requests
+# made directly from this machine (not through a proxy)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+LOOPBACK = ('127.0.0.1', '::1')
+
+def is_local_request():
+    forwarded = any(header in request.headers for header in ('X-Forwarded-For', 'X-Real-IP', 'Forwarded'))
+    return request.remote_addr in LOOPBACK and not forwarded
+
+@metrics_bp.route('/metrics')
+def metrics():
+    if METRICS_TOKEN:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not hmac.compare_digest(supplied, METRICS_TOKEN):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    elif not is_local_request():
+        return Response('Forbidden: set METRICS_TOKEN to scrape remotely\n', status=403, mimetype='text/plain')
+    return Response(render(), mimetype='text/plain; version=0.0.4')
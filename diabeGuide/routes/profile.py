@@ -1,6 +1,6 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
-from ..data import save_users, users
+from ..data import save_user
 
 profile_bp = Blueprint('profile', __name__)
 
@@ -12,7 +12,8 @@ def profile():
         current_user.height = request.form.get('height')
         current_user.age = request.form.get('age')
         current_user.diabetes_type = request.form.get('diabetes_type')
-        save_users() # Save updated user data
+        # The real User, not the LocalProxy, so the cached copy is updated in place
+        save_user(current_user._get_current_object()) # Save updated user data
         
         # If profile was incomplete and is now complete, redirect to dashboard
         if current_user.is_profile_complete():
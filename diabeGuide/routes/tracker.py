@@ -1,13 +1,84 @@
-from flask import Blueprint, request, jsonify, render_template
+import io
+import itertools
+import json
+import os
+from datetime import datetime
+from flask import Blueprint, current_app, request, jsonify, render_template, Response, stream_with_context
 from flask_login import login_required, current_user
 from .. import data
+from ..utils.http_utils import make_etag, not_modified, cacheable_json
+from ..storage.tracker_summary import describe
+from ..utils.tracker_import import import_readings, open_rows
+from ..utils.tracker_utils import day_bounds, month_key, months_in_range
 
 tracker_bp = Blueprint('tracker', __name__)
 
+PAGE_LIMIT = 200
+MAX_PAGE_LIMIT = 1000
+# Readings embedded in the tracker page (tracker.js asks for pages of this size)
+BOOTSTRAP_PAGE_LIMIT = 1000
+
+def requested_months(log):
+    """Months selected by ?from=&to=, or None when no range was asked for"""
+    start = request.args.get('from')
+    end = request.args.get('to')
+    if not start and not end:
+        return None
+    return months_in_range(log.months(), start, end)
+
+def page_args():
+    """(after, limit) from ?after=/?since=/?limit="""
+    try:
+        after = int(request.args.get('since', request.args.get('after', 0)))
+        limit = max(1, min(int(request.args.get('limit', PAGE_LIMIT)), MAX_PAGE_LIMIT))
+    except ValueError:
+        raise ValueError('after, since and limit must be whole numbers')
+    return after, limit
+
+def tracker_page(log, months, version, after=0, limit=PAGE_LIMIT, since=False):
+    """One page of readings in log order after sequence number `after`"""
+    records = list(itertools.islice(log.ordered_records(months, after), limit + 1))
+    page = {
+        'entries': records[:limit],
+        'next_cursor': records[limit - 1]['seq'] if len(records) > limit else None,
+        'version': version
+    }
+    if since:
+        # The log was cleared or rewritten after the client's copy - start over
+        page['reset'] = after < log.header()['reset']
+    return page
+
+def summary_payload(user_id, start=None, end=None):
+    """Per-month and per-day stats between months `start` and `end`, as
+    served by /api/tracker/summary (raises ValueError for a bad month)"""
+    user_id = str(user_id)
+    version = data.tracker_version(user_id)
+
+    def build():
+        summary = data.load_tracker_summary(user_id, day_bounds(start, end))
+        months = months_in_range(summary['months'], start, end)
+        month_keys = {month_key(month_year) for month_year in months}
+        return {
+            'version': summary['version'],
+            'months': [
+                dict(describe(summary['months'][month_year]), month=month_year)
+                for month_year in sorted(months, key=month_key)
+            ],
+            'days': [
+                dict(describe(bucket), day=day)
+                for day, bucket in sorted(summary['days'].items())
+                if month_key(day[:7]) in month_keys
+            ]
+        }
+    return data.loader_cache.get(('tracker_summary_payload', user_id, start, end), version, build)
+
 @tracker_bp.route('/tracker')
 @login_required
 def tracker():
-    return render_template("tracker.html")
+    # First page of the log, so tracker.js can render without fetching it
+    log = data.get_user_tracker_log(current_user.id)
+    page = tracker_page(log, None, data.tracker_version(current_user.id), 0, BOOTSTRAP_PAGE_LIMIT, since=True)
+    return render_template("tracker.html", bootstrap={'tracker_page': page})
 
 @tracker_bp.route('/api/tracker', methods=['GET', 'POST'])
 @login_required
@@ -22,19 +93,78 @@ def handle_tracker_data():
         if not all([sugar_level, note, month, year]):
             return jsonify({'error': 'Missing data'}), 400
 
-        user_tracker_data = data.load_user_data(current_user.id)
         month_year = f"{month}-{year}"
+        entry = {'sugar_level': sugar_level, 'note': note}
+        # Readings logged for the current month are stamped so they also show
+        # up in the per-day summary; clients may send their own timestamp
+        now = datetime.now()
+        timestamp = req_data.get('timestamp')
+        if timestamp:
+            try:
+                entry['timestamp'] = datetime.fromisoformat(timestamp).isoformat(timespec='seconds')
+            except (TypeError, ValueError):
+                return jsonify({'error': 'Invalid timestamp'}), 400
+        elif month_key(month_year) == (now.year, now.month):
+            entry['timestamp'] = now.isoformat(timespec='seconds')
 
-        if month_year not in user_tracker_data:
-            user_tracker_data[month_year] = []
+        seq = data.append_user_data(current_user.id, month_year, entry)
 
-        user_tracker_data[month_year].append({'sugar_level': sugar_level, 'note': note})
-        data.save_user_data(current_user.id, user_tracker_data)
-
-        return jsonify({'success': True, 'data': user_tracker_data})
+        return jsonify({'success': True, 'month_year': month_year, 'entry': entry, 'seq': seq})
     else: # GET request
-        user_tracker_data = data.load_user_data(current_user.id)
-        return jsonify(user_tracker_data)
+        log = data.get_user_tracker_log(current_user.id)
+        version = data.tracker_version(current_user.id)
+        etag = make_etag(current_user.id, version)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+        try:
+            months = requested_months(log)
+            if any(arg in request.args for arg in ('after', 'since', 'limit')):
+                after, limit = page_args()
+                page = tracker_page(log, months, version, after, limit, since='since' in request.args)
+                return cacheable_json(page, etag)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return cacheable_json(data.load_user_data(current_user.id, months), etag)
+
+@tracker_bp.route('/api/tracker/summary')
+@login_required
+def tracker_summary():
+    """Per-month and per-day aggregates for the dashboard chart"""
+    etag = make_etag(current_user.id, data.tracker_version(current_user.id))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    try:
+        payload = summary_payload(current_user.id, request.args.get('from'), request.args.get('to'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return cacheable_json(payload, etag)
+
+@tracker_bp.route('/api/tracker/analytics')
+@login_required
+def tracker_analytics():
+    """Variability, time-in-range bands, hypo/hyper episodes, rolling means
+    and weekly trends for ?from=&to= (YYYY-MM-DD) or the last ?days=N"""
+    etag = make_etag(current_user.id, data.tracker_version(current_user.id))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    try:
+        days = int(request.args['days']) if request.args.get('days') else None
+    except ValueError:
+        return jsonify({'error': 'days must be a whole number'}), 400
+    try:
+        report = current_app.analytics_cache.report(
+            current_user.id, data.get_user_tracker_arrays(current_user.id),
+            request.args.get('from'), request.args.get('to'), days
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return cacheable_json(report, etag)
 
 @tracker_bp.route('/api/tracker/clear', methods=['POST'])
 @login_required
@@ -42,3 +172,59 @@ def clear_tracker_data():
     user_tracker_data = {} # Clear data by setting to empty dict
     data.save_user_data(current_user.id, user_tracker_data)
     return jsonify({'success': True})
+
+def upload_format(upload):
+    """'csv' or 'ndjson' from ?format=, the content type or the file name; None to sniff"""
+    fmt = request.args.get('format', '').lower()
+    if fmt in ('csv', 'ndjson', 'jsonl'):
+        return 'csv' if fmt == 'csv' else 'ndjson'
+    mimetype = upload.mimetype if upload else request.mimetype
+    if 'csv' in mimetype:
+        return 'csv'
+    if 'json' in mimetype:
+        return 'ndjson'
+    extension = os.path.splitext(upload.filename or '')[1].lower() if upload else ''
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    return None
+
+@tracker_bp.route('/api/tracker/import', methods=['POST'])
+@login_required
+def import_tracker_data():
+    """Bulk-import readings from a CSV or NDJSON upload (raw body or a
+    multipart 'file' field). The body is parsed as it streams in; the
+    response is NDJSON with one progress line per committed batch and the
+    final report last."""
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+    if request.mimetype == 'multipart/form-data' and upload is None:
+        return jsonify({'error': "Upload the export as the 'file' field"}), 400
+    stream = request.stream
+    if upload:
+        # Flask closes uploaded files when the view returns, before the
+        # streamed response has read them - keep the file for ourselves
+        stream, upload.stream = upload.stream, io.BytesIO()
+    try:
+        rows = open_rows(stream, upload_format(upload))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    user_id = current_user.id
+    def generate():
+        try:
+            for progress in import_readings(user_id, rows):
+                yield json.dumps(progress) + '\n'
+        finally:
+            if upload:
+                stream.close()
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@tracker_bp.route('/api/tracker/import', methods=['GET'])
+@login_required
+def import_status():
+    """Progress of the latest bulk import, e.g. for polling from another tab"""
+    return jsonify(data.load_import_status(current_user.id) or {'state': 'none'})
@@ -1,6 +1,8 @@
 from .app import create_app
+from .utils.email_utils import resume_mail_sender
 
 app = create_app()
 
 if __name__ == '__main__':
+    resume_mail_sender()
     app.run(host='0.0.0.0', debug=True)
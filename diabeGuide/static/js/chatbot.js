@@ -64,40 +64,43 @@ window.onload = () => {
         // Create abort controller for this request
         currentAbortController = new AbortController();
 
-        console.log('Sending message to /api/chat:', message);
+        console.log('Sending message to /api/chat/stream:', message);
+        let streamedReply = null;
         try {
-            const response = await fetch('/api/chat', {
+            const response = await fetch('/api/chat/stream', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ message }),
                 signal: currentAbortController.signal
             });
-            
-            // Check if request was aborted
-            if (currentAbortController.signal.aborted) {
+
+            if (!response.ok || !response.body) {
+                const result = await response.json();
                 removeLoadingIndicator(loadingIndicator);
                 isWaitingForResponse = false;
-                hidePauseButton();
+                appendMessageWithTyping(`Error: ${result.error || 'Could not connect to the chatbot.'}`, 'bot');
                 return;
             }
-            
-            console.log('Received response from /api/chat:', response);
-            const result = await response.json();
-            console.log('Parsed JSON response:', result);
+
+            // Render the reply as it streams in
+            streamedReply = { text: '', p: null };
+            await readReplyStream(response, streamedReply, loadingIndicator);
             removeLoadingIndicator(loadingIndicator);
             isWaitingForResponse = false;
-            
-            if (result.reply) {
-                appendMessageWithTyping(result.reply, 'bot');
-            } else if (result.error) {
-                appendMessageWithTyping(`Error: ${result.error}`, 'bot');
+            if (!streamedReply.p) {
+                appendMessage('No reply was generated.', 'bot');
             }
+            hidePauseButton();
+            hideStopGeneratingButton();
         } catch (error) {
             // Check if error is due to abort
             if (error.name === 'AbortError') {
                 console.log('Request was cancelled');
                 removeLoadingIndicator(loadingIndicator);
-                appendMessage('Request cancelled.', 'bot');
+                // Keep whatever was streamed before the user stopped it
+                if (!streamedReply || !streamedReply.p) {
+                    appendMessage('Request cancelled.', 'bot');
+                }
                 isWaitingForResponse = false;
                 hidePauseButton();
                 hideStopGeneratingButton();
@@ -114,6 +117,60 @@ window.onload = () => {
             currentAbortController = null;
         }
     }
+
+    function parseSseEvent(rawEvent) {
+        const event = { type: 'message', data: {} };
+        rawEvent.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                event.type = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                event.data = JSON.parse(line.slice(5).trim());
+            }
+        });
+        return event;
+    }
+
+    async function readReplyStream(response, reply, loadingIndicator) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const event = parseSseEvent(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+                if (event.type === 'error') {
+                    reply.text += `${reply.text ? '\n\n' : ''}Error: ${event.data.error}`;
+                } else if (event.data.text) {
+                    reply.text += event.data.text;
+                } else {
+                    continue;
+                }
+
+                if (!reply.p) {
+                    // First chunk: swap the loading dots for the reply bubble
+                    removeLoadingIndicator(loadingIndicator);
+                    const messageElement = document.createElement('div');
+                    messageElement.classList.add('message', 'bot-message');
+                    reply.p = document.createElement('p');
+                    messageElement.appendChild(reply.p);
+                    chatWindow.appendChild(messageElement);
+                    const stopText = document.querySelector('#stop-generating-btn .stop-text');
+                    if (stopText) {
+                        stopText.textContent = 'Stop generating';
+                    }
+                }
+                reply.p.innerHTML = marked.parse(reply.text);
+                if (autoScrollEnabled) {
+                    chatWindow.scrollTop = chatWindow.scrollHeight;
+                }
+            }
+        }
+    }
     
     function hidePauseButton() {
         const pauseBtn = document.getElementById('pause-resume-btn');
@@ -368,14 +425,18 @@ window.onload = () => {
     async function loadCurrentSessionChat() {
         if (!chatWindow) return Promise.resolve();
         try {
-            const response = await fetch('/api/chat/current_session');
-            if (!response.ok) {
-                console.error('Failed to load current session');
-                // Still show welcome message even if session load fails
-                showWelcomeMessage();
-                return Promise.resolve();
+            // Embedded in the page on first load; fetched on later reloads
+            let history = window.takeBootstrap('current_session');
+            if (history === undefined) {
+                const response = await fetch('/api/chat/current_session');
+                if (!response.ok) {
+                    console.error('Failed to load current session');
+                    // Still show welcome message even if session load fails
+                    showWelcomeMessage();
+                    return Promise.resolve();
+                }
+                history = await response.json();
             }
-            const history = await response.json();
             chatWindow.innerHTML = '';
             if (history && Array.isArray(history) && history.length > 0) {
                 // Load existing chat history (this replaces the welcome message)
@@ -405,30 +466,54 @@ window.onload = () => {
         }
     }
 
+    // Cursor for the next older page of archived history (null when none left)
+    let historyCursor = null;
+    let loadingOlderHistory = false;
+    const HISTORY_PAGE_SIZE = 50;
+
+    function createMessageElement(message, sender) {
+        const messageElement = document.createElement('div');
+        messageElement.classList.add('message', `${sender}-message`);
+        const p = document.createElement('p');
+        if (sender === 'bot') {
+            p.innerHTML = marked.parse(message);
+        } else {
+            p.textContent = message;
+        }
+        messageElement.appendChild(p);
+        return messageElement;
+    }
+
+    async function fetchHistoryPage(before) {
+        const params = new URLSearchParams({ limit: HISTORY_PAGE_SIZE });
+        if (before !== null && before !== undefined) {
+            params.set('before', before);
+        }
+        const response = await fetch(`/api/chat/history?${params}`);
+        if (!response.ok) {
+            throw new Error('Failed to load chat history');
+        }
+        return response.json();
+    }
+
     async function loadArchivedChatHistory() {
         if (!chatWindow) return;
         try {
-            const response = await fetch('/api/chat/history');
-            if (!response.ok) {
-                alert('Failed to load chat history. Please try again.');
-                return;
-            }
-            const history = await response.json();
+            const page = await fetchHistoryPage(null);
             chatWindow.innerHTML = '';
-            if (history && Array.isArray(history)) {
-                if (history.length === 0) {
-                    appendMessage('No chat history found.', 'bot');
-                } else {
-                    history.forEach(entry => {
-                        if (entry && entry.message && entry.role) {
-                            appendMessage(entry.message, entry.role);
-                        }
-                    });
-                    // Scroll to bottom after loading
-                    setTimeout(() => {
-                        chatWindow.scrollTop = chatWindow.scrollHeight;
-                    }, 100);
-                }
+            historyCursor = page.before;
+            if (page.messages.length === 0) {
+                appendMessage('No chat history found.', 'bot');
+            } else {
+                page.messages.forEach(entry => {
+                    if (entry && entry.message && entry.role) {
+                        appendMessage(entry.message, entry.role);
+                    }
+                });
+                // Scroll to bottom after loading
+                setTimeout(() => {
+                    chatWindow.scrollTop = chatWindow.scrollHeight;
+                }, 100);
             }
         } catch (error) {
             console.error('Error loading chat history:', error);
@@ -436,6 +521,29 @@ window.onload = () => {
         }
     }
 
+    async function loadOlderHistory() {
+        if (historyCursor === null || loadingOlderHistory) return;
+        loadingOlderHistory = true;
+        try {
+            const page = await fetchHistoryPage(historyCursor);
+            historyCursor = page.before;
+            // Prepend older messages while keeping the current view in place
+            const previousHeight = chatWindow.scrollHeight;
+            const fragment = document.createDocumentFragment();
+            page.messages.forEach(entry => {
+                if (entry && entry.message && entry.role) {
+                    fragment.appendChild(createMessageElement(entry.message, entry.role));
+                }
+            });
+            chatWindow.insertBefore(fragment, chatWindow.firstChild);
+            chatWindow.scrollTop += chatWindow.scrollHeight - previousHeight;
+        } catch (error) {
+            console.error('Error loading older chat history:', error);
+        } finally {
+            loadingOlderHistory = false;
+        }
+    }
+
     async function clearChat() {
         if (!chatWindow) return;
         
@@ -458,6 +566,7 @@ window.onload = () => {
             
             // Clear chat window
             chatWindow.innerHTML = '';
+            historyCursor = null;
             
             // Clear on server
             const response = await fetch('/api/chat/current_session', { 
@@ -586,6 +695,11 @@ window.onload = () => {
     // Detect user scrolling to disable auto-scroll
     let scrollTimeout = null;
     chatWindow.addEventListener('scroll', () => {
+        // Lazy-load older archived messages when scrolled to the top
+        if (chatWindow.scrollTop < 50 && historyCursor !== null) {
+            loadOlderHistory();
+        }
+
         // Check if user scrolled up
         const isAtBottom = chatWindow.scrollHeight - chatWindow.scrollTop - chatWindow.clientHeight < 50;
         autoScrollEnabled = isAtBottom;
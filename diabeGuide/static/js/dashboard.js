@@ -15,19 +15,22 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         });
 
+        // Plot aggregates rather than raw readings so the number of points
+        // stays bounded however long the history is: daily means for the last
+        // 90 days when readings are timestamped, monthly means otherwise
+        const MAX_DAILY_POINTS = 90;
+
         async function updateChart() {
-            const response = await fetch('/api/tracker');
-            const data = await response.json();
-            const labels = [];
-            const values = [];
-            for (const entries of Object.values(data)) {
-                entries.forEach(entry => {
-                    labels.push(entry.note); // Using note as label for simplicity
-                    values.push(entry.sugar_level);
-                });
+            let summary = window.takeBootstrap('tracker_summary');
+            if (!summary) {
+                const response = await fetch('/api/tracker/summary');
+                summary = await response.json();
             }
-            sugarChart.data.labels = labels;
-            sugarChart.data.datasets[0].data = values;
+            const useDays = summary.days.length > 0 && summary.months.length <= 3;
+            const points = useDays ? summary.days.slice(-MAX_DAILY_POINTS) : summary.months;
+            sugarChart.data.labels = points.map(point => useDays ? point.day : point.month);
+            sugarChart.data.datasets[0].label = useDays ? 'Daily Average Sugar Level (mg/dL)' : 'Monthly Average Sugar Level (mg/dL)';
+            sugarChart.data.datasets[0].data = points.map(point => point.mean);
             sugarChart.update();
         }
 
@@ -36,13 +39,12 @@ document.addEventListener('DOMContentLoaded', () => {
 
     const downloadBtn = document.getElementById('download-btn');
     if (downloadBtn) {
-        downloadBtn.addEventListener('click', async () => {
-            const response = await fetch('/api/download');
-            const data = await response.json();
+        downloadBtn.addEventListener('click', () => {
+            // Let the browser save the streamed export directly instead of
+            // buffering it in the page
+            const format = document.getElementById('download-format');
             const a = document.createElement('a');
-            const file = new Blob([JSON.stringify(data, null, 2)], {type: 'application/json'});
-            a.href = URL.createObjectURL(file);
-            a.download = 'diabeguide_data.json';
+            a.href = `/api/download?${format ? format.value : 'format=json'}&download=1`;
             a.click();
         });
     }
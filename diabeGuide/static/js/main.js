@@ -1,3 +1,14 @@
+// Data the server embedded in the page for its first render. Each key is
+// handed out once; later refreshes fetch from the API as usual.
+const bootstrapElement = document.getElementById('bootstrap-data');
+const bootstrapData = bootstrapElement ? JSON.parse(bootstrapElement.textContent) : {};
+
+window.takeBootstrap = function(key) {
+    const value = bootstrapData[key];
+    delete bootstrapData[key];
+    return value;
+}
+
 window.openTab = function(evt, tabName) {
     let i, tabcontent, tablinks;
     tabcontent = document.getElementsByClassName("tab-content");
@@ -2,12 +2,40 @@ document.addEventListener('DOMContentLoaded', () => {
     const logBtn = document.getElementById('log-btn');
     const trackerLog = document.getElementById('tracker-log');
 
+    // Local copy of the log; after the first load only readings newer than
+    // trackerVersion are fetched
+    let trackerVersion = 0;
+    let trackerMonths = {};
+
+    async function fetchTrackerChanges() {
+        let url = `/api/tracker?since=${trackerVersion}&limit=1000`;
+        // The first page (since=0) comes embedded in the page
+        let page = window.takeBootstrap('tracker_page');
+        while (url) {
+            if (!page) {
+                const response = await fetch(url);
+                page = await response.json();
+            }
+            if (page.reset) {
+                trackerMonths = {};
+            }
+            page.entries.forEach(entry => {
+                if (!trackerMonths[entry.month_year]) {
+                    trackerMonths[entry.month_year] = [];
+                }
+                trackerMonths[entry.month_year].push(entry);
+            });
+            trackerVersion = page.version;
+            url = page.next_cursor ? `/api/tracker?after=${page.next_cursor}&limit=1000` : null;
+            page = null;
+        }
+    }
+
     async function updateTrackerLog() {
         if (!trackerLog) return;
-        const response = await fetch('/api/tracker');
-        const data = await response.json();
+        await fetchTrackerChanges();
         trackerLog.innerHTML = '';
-        for (const [monthYear, entries] of Object.entries(data)) {
+        for (const [monthYear, entries] of Object.entries(trackerMonths)) {
             const monthDiv = document.createElement('div');
             monthDiv.innerHTML = `<h3>${monthYear}</h3>`;
             entries.forEach(entry => {
@@ -45,6 +73,54 @@ document.addEventListener('DOMContentLoaded', () => {
         updateTrackerLog();
     }
 
+    // Bulk import of a meter/CGM export (CSV or NDJSON). The server answers
+    // with one JSON progress line per batch it has saved.
+    const importBtn = document.getElementById('import-btn');
+    const importProgress = document.getElementById('import-progress');
+    if (importBtn) {
+        importBtn.addEventListener('click', async () => {
+            const file = document.getElementById('import-file-input').files[0];
+            if (!file) return;
+            importBtn.disabled = true;
+            importProgress.textContent = 'Uploading...';
+            try {
+                const response = await fetch('/api/tracker/import', {
+                    method: 'POST',
+                    headers: { 'Content-Type': file.type || 'application/octet-stream' },
+                    body: file
+                });
+                if (!response.ok) {
+                    const error = await response.json();
+                    importProgress.textContent = error.error || 'Import failed.';
+                    return;
+                }
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                let status = null;
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    const lines = buffer.split('\n');
+                    buffer = lines.pop();
+                    lines.filter(line => line.trim()).forEach(line => {
+                        status = JSON.parse(line);
+                        importProgress.textContent = `Imported ${status.imported} of ${status.processed} rows...`;
+                    });
+                }
+                if (status) {
+                    importProgress.textContent = status.state === 'done'
+                        ? `Imported ${status.imported} readings (${status.duplicates} duplicates, ${status.rejected} rejected).`
+                        : `Import ${status.state}: ${status.error || ''}`;
+                }
+                updateTrackerLog();
+            } finally {
+                importBtn.disabled = false;
+            }
+        });
+    }
+
     const clearBtn = document.getElementById('clear-data-btn');
     if (clearBtn) {
         clearBtn.addEventListener('click', async () => {
@@ -0,0 +1,39 @@
+import json
+import os
+import threading
+
+
+def _tmp_path(path):
+    # Unique per process and thread, so concurrent writers never share a temp file
+    return f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+
+def atomic_write(path, chunks, fsync=True):
+    """Replace `path` with the given byte chunks, all or nothing.
+
+    The content goes to a temp file in the same directory which is then
+    renamed over the target, so readers see either the old file or the new
+    one, never a half-written one. With fsync the data is on disk before
+    the rename, so a crash can't leave an empty file behind either.
+    """
+    tmp_path = _tmp_path(path)
+    try:
+        with open(tmp_path, 'wb') as f:
+            if isinstance(chunks, bytes):
+                f.write(chunks)
+            else:
+                f.writelines(chunks)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def atomic_write_json(path, obj, fsync=True, **dump_kwargs):
+    atomic_write(path, json.dumps(obj, **dump_kwargs).encode('utf-8'), fsync=fsync)
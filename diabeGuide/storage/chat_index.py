@@ -0,0 +1,113 @@
+import os
+import re
+import sqlite3
+from contextlib import closing
+
+_TERM = re.compile(r'\w+\*?')
+# Terms beyond this are ignored
+MAX_QUERY_TERMS = 10
+
+
+def parse_query(text):
+    """FTS5 query for free text: every word must match, 'word*' matches as a
+    prefix. Words are quoted so FTS syntax in the input is taken literally.
+    Returns None if there is nothing to search for."""
+    terms = []
+    for match in _TERM.findall((text or '').lower())[:MAX_QUERY_TERMS]:
+        word = match.rstrip('*')
+        terms.append(f'"{word}"' + ('*' if match.endswith('*') else ''))
+    return ' '.join(terms) or None
+
+
+class ChatIndex:
+    """Per-user full-text index over a ChatLog, in an SQLite FTS5 table.
+
+    Rows are keyed by archive position and `indexed` records how many
+    messages have been added, so sync() only indexes what was appended
+    since. Queries go through the inverted index and never read the
+    archive itself.
+    """
+
+    SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(
+            message, role UNINDEXED, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        );
+        CREATE TABLE IF NOT EXISTS index_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO index_meta (key, value) VALUES ('indexed', 0);
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'index_meta'").fetchone() is None:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(self.SCHEMA)
+        return conn
+
+    def _indexed(self, conn):
+        return conn.execute("SELECT value FROM index_meta WHERE key = 'indexed'").fetchone()[0]
+
+    def sync(self, log):
+        """Index messages appended to `log` since the last sync; returns how many"""
+        total = log.count()
+        with closing(self._connect()) as conn:
+            if self._indexed(conn) == total:
+                return 0
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                indexed = self._indexed(conn)
+                if indexed > total:
+                    # The archive was rewritten shorter - start over
+                    conn.execute('DELETE FROM messages')
+                    indexed = 0
+                messages = log.read(indexed, total)
+                conn.executemany(
+                    'INSERT INTO messages (rowid, message, role) VALUES (?, ?, ?)',
+                    [(indexed + i, str(m.get('message', '')), m.get('role')) for i, m in enumerate(messages)]
+                )
+                conn.execute("UPDATE index_meta SET value = ? WHERE key = 'indexed'", (indexed + len(messages),))
+        return len(messages)
+
+    def clear(self):
+        """Forget everything (after the archive was replaced); the next sync rebuilds"""
+        if not self.exists():
+            return
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM messages')
+            conn.execute("UPDATE index_meta SET value = 0 WHERE key = 'indexed'")
+
+    def search(self, text, limit=20, offset=0):
+        """(results, total) for a free-text query, best matches first.
+
+        Each result has the message's archive position as `id` (usable as a
+        /api/chat/history cursor), its role, text and a short snippet.
+        """
+        query = parse_query(text)
+        if query is None:
+            return [], 0
+        with closing(self._connect()) as conn:
+            total = conn.execute('SELECT count(*) FROM messages WHERE messages MATCH ?', (query,)).fetchone()[0]
+            rows = conn.execute(
+                "SELECT rowid, role, message, snippet(messages, 0, '', '', '...', 16) AS snippet, bm25(messages) AS score "
+                'FROM messages WHERE messages MATCH ? ORDER BY score, rowid DESC LIMIT ? OFFSET ?',
+                (query, limit, offset)
+            ).fetchall()
+        results = [{
+            'id': row['rowid'],
+            'role': row['role'],
+            'message': row['message'],
+            'snippet': row['snippet'],
+            # bm25() is lower-is-better; flip it so higher means more relevant
+            'score': round(-row['score'], 3),
+        } for row in rows]
+        return results, total
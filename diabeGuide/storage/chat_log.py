@@ -0,0 +1,220 @@
+import json
+import os
+import struct
+import zlib
+from .atomic import atomic_write
+from .locks import FileLock
+
+# Each index entry is the byte offset of one message in the log
+_OFFSET = struct.Struct('<Q')
+# Index header: magic, size of the log it was written against and a CRC of
+# the last _TAIL bytes of that much of the log
+_HEADER = struct.Struct('<4sQI')
+_MAGIC = b'CLX1'
+_TAIL = 256
+
+
+class ChatLog:
+    """Append-only, per-user chat archive with an offset index.
+
+    Messages are JSON lines in `path`; `path + '.idx'` holds one fixed-width
+    offset per message after a short header, so message i's offset is entry
+    i. Adding a turn appends to both files, and reading a page of messages
+    seeks straight to it without parsing the rest of the archive.
+
+    The two files can't be replaced together atomically, so the header
+    fingerprints the log it was written against. An index that doesn't
+    match the log (a crash mid-replace, or an index from before headers) is
+    rebuilt from the log before it is used.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _lock(self):
+        return FileLock(self.path + '.lock')
+
+    # --- Reading ---
+    def version(self):
+        """Change stamp for the archive (mtime and size), None if it doesn't exist"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def count(self):
+        self._check_index()
+        return self._count()
+
+    def _count(self):
+        try:
+            return max(0, os.path.getsize(self.index_path) - _HEADER.size) // _OFFSET.size
+        except FileNotFoundError:
+            return 0
+
+    def _offset(self, index_file, position):
+        index_file.seek(_HEADER.size + position * _OFFSET.size)
+        return _OFFSET.unpack(index_file.read(_OFFSET.size))[0]
+
+    # --- Index consistency ---
+    @staticmethod
+    def _header(content_tail, size):
+        return _HEADER.pack(_MAGIC, size, zlib.crc32(content_tail))
+
+    def _header_for(self, log_file, size):
+        start = max(0, size - _TAIL)
+        log_file.seek(start)
+        return self._header(log_file.read(size - start), size)
+
+    def _index_valid(self):
+        try:
+            log_file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return self._count() == 0
+        with log_file:
+            try:
+                with open(self.index_path, 'rb') as index_file:
+                    header = index_file.read(_HEADER.size)
+            except FileNotFoundError:
+                return False
+            if len(header) < _HEADER.size:
+                return False
+            magic, size, _ = _HEADER.unpack(header)
+            if magic != _MAGIC or size > os.fstat(log_file.fileno()).st_size:
+                return False
+            # Appends only add to the log, so this part of it never changes
+            return self._header_for(log_file, size) == header
+
+    def _check_index(self):
+        if not self._index_valid():
+            with self._lock():
+                if not self._index_valid():
+                    self._rebuild()
+
+    def _rebuild(self):
+        """Re-create the index from the log"""
+        offsets, position = [], 0
+        try:
+            with open(self.path, 'rb') as log_file:
+                for line in log_file:
+                    if not line.endswith(b'\n'):
+                        break  # torn trailing write
+                    offsets.append(position)
+                    position += len(line)
+                header = self._header_for(log_file, position)
+        except FileNotFoundError:
+            header = self._header(b'', 0)
+        atomic_write(self.index_path, header + b''.join(_OFFSET.pack(offset) for offset in offsets), fsync=False)
+
+    def read(self, start=0, end=None):
+        """Messages [start, end) in archive order"""
+        total = self.count()
+        end = total if end is None else min(end, total)
+        start = max(0, start)
+        if start >= end:
+            return []
+        with open(self.index_path, 'rb') as index_file, open(self.path, 'rb') as log_file:
+            begin = self._offset(index_file, start)
+            stop = self._offset(index_file, end) if end < total else None
+            log_file.seek(begin)
+            chunk = log_file.read() if stop is None else log_file.read(stop - begin)
+        messages = []
+        for line in chunk.splitlines()[:end - start]:
+            try:
+                messages.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue  # torn trailing write - skip it
+        return messages
+
+    def page(self, before=None, limit=50):
+        """Up to `limit` messages ending just before position `before` (default: the newest).
+
+        Returns (messages, start) where `start` is the position of the first
+        message, i.e. the `before` cursor for the next older page.
+        """
+        end = self.count() if before is None else min(before, self.count())
+        start = max(0, end - limit)
+        return self.read(start, end), start
+
+    # --- Writing ---
+    def _repair(self):
+        """Re-index messages appended without index entries (e.g. after a crash)"""
+        count = self._count()
+        try:
+            log_size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        with open(self.path, 'rb') as log_file:
+            position = 0
+            if count:
+                with open(self.index_path, 'rb') as index_file:
+                    log_file.seek(self._offset(index_file, count - 1))
+                log_file.readline()
+                position = log_file.tell()
+            if position >= log_size:
+                return
+            offsets = []
+            while position < log_size:
+                line = log_file.readline()
+                if not line.endswith(b'\n'):
+                    break
+                offsets.append(position)
+                position = log_file.tell()
+        self._extend_index(offsets, position)
+
+    def _extend_index(self, offsets, log_size):
+        # Header first: if we crash before the entries are added, it still
+        # matches the log and _repair() adds them next time
+        with open(self.path, 'rb') as log_file:
+            header = self._header_for(log_file, log_size)
+        with open(self.index_path, 'r+b') as index_file:
+            index_file.write(header)
+            index_file.seek(0, os.SEEK_END)
+            index_file.write(b''.join(_OFFSET.pack(offset) for offset in offsets))
+
+    def append(self, messages):
+        """Append messages (e.g. one user/bot turn) and return the new count"""
+        with self._lock():
+            if self._index_valid() and os.path.exists(self.index_path):
+                self._repair()
+            else:
+                self._rebuild()
+            lines = [(json.dumps(message) + '\n').encode('utf-8') for message in messages]
+            with open(self.path, 'ab') as log_file:
+                offset = log_file.seek(0, os.SEEK_END)
+                log_file.write(b''.join(lines))
+            offsets = []
+            for line in lines:
+                offsets.append(offset)
+                offset += len(line)
+            self._extend_index(offsets, offset)
+            return self._count()
+
+    def replace(self, messages):
+        """Rewrite the whole archive from a list of messages"""
+        with self._lock():
+            self._replace(messages)
+
+    def _replace(self, messages):
+        lines = [(json.dumps(message) + '\n').encode('utf-8') for message in messages]
+        offsets, offset = [], 0
+        for line in lines:
+            offsets.append(offset)
+            offset += len(line)
+        content = b''.join(lines)
+        # Index first, stamped with the new log: if we crash before the log
+        # is replaced, the stamp won't match the old log and the index is rebuilt
+        atomic_write(self.index_path, self._header(content[-_TAIL:], len(content))
+                     + b''.join(_OFFSET.pack(o) for o in offsets))
+        atomic_write(self.path, content)
+
+    def import_legacy(self, messages):
+        """Seed the archive from an old chat_history_{id}.json list, once"""
+        with self._lock():
+            if not self.exists():
+                self._replace(messages)
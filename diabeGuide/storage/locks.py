@@ -0,0 +1,40 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows dev setups - fall back to an in-process lock
+    fcntl = None
+
+# Without fcntl, one in-process lock per path stands in for the file lock
+_fallback_locks = {}
+_fallback_guard = threading.Lock()
+
+
+def _fallback_lock(path):
+    with _fallback_guard:
+        return _fallback_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+class FileLock:
+    """Exclusive advisory lock held on a side file for the duration of a with-block"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        if fcntl is None:
+            self._fd = _fallback_lock(self.path)
+            self._fd.acquire()
+            return self
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is None:
+            self._fd.release()
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
@@ -0,0 +1,89 @@
+import time
+from .sqlite import ConnectionPerThread
+
+
+class SessionChatStore:
+    """Current-session chat messages shared by all gunicorn workers.
+
+    Backed by SQLite so every worker sees the same session. Each user keeps
+    at most `max_messages` (oldest dropped first), and sessions idle for
+    longer than `idle_ttl` seconds are evicted, so nothing grows unbounded.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS session_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            message TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS session_messages_user ON session_messages (user_id, id);
+        CREATE TABLE IF NOT EXISTS sessions (
+            user_id TEXT PRIMARY KEY,
+            last_active REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS sessions_last_active ON sessions (last_active);
+    """
+
+    # Sweep idle sessions every this many appends
+    EVICT_EVERY = 200
+
+    def __init__(self, path, max_messages=100, idle_ttl=12 * 3600):
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self._connections = ConnectionPerThread(path)
+        self._appends = 0
+        conn = self._connections.get()
+        with conn:
+            conn.executescript(self.SCHEMA)
+
+    def get(self, user_id):
+        conn = self._connections.get()
+        session = conn.execute('SELECT last_active FROM sessions WHERE user_id = ?', (str(user_id),)).fetchone()
+        if session is None:
+            return []
+        if time.time() - session['last_active'] > self.idle_ttl:
+            self.clear(user_id)
+            return []
+        rows = conn.execute(
+            'SELECT role, message FROM session_messages WHERE user_id = ? ORDER BY id', (str(user_id),)
+        )
+        return [{'role': row['role'], 'message': row['message']} for row in rows]
+
+    def append(self, user_id, messages):
+        user_id = str(user_id)
+        conn = self._connections.get()
+        with conn:
+            conn.executemany(
+                'INSERT INTO session_messages (user_id, role, message) VALUES (?, ?, ?)',
+                [(user_id, message['role'], message['message']) for message in messages]
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions (user_id, last_active) VALUES (?, ?)', (user_id, time.time())
+            )
+            # Keep only the newest max_messages for this user
+            conn.execute(
+                'DELETE FROM session_messages WHERE user_id = ? AND id <= '
+                '(SELECT id FROM session_messages WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)',
+                (user_id, user_id, self.max_messages)
+            )
+        self._appends += 1
+        if self._appends % self.EVICT_EVERY == 0:
+            self.evict_idle()
+
+    def clear(self, user_id):
+        conn = self._connections.get()
+        with conn:
+            conn.execute('DELETE FROM session_messages WHERE user_id = ?', (str(user_id),))
+            conn.execute('DELETE FROM sessions WHERE user_id = ?', (str(user_id),))
+
+    def evict_idle(self):
+        """Drop every session that has been idle for longer than idle_ttl"""
+        cutoff = time.time() - self.idle_ttl
+        conn = self._connections.get()
+        with conn:
+            conn.execute(
+                'DELETE FROM session_messages WHERE user_id IN (SELECT user_id FROM sessions WHERE last_active < ?)',
+                (cutoff,)
+            )
+            conn.execute('DELETE FROM sessions WHERE last_active < ?', (cutoff,))
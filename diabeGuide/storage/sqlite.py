@@ -0,0 +1,26 @@
+import os
+import sqlite3
+import threading
+
+
+class ConnectionPerThread:
+    """Hands out one SQLite connection per thread and per process.
+
+    Connections must not cross a gunicorn fork or be shared between the
+    threads of a gthread worker, so each gets its own, opened lazily.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
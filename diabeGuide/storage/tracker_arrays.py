@@ -0,0 +1,127 @@
+import io
+import zipfile
+from .atomic import atomic_write
+from .tracker_summary import parse_level
+
+
+def _numpy():
+    import numpy as np  # imported on first use to keep worker start-up light
+    return np
+
+
+def to_arrays(records):
+    """(times, levels, untimed) for tracker records, sorted by time.
+
+    `times` are local wall-clock seconds (datetime64[s] as int64) and
+    `levels` mg/dL as float32; readings without a usable timestamp can't be
+    placed on a time axis and are only counted.
+    """
+    np = _numpy()
+    timestamps, levels, untimed = [], [], 0
+    for record in records:
+        level = parse_level(record.get('sugar_level'))
+        if level is None:
+            continue
+        timestamp = record.get('timestamp')
+        if not isinstance(timestamp, str) or len(timestamp) < 10:
+            untimed += 1
+            continue
+        # Drop any UTC offset or fraction - readings are in the user's local time
+        timestamps.append(timestamp[:19])
+        levels.append(level)
+    try:
+        times = np.array(timestamps, dtype='datetime64[s]')
+    except ValueError:
+        times = np.array([_parse_one(np, t) for t in timestamps], dtype='datetime64[s]')
+    times = times.astype(np.int64)
+    levels = np.array(levels, dtype=np.float32)
+    valid = times != np.iinfo(np.int64).min  # NaT
+    if not valid.all():
+        untimed += int((~valid).sum())
+        times, levels = times[valid], levels[valid]
+    order = np.argsort(times, kind='stable')
+    return times[order], levels[order], untimed
+
+
+def _parse_one(np, timestamp):
+    try:
+        return np.datetime64(timestamp, 's')
+    except ValueError:
+        return np.datetime64('NaT')
+
+
+class TrackerArrays:
+    """Typed NumPy copy of a user's readings, kept in a .npz next to the log.
+
+    Like TrackerSummary it is tagged with the log version it covers. Readings
+    appended since then are read from the log and merged in; a rewrite (clear
+    or replace) of the log means starting over from the full log.
+    """
+
+    def __init__(self, path, log):
+        self.path = path
+        self.log = log
+
+    def _load(self):
+        np = _numpy()
+        try:
+            with np.load(self.path) as f:
+                return {
+                    'version': int(f['version']),
+                    'times': f['times'],
+                    'levels': f['levels'],
+                    'untimed': int(f['untimed']),
+                }
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return None
+
+    def _save(self, arrays):
+        np = _numpy()
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        # Derived data (rebuilt from the log on a mismatch), so no fsync
+        atomic_write(self.path, buffer.getvalue(), fsync=False)
+
+    def _records(self, after, version):
+        # Stop at `version` - anything appended meanwhile is picked up next time
+        return (record for record in self.log.records(after=after) if record['seq'] <= version)
+
+    def _extend(self, arrays, version):
+        np = _numpy()
+        times, levels, untimed = to_arrays(self._records(arrays['version'], version))
+        if len(times):
+            times = np.concatenate((arrays['times'], times))
+            levels = np.concatenate((arrays['levels'], levels))
+            if len(arrays['times']) and times[len(arrays['times'])] < arrays['times'][-1]:
+                # Back-dated readings - restore time order
+                order = np.argsort(times, kind='stable')
+                times, levels = times[order], levels[order]
+        else:
+            times, levels = arrays['times'], arrays['levels']
+        return {'version': version, 'times': times, 'levels': levels, 'untimed': arrays['untimed'] + untimed}
+
+    def get(self, current=None):
+        """Arrays for the log's current version.
+
+        `current` is a copy the caller already holds (e.g. in a worker's
+        memory); it is tried before the file on disk.
+        """
+        version = self.log.version()
+        reset = self.log.header()['reset']
+
+        def usable(arrays):
+            return arrays is not None and reset <= arrays['version'] <= version
+
+        arrays = current if usable(current) else None
+        if arrays is None:
+            stored = self._load()
+            arrays = stored if usable(stored) else None
+        if arrays is None:
+            times, levels, untimed = to_arrays(self._records(None, version))
+            arrays = {'version': version, 'times': times, 'levels': levels, 'untimed': untimed}
+            if version:
+                self._save(arrays)
+        elif arrays['version'] != version:
+            arrays = self._extend(arrays, version)
+            self._save(arrays)
+        return arrays
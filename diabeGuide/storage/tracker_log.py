@@ -0,0 +1,323 @@
+import heapq
+import json
+import os
+from .atomic import atomic_write
+from .locks import FileLock
+
+# Rewrite the log once this many bytes have been appended since the last compaction
+COMPACT_TAIL_BYTES = 64 * 1024
+
+_HEADER_PREFIX = b'{"tracker_log"'
+_EMPTY_HEADER = {'seq': 0, 'reset': 0, 'body': 0, 'index': {}}
+
+
+class TrackerLog:
+    """Append-only, per-user log of tracker readings.
+
+    Each reading is one JSON line, so logging a reading is a single append
+    instead of a rewrite of the user's whole history. The file looks like:
+
+        {"tracker_log": 1, "seq": 41, "reset": 3, "body": 2048, "index": {"03-2025": [0, 512, 17], ...}}
+        ...readings grouped by month, covered by the index...
+        ...readings appended since the last compaction (the tail)...
+
+    Compaction regroups the tail into the indexed body, so reading a few
+    months only touches those byte ranges plus the (bounded) tail. Every
+    reading carries a sequence number; the highest one is the log's version.
+    `seq` in the header is the version at the last compaction (everything
+    newer is in the tail) and `reset` the version of the last full rewrite.
+    Each index entry is the month's byte range and its highest sequence
+    number; within a month (and in the tail) readings are in sequence order,
+    which lets ordered_records() seek instead of scanning.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    # --- Locking ---
+    def _lock(self):
+        return FileLock(self.path + '.lock')
+
+    # --- Reading ---
+    def _read_header(self, f):
+        f.seek(0)
+        first = f.readline()
+        if first.startswith(_HEADER_PREFIX):
+            try:
+                return dict(_EMPTY_HEADER, **json.loads(first)), len(first)
+            except json.JSONDecodeError:
+                pass
+        f.seek(0)
+        return dict(_EMPTY_HEADER), 0
+
+    def _lines(self, f, length=None):
+        """Lines from the current position (at most `length` bytes), read
+        incrementally so large logs are never held in memory at once"""
+        if length is None:
+            yield from f
+            return
+        while length > 0:
+            line = f.readline(length)
+            if not line:
+                return
+            length -= len(line)
+            yield line
+
+    def _parse_lines(self, lines):
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith(_HEADER_PREFIX):
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn trailing write - skip it
+
+    def header(self):
+        try:
+            with open(self.path, 'rb') as f:
+                return self._read_header(f)[0]
+        except FileNotFoundError:
+            return dict(_EMPTY_HEADER)
+
+    def months(self):
+        """Month keys present in the log, in first-logged order"""
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return []
+        with f:
+            header, data_start = self._read_header(f)
+            months = dict.fromkeys(header['index'])
+            f.seek(data_start + header['body'])
+            for record in self._parse_lines(self._lines(f)):
+                months.setdefault(record['month_year'])
+        return list(months)
+
+    def records(self, months=None, after=None):
+        """Yield raw records (with 'seq' and 'month_year'), optionally only
+        for `months` and/or with a sequence number above `after`"""
+        if months is not None:
+            months = set(months)
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            header, data_start = self._read_header(f)
+            tail_start = data_start + header['body']
+            if after is not None and after >= header['seq']:
+                # Everything newer than the last compaction lives in the tail
+                f.seek(tail_start)
+                found = self._parse_lines(self._lines(f))
+            elif months is None:
+                f.seek(data_start)
+                found = self._parse_lines(self._lines(f))
+            else:
+                found = self._read_months(f, header, data_start, months)
+
+            for record in found:
+                if after is not None and record['seq'] <= after:
+                    continue
+                if months is not None and record['month_year'] not in months:
+                    continue
+                yield record
+
+    def _read_months(self, f, header, data_start, months):
+        # Indexed byte ranges for the requested months, then the tail
+        for month_year, (start, end, *_) in header['index'].items():
+            if month_year in months:
+                f.seek(data_start + start)
+                yield from self._parse_lines(self._lines(f, end - start))
+        f.seek(data_start + header['body'])
+        yield from self._parse_lines(self._lines(f))
+
+    def ordered_records(self, months=None, after=0):
+        """Like records(), but in sequence order and lazily: each month's
+        range is binary-searched for the first reading above `after` and the
+        months are merged, so taking the first n reads about n readings"""
+        if months is not None:
+            months = set(months)
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            header, data_start = self._read_header(f)
+            tail_start = data_start + header['body']
+            sources = []
+            if after < header['seq']:
+                for month_year, (start, end, *last) in header['index'].items():
+                    # Index entries written before the last seq was recorded have none
+                    if (months is not None and month_year not in months) or (last and last[0] <= after):
+                        continue
+                    start = self._seek_seq(f, data_start + start, data_start + end, after)
+                    sources.append(self._parse_lines(self._lines_at(f, start, data_start + end)))
+            # The tail is bounded by compaction, so it is simply filtered
+            f.seek(tail_start)
+            tail = [record for record in self._parse_lines(self._lines(f))
+                    if record['seq'] > after and (months is None or record['month_year'] in months)]
+            sources.append(tail)
+            yield from heapq.merge(*sources, key=lambda record: record['seq'])
+
+    def _lines_at(self, f, start, end):
+        # Lines in [start, end), re-seeking each time so several ranges of the
+        # same file can be read in step
+        while start < end:
+            f.seek(start)
+            line = f.readline(end - start)
+            if not line:
+                return
+            start += len(line)
+            yield line
+
+    def _line_seq(self, line):
+        try:
+            return json.loads(line)['seq']
+        except (ValueError, KeyError):
+            return None
+
+    def _seek_seq(self, f, start, end, after):
+        """Offset of the first line in [start, end) with a sequence number
+        above `after`; the lines there must be in sequence order"""
+        lo, hi = start, end  # lines before lo are <= after; hi is a line start or end
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if mid > lo:
+                # First line start at or after mid
+                f.seek(mid - 1)
+                f.readline()
+                pos = f.tell()
+            else:
+                pos = lo
+            if pos >= hi:
+                pos = lo
+            f.seek(pos)
+            line = f.readline(hi - pos)
+            seq = self._line_seq(line)
+            if seq is None or seq <= after:
+                lo = pos + len(line)
+            else:
+                hi = pos
+        return lo
+
+    def read(self, months=None):
+        """Return {month_year: [entries]} in the shape the app has always used"""
+        tracker_data = {}
+        for record in self.records(months):
+            entry = {k: v for k, v in record.items() if k not in ('seq', 'month_year')}
+            tracker_data.setdefault(record['month_year'], []).append(entry)
+        return tracker_data
+
+    def _last_line_seq(self, f):
+        # Walk back from the end of the file to the last complete line
+        pos, buf = f.seek(0, os.SEEK_END), b''
+        while pos > 0:
+            step = min(4096, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+            lines = buf.rstrip(b'\n').split(b'\n')
+            # The first line may be cut off unless we reached the start of the file
+            for line in reversed(lines if pos == 0 else lines[1:]):
+                try:
+                    return json.loads(line)['seq']
+                except (ValueError, KeyError):
+                    continue
+        return 0
+
+    def version(self):
+        """Sequence number of the latest write (0 for an empty log)"""
+        try:
+            with open(self.path, 'rb') as f:
+                header, _ = self._read_header(f)
+                return max(header['seq'], self._last_line_seq(f))
+        except FileNotFoundError:
+            return 0
+
+    # --- Writing ---
+    def append(self, month_year, entry):
+        """Append one reading and return its sequence number"""
+        return self.append_many([(month_year, entry)])
+
+    def append_many(self, readings, compact=True):
+        """Append (month_year, entry) pairs in a single write and return the
+        sequence number of the last one.
+
+        Bulk imports pass compact=False and call compact() once at the end,
+        instead of regrouping the whole log after every batch.
+        """
+        with self._lock():
+            seq = self.version()
+            lines = []
+            for month_year, entry in readings:
+                seq += 1
+                lines.append(json.dumps(dict(entry, seq=seq, month_year=month_year), separators=(',', ':')) + '\n')
+            if not lines:
+                return seq
+            content = ''.join(lines).encode('utf-8')
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                written = 0
+                while written < len(content):
+                    written += os.write(fd, content[written:])
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+
+            if compact:
+                with open(self.path, 'rb') as f:
+                    header, data_start = self._read_header(f)
+                if size - data_start - header['body'] > COMPACT_TAIL_BYTES:
+                    self._compact()
+        return seq
+
+    def _write(self, records, seq, reset):
+        """Write `records` grouped by month, with a fresh header, replacing the file"""
+        grouped, last_seq = {}, {}
+        for record in records:
+            line = json.dumps(record, separators=(',', ':')) + '\n'
+            grouped.setdefault(record['month_year'], []).append(line.encode('utf-8'))
+            last_seq[record['month_year']] = record['seq']
+
+        index, chunks, offset = {}, [], 0
+        for month_year, lines in grouped.items():
+            chunk = b''.join(lines)
+            index[month_year] = [offset, offset + len(chunk), last_seq[month_year]]
+            chunks.append(chunk)
+            offset += len(chunk)
+        header = json.dumps({'tracker_log': 1, 'seq': seq, 'reset': reset, 'body': offset, 'index': index}, separators=(',', ':'))
+
+        atomic_write(self.path, [header.encode('utf-8') + b'\n'] + chunks)
+
+    def _compact(self):
+        self._write(list(self.records()), self.version(), self.header()['reset'])
+
+    def compact(self):
+        """Fold the appended tail into the month-indexed body"""
+        with self._lock():
+            self._compact()
+
+    def replace(self, tracker_data):
+        """Replace the whole log with `tracker_data` ({month_year: [entries]})"""
+        with self._lock():
+            self._replace(tracker_data)
+
+    def _replace(self, tracker_data):
+        seq = self.version()
+        records = []
+        for month_year, entries in tracker_data.items():
+            for entry in entries:
+                seq += 1
+                records.append(dict(entry, seq=seq, month_year=month_year))
+        # A rewrite always moves the version forward, even when clearing
+        self._write(records, seq + 1, seq + 1)
+
+    def import_legacy(self, tracker_data):
+        """Seed the log from an old tracker_data_{id}.json dict, once"""
+        with self._lock():
+            if not self.exists():
+                self._replace(tracker_data)
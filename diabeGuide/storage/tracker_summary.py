@@ -0,0 +1,292 @@
+import heapq
+import json
+import math
+import os
+import sqlite3
+from contextlib import closing
+
+# Target glucose range in mg/dL, used for time-in-range
+TARGET_LOW = 70
+TARGET_HIGH = 180
+# Latest readings kept verbatim in the summary (quoted in the chatbot prompt)
+RECENT_READINGS = int(os.getenv('CHAT_CONTEXT_RECENT', 20))
+
+
+def parse_level(value):
+    """Sugar level as a float, or None if it isn't a usable number"""
+    try:
+        level = float(value)
+    except (TypeError, ValueError):
+        return None
+    return level if math.isfinite(level) else None
+
+
+def reading_day(entry):
+    """'YYYY-MM-DD' for readings that carry a timestamp, else None"""
+    timestamp = entry.get('timestamp')
+    if isinstance(timestamp, str) and len(timestamp) >= 10:
+        return timestamp[:10]
+    return None
+
+
+def _empty_bucket():
+    return {'count': 0, 'total': 0.0, 'total_sq': 0.0, 'min': None, 'max': None, 'below': 0, 'in_range': 0, 'above': 0}
+
+
+def _add_reading(bucket, level):
+    bucket['count'] += 1
+    bucket['total'] += level
+    bucket['total_sq'] += level * level
+    bucket['min'] = level if bucket['min'] is None else min(bucket['min'], level)
+    bucket['max'] = level if bucket['max'] is None else max(bucket['max'], level)
+    if level < TARGET_LOW:
+        bucket['below'] += 1
+    elif level > TARGET_HIGH:
+        bucket['above'] += 1
+    else:
+        bucket['in_range'] += 1
+
+
+def describe(bucket):
+    """Turn running sums into the stats the dashboard shows"""
+    count = bucket['count']
+    mean = bucket['total'] / count
+    variance = max(bucket['total_sq'] / count - mean * mean, 0.0)
+    return {
+        'count': count,
+        'mean': round(mean, 1),
+        'min': bucket['min'],
+        'max': bucket['max'],
+        'std_dev': round(math.sqrt(variance), 1),
+        'time_in_range': round(100.0 * bucket['in_range'] / count, 1),
+        'time_below_range': round(100.0 * bucket['below'] / count, 1),
+        'time_above_range': round(100.0 * bucket['above'] / count, 1),
+        # ADAG estimate: A1c (%) = (mean glucose mg/dL + 46.7) / 28.7
+        'estimated_a1c': round((mean + 46.7) / 28.7, 1),
+    }
+
+
+def _group(keys, levels):
+    """Running-sum buckets per key, computed in a few vectorized passes"""
+    if not keys:
+        return {}
+    import numpy as np  # imported on first use to keep worker start-up light
+    levels = np.asarray(levels, dtype=np.float64)
+    labels, inverse = np.unique(np.asarray(keys), return_inverse=True)
+    size = len(labels)
+    counts = np.bincount(inverse, minlength=size)
+    totals = np.bincount(inverse, weights=levels, minlength=size)
+    totals_sq = np.bincount(inverse, weights=levels * levels, minlength=size)
+    below = np.bincount(inverse, weights=levels < TARGET_LOW, minlength=size)
+    above = np.bincount(inverse, weights=levels > TARGET_HIGH, minlength=size)
+    mins = np.full(size, np.inf)
+    maxs = np.full(size, -np.inf)
+    np.minimum.at(mins, inverse, levels)
+    np.maximum.at(maxs, inverse, levels)
+
+    buckets = {}
+    for i, label in enumerate(labels.tolist()):
+        buckets[label] = {
+            'count': int(counts[i]),
+            'total': float(totals[i]),
+            'total_sq': float(totals_sq[i]),
+            'min': float(mins[i]),
+            'max': float(maxs[i]),
+            'below': int(below[i]),
+            'in_range': int(counts[i] - below[i] - above[i]),
+            'above': int(above[i]),
+        }
+    return buckets
+
+
+def compute_summary(records):
+    """Per-month and per-day buckets and the latest readings for an iterable
+    of tracker records"""
+    levels, months, day_levels, days = [], [], [], []
+    recent = []
+    for record in records:
+        # Bounded min-heap on seq: the newest RECENT_READINGS seen so far
+        if len(recent) < RECENT_READINGS:
+            heapq.heappush(recent, (record['seq'], record))
+        elif recent and record['seq'] > recent[0][0]:
+            heapq.heapreplace(recent, (record['seq'], record))
+        level = parse_level(record.get('sugar_level'))
+        if level is None:
+            continue
+        levels.append(level)
+        months.append(record['month_year'])
+        day = reading_day(record)
+        if day:
+            day_levels.append(level)
+            days.append(day)
+    return {
+        'months': _group(months, levels),
+        'days': _group(days, day_levels),
+        'recent': [record for _, record in sorted(recent, key=lambda item: item[0], reverse=True)],
+    }
+
+
+_BUCKET_FIELDS = ('count', 'total', 'total_sq', 'min', 'max', 'below', 'in_range', 'above')
+
+
+class TrackerSummary:
+    """Per-user running aggregates over a TrackerLog, in an SQLite file.
+
+    Each month and day bucket is a row, so an append updates only the rows
+    of its own month and day (plus the short `recent` list) rather than
+    rewriting every bucket, and readers load the day buckets only when they
+    ask for them. `version` in summary_meta says which log version the rows
+    cover; any mismatch (a clear, a lost race between two writers) is
+    repaired by a full NumPy recompute on the next read.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS buckets (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            total REAL NOT NULL,
+            total_sq REAL NOT NULL,
+            min REAL,
+            max REAL,
+            below INTEGER NOT NULL,
+            in_range INTEGER NOT NULL,
+            above INTEGER NOT NULL,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS recent (
+            seq INTEGER PRIMARY KEY,
+            record TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS summary_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    UPSERT = f"""
+        INSERT INTO buckets (kind, key, {', '.join(_BUCKET_FIELDS)}) VALUES (?, ?, {', '.join('?' * len(_BUCKET_FIELDS))})
+        ON CONFLICT (kind, key) DO UPDATE SET
+            count = count + excluded.count, total = total + excluded.total, total_sq = total_sq + excluded.total_sq,
+            min = min(min, excluded.min), max = max(max, excluded.max),
+            below = below + excluded.below, in_range = in_range + excluded.in_range, above = above + excluded.above
+    """
+
+    def __init__(self, path, log):
+        self.path = path
+        self.log = log
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'summary_meta'").fetchone() is None:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(self.SCHEMA)
+        return conn
+
+    def _version(self, conn):
+        """Log version the rows cover, or None before the first rebuild"""
+        row = conn.execute("SELECT value FROM summary_meta WHERE key = 'version'").fetchone()
+        return row[0] if row else None
+
+    def _set_version(self, conn, version):
+        conn.execute("INSERT OR REPLACE INTO summary_meta (key, value) VALUES ('version', ?)", (version,))
+
+    def _add_buckets(self, conn, kind, buckets):
+        conn.executemany(self.UPSERT, [
+            (kind, key) + tuple(bucket[field] for field in _BUCKET_FIELDS) for key, bucket in buckets.items()
+        ])
+
+    def _add_recent(self, conn, records):
+        conn.executemany('INSERT OR REPLACE INTO recent (seq, record) VALUES (?, ?)',
+                         [(record['seq'], json.dumps(record, separators=(',', ':'))) for record in records])
+        conn.execute('DELETE FROM recent WHERE seq NOT IN (SELECT seq FROM recent ORDER BY seq DESC LIMIT ?)',
+                     (RECENT_READINGS,))
+
+    def rebuild(self):
+        version = self.log.version()
+        # Only fold what `version` covers: rebuilds run without the user lock,
+        # and a reading appended meanwhile is added by its writer's
+        # record_many - counting it here as well would double it for good
+        summary = compute_summary(record for record in self.log.records() if record['seq'] <= version)
+        with closing(self._connect()) as conn, conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM buckets')
+            conn.execute('DELETE FROM recent')
+            self._add_buckets(conn, 'month', summary['months'])
+            self._add_buckets(conn, 'day', summary['days'])
+            self._add_recent(conn, summary['recent'])
+            self._set_version(conn, version)
+        summary['version'] = version
+        return summary
+
+    def record(self, seq, month_year, entry):
+        """Fold one appended reading (log sequence number `seq`) into the buckets"""
+        self.record_many(seq, [(month_year, entry)])
+
+    def record_many(self, last_seq, readings):
+        """Fold readings appended together, ending at sequence number `last_seq`"""
+        first_seq = last_seq - len(readings) + 1
+        months, days, recent = {}, {}, []
+        for seq, (month_year, entry) in enumerate(readings, first_seq):
+            recent.append(dict(entry, seq=seq, month_year=month_year))
+            level = parse_level(entry.get('sugar_level'))
+            if level is not None:
+                _add_reading(months.setdefault(month_year, _empty_bucket()), level)
+                day = reading_day(entry)
+                if day:
+                    _add_reading(days.setdefault(day, _empty_bucket()), level)
+
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                stale = self._version(conn) != first_seq - 1
+                if not stale:
+                    self._add_buckets(conn, 'month', months)
+                    self._add_buckets(conn, 'day', days)
+                    self._add_recent(conn, recent[-RECENT_READINGS:])
+                    self._set_version(conn, last_seq)
+        if stale:
+            self.rebuild()
+
+    def _buckets(self, conn, kind, first=None, last=None):
+        query, args = 'SELECT * FROM buckets WHERE kind = ?', [kind]
+        if first is not None:
+            query += ' AND key >= ?'
+            args.append(first)
+        if last is not None:
+            query += ' AND key <= ?'
+            args.append(last)
+        return {row['key']: {field: row[field] for field in _BUCKET_FIELDS} for row in conn.execute(query, args)}
+
+    def get(self, version=None, days=None):
+        """Current month buckets and latest readings, recomputed first if the
+        log has moved on (pass the log `version` if the caller has already
+        read it). Day buckets are only loaded when asked for: `days` is a
+        (first, last) pair of 'YYYY-MM-DD' bounds, either of which may be None.
+        """
+        if version is None:
+            version = self.log.version()
+        with closing(self._connect()) as conn:
+            # One read transaction, so the rows all belong to the same version
+            with conn:
+                conn.execute('BEGIN')
+                if self._version(conn) == version:
+                    summary = {
+                        'version': version,
+                        'months': self._buckets(conn, 'month'),
+                        'recent': [json.loads(row['record']) for row in
+                                   conn.execute('SELECT record FROM recent ORDER BY seq DESC')],
+                    }
+                    if days is not None:
+                        summary['days'] = self._buckets(conn, 'day', *days)
+                    return summary
+        summary = self.rebuild()
+        if days is None:
+            del summary['days']
+        else:
+            first, last = days
+            summary['days'] = {day: bucket for day, bucket in summary['days'].items()
+                               if (first is None or day >= first) and (last is None or day <= last)}
+        return summary
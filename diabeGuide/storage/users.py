@@ -0,0 +1,290 @@
+import json
+import logging
+import os
+import sqlite3
+from .atomic import atomic_write_json
+from .locks import FileLock
+from .sqlite import ConnectionPerThread
+
+logger = logging.getLogger(__name__)
+
+# Columns every backend stores for a user (besides the id)
+USER_FIELDS = ('username', 'password_hash', 'email', 'weight', 'height', 'age', 'diabetes_type', 'email_verified')
+
+
+def _normalize_email(email):
+    return email.lower() if email else None
+
+
+class JsonUserRepository:
+    """The original users.json store - every write rewrites the whole file.
+
+    Writes read, modify and atomically replace the file under a lock, so
+    concurrent signups in different workers can't drop each other's users.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Lookups scan the copy read by the last load_all() call
+        self._data = {}
+
+    def _lock(self):
+        return FileLock(self.path + '.lock')
+
+    def _read(self, strict=False):
+        try:
+            with open(self.path, 'r') as f:
+                self._data = json.load(f)
+        except FileNotFoundError:
+            self._data = {}
+        except json.JSONDecodeError:
+            # Never rewrite an unreadable file as if it were empty
+            if strict:
+                raise
+            self._data = {}
+        return self._data
+
+    def _write(self, users_data):
+        atomic_write_json(self.path, users_data, indent=4)
+
+    def version(self):
+        """Cheap change stamp for the file: mtime, size and inode"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def changes_since(self, version):
+        """Return (new_version, changed records) since `version` was taken,
+        or (new_version, None) if the caller has no version yet.
+
+        The file is only re-read when its stamp moved, and the result is
+        diffed against the previous copy so callers just patch changed users.
+        """
+        current = self.version()
+        if version is None:
+            return current, None
+        if current == version:
+            return current, []
+        previous = self._data
+        users_data = self._read()
+        changed = [dict(record, id=user_id) for user_id, record in users_data.items() if previous.get(user_id) != record]
+        return current, changed
+
+    def load_all(self):
+        """Return {user_id: record} for every stored user"""
+        return {user_id: dict(record, id=user_id) for user_id, record in self._read().items()}
+
+    def iter_all(self):
+        """Every stored user, one record at a time"""
+        return iter(self.load_all().values())
+
+    def get(self, user_id):
+        record = self._data.get(str(user_id))
+        return dict(record, id=str(user_id)) if record else None
+
+    def get_by_username(self, username):
+        for user_id, record in self._data.items():
+            if record.get('username') == username:
+                return dict(record, id=user_id)
+        return None
+
+    def get_by_email(self, email):
+        email = _normalize_email(email)
+        for user_id, record in self._data.items():
+            if record.get('email') and record['email'].lower() == email:
+                return dict(record, id=user_id)
+        return None
+
+    def insert(self, record):
+        """Store a new user and return its id, or None if username/email is taken"""
+        with self._lock():
+            users_data = self._read(strict=True)
+            email = _normalize_email(record.get('email'))
+            for existing in users_data.values():
+                if existing.get('username') == record['username']:
+                    return None
+                if email and existing.get('email') and existing['email'].lower() == email:
+                    return None
+            next_id = max([int(uid) for uid in users_data.keys()], default=0) + 1
+            users_data[str(next_id)] = {field: record.get(field) for field in USER_FIELDS}
+            self._write(users_data)
+        return str(next_id)
+
+    def update(self, user_id, record):
+        with self._lock():
+            users_data = self._read(strict=True)
+            users_data[str(user_id)] = {field: record.get(field) for field in USER_FIELDS}
+            self._write(users_data)
+
+    def update_many(self, records):
+        with self._lock():
+            users_data = self._read(strict=True)
+            for record in records:
+                users_data[str(record['id'])] = {field: record.get(field) for field in USER_FIELDS}
+            self._write(users_data)
+
+
+class SqliteUserRepository:
+    """SQLite store with unique indexes on username and lowercased email.
+
+    Lookups go through an index and saves touch a single row, so login,
+    signup and profile edits no longer scale with the number of accounts.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL UNIQUE,
+            password_hash TEXT NOT NULL,
+            email TEXT,
+            email_lower TEXT UNIQUE,
+            weight TEXT,
+            height TEXT,
+            age TEXT,
+            diabetes_type TEXT,
+            email_verified INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS store_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO store_meta (key, value) VALUES ('version', 0);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connections = ConnectionPerThread(path)
+        conn = self._connect()
+        with conn:
+            conn.executescript(self.SCHEMA)
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(users)')]
+            if 'version' not in columns:
+                conn.execute('ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+            conn.execute('CREATE INDEX IF NOT EXISTS users_version ON users (version)')
+
+    def _connect(self):
+        return self._connections.get()
+
+    def _record(self, row):
+        if row is None:
+            return None
+        record = {field: row[field] for field in USER_FIELDS}
+        record['id'] = str(row['id'])
+        record['email_verified'] = bool(record['email_verified'])
+        return record
+
+    def _values(self, record):
+        return (
+            record['username'],
+            record['password_hash'],
+            record.get('email'),
+            _normalize_email(record.get('email')),
+            record.get('weight'),
+            record.get('height'),
+            record.get('age'),
+            record.get('diabetes_type'),
+            1 if record.get('email_verified') else 0,
+        )
+
+    def _bump_version(self, conn):
+        # Every write bumps the store version and stamps the rows it touched,
+        # so other workers can fetch just those rows
+        conn.execute("UPDATE store_meta SET value = value + 1 WHERE key = 'version'")
+        return conn.execute("SELECT value FROM store_meta WHERE key = 'version'").fetchone()[0]
+
+    def version(self):
+        return self._connect().execute("SELECT value FROM store_meta WHERE key = 'version'").fetchone()[0]
+
+    def changes_since(self, version):
+        """Return (new_version, changed records), or (new_version, None) if
+        the caller has no version yet and should start from scratch"""
+        current = self.version()
+        if version is None:
+            return current, None
+        if current == version:
+            return current, []
+        rows = self._connect().execute('SELECT * FROM users WHERE version > ?', (version,))
+        return current, [self._record(row) for row in rows]
+
+    def is_empty(self):
+        return self._connect().execute('SELECT 1 FROM users LIMIT 1').fetchone() is None
+
+    def load_all(self):
+        rows = self._connect().execute('SELECT * FROM users')
+        return {str(row['id']): self._record(row) for row in rows}
+
+    def iter_all(self):
+        """Every stored user in id order, streamed from a cursor"""
+        for row in self._connect().execute('SELECT * FROM users ORDER BY id'):
+            yield self._record(row)
+
+    def get(self, user_id):
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+        row = self._connect().execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+        return self._record(row)
+
+    def get_by_username(self, username):
+        row = self._connect().execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+        return self._record(row)
+
+    def get_by_email(self, email):
+        row = self._connect().execute('SELECT * FROM users WHERE email_lower = ?', (_normalize_email(email),)).fetchone()
+        return self._record(row)
+
+    def insert(self, record):
+        """Store a new user and return its id, or None if username/email is taken"""
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    'INSERT INTO users (username, password_hash, email, email_lower, weight, height, age, diabetes_type, email_verified, version) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    self._values(record) + (self._bump_version(conn),),
+                )
+        except sqlite3.IntegrityError:
+            return None
+        return str(cursor.lastrowid)
+
+    def update(self, user_id, record):
+        self.update_many([dict(record, id=user_id)])
+
+    def update_many(self, records):
+        conn = self._connect()
+        with conn:
+            version = self._bump_version(conn)
+            conn.executemany(
+                'UPDATE users SET username = ?, password_hash = ?, email = ?, email_lower = ?, weight = ?, height = ?, '
+                'age = ?, diabetes_type = ?, email_verified = ?, version = ? WHERE id = ?',
+                [self._values(record) + (version, int(record['id'])) for record in records],
+            )
+
+    def import_records(self, records):
+        """Bulk-load records keeping their ids (used to migrate users.json)"""
+        conn = self._connect()
+        with conn:
+            version = self._bump_version(conn)
+            conn.executemany(
+                'INSERT OR IGNORE INTO users (id, username, password_hash, email, email_lower, weight, height, age, diabetes_type, email_verified, version) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(int(record['id']),) + self._values(record) + (version,) for record in records],
+            )
+
+
+def create_user_repository(backend, json_path, sqlite_path):
+    """Build the configured user repository ('sqlite' by default, or 'json')"""
+    if backend == 'json':
+        return JsonUserRepository(json_path)
+
+    repository = SqliteUserRepository(sqlite_path)
+    # First start on SQLite: carry over accounts from the old users.json
+    if repository.is_empty() and os.path.exists(json_path):
+        records = JsonUserRepository(json_path).load_all().values()
+        repository.import_records(records)
+        logger.info("Migrated %d users from %s to %s", len(records), json_path, sqlite_path)
+    return repository
@@ -0,0 +1,290 @@
+import threading
+from collections import OrderedDict
+from ..storage.tracker_summary import TARGET_LOW, TARGET_HIGH
+
+# Consensus time-in-range bands, mg/dL
+VERY_LOW = 54
+VERY_HIGH = 250
+# Readings further apart than this belong to separate episodes and excursions
+EPISODE_GAP = 2 * 3600
+# Most recent episodes listed per kind (all of them are counted)
+MAX_EPISODES = 20
+ROLLING_WINDOWS = (7, 30)
+DAY = 86400
+
+
+def _numpy():
+    import numpy as np  # imported on first use to keep worker start-up light
+    return np
+
+
+def _round(value, digits=1):
+    value = float(value)
+    return None if value != value else round(value, digits)  # NaN -> None
+
+
+def _iso(np, seconds):
+    return str(np.datetime64(int(seconds), 's'))
+
+
+def _day(np, day_number):
+    return str(np.datetime64(int(day_number), 'D'))
+
+
+def bands(levels):
+    """Percent of readings in each consensus band"""
+    np = _numpy()
+    edges = np.array([VERY_LOW, TARGET_LOW, TARGET_HIGH + 1e-9, VERY_HIGH + 1e-9])
+    counts = np.bincount(np.searchsorted(edges, levels, side='right'), minlength=5)
+    share = 100.0 * counts / max(len(levels), 1)
+    return {
+        'very_low': _round(share[0]),
+        'low': _round(share[1]),
+        'in_range': _round(share[2]),
+        'high': _round(share[3]),
+        'very_high': _round(share[4]),
+    }
+
+
+def episodes(times, levels, mask, extreme):
+    """Runs of consecutive readings matching `mask`, split at gaps over EPISODE_GAP.
+
+    Returns the count, total minutes and the latest MAX_EPISODES runs with
+    their start, end, duration and most extreme value (`extreme` is 'min'
+    for lows, 'max' for highs).
+    """
+    np = _numpy()
+    if not mask.any():
+        return {'count': 0, 'minutes': 0, 'latest': []}
+    joined = np.diff(times) <= EPISODE_GAP
+    continues_previous = np.concatenate(([False], mask[:-1] & joined))
+    continues_next = np.concatenate((mask[1:] & joined, [False]))
+    starts = np.flatnonzero(mask & ~continues_previous)
+    ends = np.flatnonzero(mask & ~continues_next)
+
+    # Readings outside the runs are neutralized so a segmented reduce from
+    # each start only sees its own run
+    if extreme == 'min':
+        peaks = np.minimum.reduceat(np.where(mask, levels, np.inf), starts)
+    else:
+        peaks = np.maximum.reduceat(np.where(mask, levels, -np.inf), starts)
+    durations = (times[ends] - times[starts]) / 60.0
+
+    latest = []
+    for i in range(len(starts) - 1, max(len(starts) - MAX_EPISODES, 0) - 1, -1):
+        latest.append({
+            'start': _iso(np, times[starts[i]]),
+            'end': _iso(np, times[ends[i]]),
+            'minutes': int(durations[i]),
+            'readings': int(ends[i] - starts[i] + 1),
+            extreme: _round(peaks[i]),
+        })
+    return {'count': int(len(starts)), 'minutes': int(durations.sum()), 'latest': latest}
+
+
+def _daily(np, days, levels):
+    first = days[0]
+    index = days - first
+    size = int(index[-1]) + 1
+    counts = np.bincount(index, minlength=size)
+    totals = np.bincount(index, weights=levels, minlength=size)
+    totals_sq = np.bincount(index, weights=levels * levels, minlength=size)
+    return first, index, counts, totals, totals_sq
+
+
+def rolling_means(np, first, counts, totals):
+    """Per-day mean plus trailing ROLLING_WINDOWS-day means, for days with readings"""
+    cum_counts = np.concatenate(([0], np.cumsum(counts)))
+    cum_totals = np.concatenate(([0.0], np.cumsum(totals)))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = {'mean': totals / counts}
+        for window in ROLLING_WINDOWS:
+            upper = np.arange(1, len(counts) + 1)
+            lower = np.maximum(upper - window, 0)
+            means[f'mean_{window}d'] = (cum_totals[upper] - cum_totals[lower]) / (cum_counts[upper] - cum_counts[lower])
+    rows = []
+    for i in np.flatnonzero(counts):
+        row = {'day': _day(np, first + i), 'count': int(counts[i])}
+        row.update((name, _round(values[i])) for name, values in means.items())
+        rows.append(row)
+    return rows
+
+
+def mage(np, times, levels, day_index, day_sd):
+    """Mean amplitude of glycemic excursions.
+
+    Excursions are the rises and falls between successive turning points;
+    those larger than the standard deviation of the day they start on count
+    towards the mean (both directions are averaged). Excursions across a
+    gap in the data are ignored.
+    """
+    if len(levels) < 3:
+        return None
+    slopes = np.diff(levels)
+    moving = np.flatnonzero(slopes != 0)
+    if len(moving) < 2:
+        return None
+    signs = np.sign(slopes[moving])
+    turns = moving[1:][signs[1:] != signs[:-1]]
+    points = np.concatenate(([moving[0]], turns, [len(levels) - 1]))
+    amplitudes = np.abs(np.diff(levels[points]))
+    spans = np.diff(times[points])
+    counted = (amplitudes > day_sd[day_index[points[:-1]]]) & (spans <= EPISODE_GAP * 6)
+    if not counted.any():
+        return None
+    return _round(amplitudes[counted].mean())
+
+
+def weekly_trends(np, days, times, levels):
+    """Mean and within-week least-squares slope (mg/dL per day) by Monday-start
+    week, plus the change from the previous week's mean"""
+    # 1970-01-01 was a Thursday, so shift by 3 days to start weeks on Monday
+    weeks = (days + 3) // 7
+    first = weeks[0]
+    index = weeks - first
+    size = int(index[-1]) + 1
+    t = (times - (weeks * 7 - 3) * DAY) / DAY  # days since the week started
+    n = np.bincount(index, minlength=size)
+    sum_t = np.bincount(index, weights=t, minlength=size)
+    sum_y = np.bincount(index, weights=levels, minlength=size)
+    sum_tt = np.bincount(index, weights=t * t, minlength=size)
+    sum_ty = np.bincount(index, weights=t * levels, minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sum_y / n
+        denominator = n * sum_tt - sum_t * sum_t
+        slopes = np.where(np.abs(denominator) > 1e-9, (n * sum_ty - sum_t * sum_y) / denominator, np.nan)
+    rows = []
+    for i in np.flatnonzero(n):
+        previous = means[i - 1] if i > 0 and n[i - 1] else np.nan
+        rows.append({
+            'week_start': _day(np, (first + i) * 7 - 3),
+            'count': int(n[i]),
+            'mean': _round(means[i]),
+            'slope_per_day': _round(slopes[i], 2),
+            'change_from_previous': _round(means[i] - previous),
+        })
+    return rows
+
+
+def analyze(times, levels):
+    """All metrics for time-sorted readings (times in seconds, levels in mg/dL)"""
+    np = _numpy()
+    if len(levels) == 0:
+        return {'count': 0}
+    levels = levels.astype(np.float64)
+    days = times // DAY
+    first, day_index, counts, totals, totals_sq = _daily(np, days, levels)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        day_mean = totals / counts
+        day_sd = np.sqrt(np.maximum(totals_sq / counts - day_mean * day_mean, 0.0))
+
+    mean = levels.mean()
+    sd = levels.std()
+    weeks = weekly_trends(np, days, times, levels)
+    week_means = np.array([w['mean'] for w in weeks], dtype=np.float64)
+    return {
+        'count': int(len(levels)),
+        'first': _iso(np, times[0]),
+        'last': _iso(np, times[-1]),
+        'mean': _round(mean),
+        'std_dev': _round(sd),
+        'cv': _round(100.0 * sd / mean) if mean else None,
+        # Glucose management indicator (Bergenstal 2018)
+        'gmi': _round(3.31 + 0.02392 * mean),
+        'mage': mage(np, times, levels, day_index, day_sd),
+        'bands': bands(levels),
+        'episodes': {
+            'hypo': episodes(times, levels, levels < TARGET_LOW, 'min'),
+            'severe_hypo': episodes(times, levels, levels < VERY_LOW, 'min'),
+            'hyper': episodes(times, levels, levels > TARGET_HIGH, 'max'),
+            'severe_hyper': episodes(times, levels, levels > VERY_HIGH, 'max'),
+        },
+        'days': rolling_means(np, first, counts, totals),
+        'weeks': weeks,
+        # Least-squares slope of the weekly means, mg/dL per week
+        'weekly_trend': _round(np.polyfit(np.arange(len(week_means)), week_means, 1)[0], 2) if len(week_means) > 1 else None,
+    }
+
+
+def select(arrays, start=None, end=None, days=None):
+    """Slice time-sorted arrays to [start, end] ('YYYY-MM-DD', inclusive) or
+    the last `days` days of data. Raises ValueError for bad bounds."""
+    np = _numpy()
+    times, levels = arrays['times'], arrays['levels']
+    try:
+        low = np.datetime64(start, 'D').astype('datetime64[s]').astype(np.int64) if start else None
+        high = (np.datetime64(end, 'D') + 1).astype('datetime64[s]').astype(np.int64) if end else None
+    except ValueError:
+        raise ValueError('Dates must look like YYYY-MM-DD')
+    if days is not None:
+        if days < 1:
+            raise ValueError('days must be at least 1')
+        if len(times):
+            low = ((int(times[-1]) // DAY) - days + 1) * DAY
+    lo = np.searchsorted(times, low, side='left') if low is not None else 0
+    hi = np.searchsorted(times, high, side='left') if high is not None else len(times)
+    return times[lo:hi], levels[lo:hi]
+
+
+class AnalyticsCache:
+    """Per-worker LRU of users' reading arrays and finished reports.
+
+    Entries are keyed by the tracker log version, so any write - from any
+    worker - makes the next request miss. On a miss only the readings
+    appended since the cached copy are read (see TrackerArrays). Arrays are
+    evicted by least recent use once more than `max_readings` are held.
+    """
+
+    def __init__(self, max_readings=2000000, max_reports=256):
+        self.max_readings = max_readings
+        self.max_reports = max_reports
+        self._arrays = OrderedDict()
+        self._reports = OrderedDict()
+        self._lock = threading.Lock()
+        self._readings = 0
+        self.hits = 0
+        self.misses = 0
+
+    def arrays(self, user_id, store):
+        with self._lock:
+            current = self._arrays.get(user_id)
+        arrays = store.get(current)
+        if arrays is not current:
+            with self._lock:
+                previous = self._arrays.pop(user_id, None)
+                if previous is not None:
+                    self._readings -= len(previous['times'])
+                self._arrays[user_id] = arrays
+                self._readings += len(arrays['times'])
+                while self._readings > self.max_readings and len(self._arrays) > 1:
+                    _, evicted = self._arrays.popitem(last=False)
+                    self._readings -= len(evicted['times'])
+        else:
+            with self._lock:
+                if user_id in self._arrays:
+                    self._arrays.move_to_end(user_id)
+        return arrays
+
+    def report(self, user_id, store, start=None, end=None, days=None):
+        """analyze() for the user's readings in the selected range"""
+        arrays = self.arrays(user_id, store)
+        key = (user_id, arrays['version'], start, end, days)
+        with self._lock:
+            report = self._reports.get(key)
+            if report is not None:
+                self._reports.move_to_end(key)
+                self.hits += 1
+                return report
+        times, levels = select(arrays, start, end, days)
+        report = dict(analyze(times, levels), version=arrays['version'], untimed=arrays['untimed'])
+        with self._lock:
+            self.misses += 1
+            self._reports[key] = report
+            while len(self._reports) > self.max_reports:
+                self._reports.popitem(last=False)
+        return report
+
+    def stats(self):
+        with self._lock:
+            return {'users': len(self._arrays), 'readings': self._readings, 'reports': len(self._reports),
+                    'hits': self.hits, 'misses': self.misses}
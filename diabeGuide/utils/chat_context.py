@@ -0,0 +1,110 @@
+import os
+import threading
+from collections import OrderedDict
+from .. import data
+from ..storage.tracker_summary import TARGET_HIGH, TARGET_LOW, describe
+from .tracker_utils import month_key
+
+# Rough budget for the tracker section of the chatbot prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CHAT_CONTEXT_TOKENS', 1500))
+# Users whose context is kept in memory per worker
+CACHE_SIZE = 1024
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+def _overall(buckets):
+    total = {'count': 0, 'total': 0.0, 'total_sq': 0.0, 'min': None, 'max': None, 'below': 0, 'in_range': 0, 'above': 0}
+    for bucket in buckets:
+        for field in ('count', 'total', 'total_sq', 'below', 'in_range', 'above'):
+            total[field] += bucket[field]
+        total['min'] = bucket['min'] if total['min'] is None else min(total['min'], bucket['min'])
+        total['max'] = bucket['max'] if total['max'] is None else max(total['max'], bucket['max'])
+    return total
+
+
+def _format_reading(record):
+    when = record['month_year']
+    if record.get('timestamp'):
+        when += f" {record['timestamp']}"
+    line = f"- {when}: {record.get('sugar_level')} mg/dL"
+    if record.get('note'):
+        line += f" (note: {record['note']})"
+    return line
+
+
+def _render(user_id, budget):
+    summary = data.load_tracker_summary(user_id)
+    months = sorted((m for m in summary['months'] if month_key(m)), key=month_key, reverse=True)
+    if not months:
+        return "No tracker readings logged yet."
+
+    stats = {month_year: describe(summary['months'][month_year]) for month_year in months}
+    overall = describe(_overall(summary['months'][m] for m in months))
+    sections = [
+        f"Overall: {overall['count']} readings across {len(months)} months; mean {overall['mean']} mg/dL; "
+        f"{overall['time_in_range']}% in range ({TARGET_LOW}-{TARGET_HIGH}), {overall['time_below_range']}% below, "
+        f"{overall['time_above_range']}% above; estimated A1c {overall['estimated_a1c']}%."
+    ]
+    if len(months) > 1:
+        latest, previous = stats[months[0]], stats[months[1]]
+        change = round(latest['mean'] - previous['mean'], 1)
+        sections.append(
+            f"Trend: {months[0]} mean {latest['mean']} mg/dL vs {previous['mean']} in {months[1]} "
+            f"({'+' if change >= 0 else ''}{change} mg/dL)."
+        )
+
+    # Kept up to date by the summary, so no part of the log is read here
+    recent = [_format_reading(record) for record in summary['recent']]
+    monthly = [
+        f"- {m}: {stats[m]['count']} readings, mean {stats[m]['mean']}, min {stats[m]['min']}, "
+        f"max {stats[m]['max']}, {stats[m]['time_in_range']}% in range"
+        for m in months
+    ]
+
+    # Fill the budget in priority order: headline stats, recent readings, then
+    # monthly averages from newest to oldest
+    lines, used = [], 0
+    for heading, items in ((None, sections), ("Recent readings (newest first):", recent),
+                           ("Monthly averages (newest first):", monthly)):
+        if heading and items:
+            if used + estimate_tokens(heading) > budget:
+                break
+            lines.append(heading)
+            used += estimate_tokens(heading)
+        for item in items:
+            cost = estimate_tokens(item)
+            if used + cost > budget:
+                break
+            lines.append(item)
+            used += cost
+    return "\n".join(lines)
+
+
+def build_tracker_context(user_id, budget=CONTEXT_TOKEN_BUDGET):
+    """Compact, budget-capped summary of a user's tracker data for the prompt.
+
+    Cached per user against the tracker log version, so any tracker write
+    (from any worker) makes the next call rebuild it.
+    """
+    user_id = str(user_id)
+    stamp = (data.tracker_version(user_id), budget)
+    with _cache_lock:
+        cached = _cache.get(user_id)
+        if cached and cached[0] == stamp:
+            _cache.move_to_end(user_id)
+            return cached[1]
+
+    context = _render(user_id, budget)
+    with _cache_lock:
+        _cache[user_id] = (stamp, context)
+        _cache.move_to_end(user_id)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return context
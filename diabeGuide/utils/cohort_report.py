@@ -0,0 +1,283 @@
+"""Population report over every user's tracker data, computed in parallel.
+
+    python -m diabeGuide.utils.cohort_report [--out diabeGuide/reports] [--workers 8] [--full]
+
+Users are streamed from the user store and sharded across a process pool.
+Per-user aggregates are kept in <out>/users.npz (one array per column) and
+on the next run only users whose tracker log changed since are read again.
+The cohort table by diabetes type and age band is rebuilt from those
+columns every run and written to <out>/cohorts.csv.
+"""
+import argparse
+import csv
+import io
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from .. import data
+from ..storage.atomic import atomic_write
+from ..storage.tracker_summary import describe
+from .profile_utils import UNKNOWN, age_band
+
+# Users handed to a pool worker at a time
+CHUNK_SIZE = 500
+ALL = 'all'
+# Per-user columns summed from the user's monthly tracker buckets
+SUM_COLUMNS = ('count', 'total', 'total_sq', 'below', 'in_range', 'above')
+# (0, 0) stamp: the user has no tracker log at all
+NO_LOG = (0, 0)
+EMPTY_STATS = (0, 0.0, 0.0, 0, 0, 0, float('inf'), float('-inf'), None, None)
+# Per-user columns after the id, diabetes type and age band: (name, dtype, default)
+COLUMNS = (('stamp_mtime', 'int64', 0), ('stamp_size', 'int64', 0),
+           ('count', 'int64', 0), ('total', 'float64', 0.0), ('total_sq', 'float64', 0.0),
+           ('below', 'int64', 0), ('in_range', 'int64', 0), ('above', 'int64', 0),
+           ('min', 'float64', float('inf')), ('max', 'float64', float('-inf')),
+           ('first_day', 'datetime64[D]', 'NaT'), ('last_day', 'datetime64[D]', 'NaT'))
+
+
+def _numpy():
+    import numpy as np  # imported on first use to keep worker start-up light
+    return np
+
+
+def diabetes_type(value):
+    value = str(value or '').strip()
+    return value or UNKNOWN
+
+
+def log_stamp(user_id):
+    """(mtime_ns, size) of the user's tracker log, seeding it from the legacy
+    tracker_data_{id}.json first if needed; NO_LOG if there is no data"""
+    path = data.get_user_tracker_log_file(user_id)
+    if not os.path.exists(path):
+        if not os.path.exists(data.get_user_tracker_data_file(user_id)):
+            return NO_LOG
+        data.get_user_tracker_log(user_id)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return NO_LOG
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def user_stats(user_id):
+    """Totals over the user's monthly buckets (read from the tracker summary,
+    which is rebuilt from the log first if it is out of date)"""
+    summary = data.get_user_tracker_summary(user_id).get(days=(None, None))
+    buckets = [bucket for bucket in summary['months'].values() if bucket['count']]
+    if not buckets:
+        return EMPTY_STATS
+    sums = tuple(sum(bucket[column] for bucket in buckets) for column in SUM_COLUMNS)
+    days = sorted(summary['days'])
+    return sums + (
+        min(bucket['min'] for bucket in buckets),
+        max(bucket['max'] for bucket in buckets),
+        days[0] if days else None,
+        days[-1] if days else None,
+    )
+
+
+def process_chunk(chunk):
+    """[(position, user_id, previous stamp)] -> (positions, {column: array})
+    for the users whose tracker log changed"""
+    np = _numpy()
+    positions, rows = [], []
+    for position, user_id, previous in chunk:
+        stamp = log_stamp(user_id)
+        if stamp == previous:
+            continue
+        positions.append(position)
+        rows.append(stamp + (EMPTY_STATS if stamp == NO_LOG else user_stats(user_id)))
+    columns = {}
+    for (name, dtype, default), values in zip(COLUMNS, zip(*rows)):
+        columns[name] = np.array([default if value is None else value for value in values], dtype=dtype)
+    return np.array(positions, dtype=np.int64), columns
+
+
+def load_table(path):
+    np = _numpy()
+    try:
+        with np.load(path) as f:
+            return {name: f[name] for name in f.files}
+    except (OSError, ValueError):
+        return None
+
+
+def _save_npz(path, columns):
+    np = _numpy()
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **columns)
+    atomic_write(path, buffer.getvalue())
+
+
+def _chunks(previous, users):
+    """Stream (position, user_id, previous stamp) chunks while recording each
+    user's id, diabetes type, age band and row in the previous table"""
+    if previous is not None:
+        index = dict(zip(previous['user_id'].tolist(), range(len(previous['user_id']))))
+        mtimes, sizes = previous['stamp_mtime'].tolist(), previous['stamp_size'].tolist()
+    else:
+        index = {}
+    chunk = []
+    for position, record in enumerate(data.user_repository.iter_all()):
+        user_id = int(record['id'])
+        row = index.get(user_id, -1)
+        users['user_id'].append(user_id)
+        users['diabetes_type'].append(diabetes_type(record.get('diabetes_type')))
+        users['age_band'].append(age_band(record.get('age')))
+        users['previous_row'].append(row)
+        chunk.append((position, record['id'], (mtimes[row], sizes[row]) if row >= 0 else None))
+        if len(chunk) >= CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _run_chunks(chunks, workers):
+    """Yield process_chunk results, keeping at most a few chunks per worker in flight"""
+    if not workers:
+        for chunk in chunks:
+            yield process_chunk(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for chunk in chunks:
+            pending.add(pool.submit(process_chunk, chunk))
+            if len(pending) >= workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in pending:
+            yield future.result()
+
+
+def build_users(previous, workers):
+    """The per-user table for this run and the number of users re-read"""
+    np = _numpy()
+    users = {'user_id': [], 'diabetes_type': [], 'age_band': [], 'previous_row': []}
+    results = [result for result in _run_chunks(_chunks(previous, users), workers) if len(result[0])]
+
+    size = len(users['user_id'])
+    rows = np.array(users.pop('previous_row'), dtype=np.int64)
+    table = {
+        'user_id': np.array(users.pop('user_id'), dtype=np.int64),
+        'diabetes_type': np.array(users.pop('diabetes_type'), dtype=str),
+        'age_band': np.array(users.pop('age_band'), dtype=str),
+    }
+    kept = rows >= 0
+    for name, dtype, default in COLUMNS:
+        column = np.full(size, default, dtype=dtype)
+        if previous is not None:
+            column[kept] = previous[name][rows[kept]]
+        for positions, columns in results:
+            column[positions] = columns[name]
+        table[name] = column
+    return table, sum(len(positions) for positions, _ in results)
+
+
+def cohorts(table):
+    """Rows of pooled stats by (diabetes type, age band), with 'all' rollups"""
+    np = _numpy()
+    types, type_index = np.unique(table['diabetes_type'], return_inverse=True)
+    bands, band_index = np.unique(table['age_band'], return_inverse=True)
+    shape = (len(types), len(bands))
+    group = type_index * len(bands) + band_index
+    size = shape[0] * shape[1]
+
+    counts = table['count']
+    has_readings = counts > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        user_tir = np.where(has_readings, 100.0 * table['in_range'] / counts, 0.0)
+    sums = {
+        'users': np.bincount(group, minlength=size),
+        'users_with_readings': np.bincount(group, weights=has_readings, minlength=size),
+        'user_tir': np.bincount(group, weights=user_tir, minlength=size),
+    }
+    for column in SUM_COLUMNS:
+        sums[column] = np.bincount(group, weights=table[column], minlength=size)
+    mins = np.full(size, np.inf)
+    maxs = np.full(size, -np.inf)
+    np.minimum.at(mins, group, table['min'])
+    np.maximum.at(maxs, group, table['max'])
+    sums = {name: values.reshape(shape) for name, values in sums.items()}
+    mins, maxs = mins.reshape(shape), maxs.reshape(shape)
+
+    type_labels = list(types) + [ALL]
+    band_labels = list(bands) + [ALL]
+
+    def rollup(values, reduce):
+        # Append an 'all' row and column holding the reduction over each axis
+        values = np.vstack((values, reduce(values, axis=0, keepdims=True)))
+        return np.hstack((values, reduce(values, axis=1, keepdims=True)))
+
+    sums = {name: rollup(values, np.sum) for name, values in sums.items()}
+    mins, maxs = rollup(mins, np.min), rollup(maxs, np.max)
+
+    rows = []
+    for i, type_label in enumerate(type_labels):
+        for j, band_label in enumerate(band_labels):
+            users = int(sums['users'][i, j])
+            if not users:
+                continue
+            with_readings = int(sums['users_with_readings'][i, j])
+            row = {
+                'diabetes_type': str(type_label),
+                'age_band': str(band_label),
+                'users': users,
+                'users_with_readings': with_readings,
+            }
+            if sums['count'][i, j]:
+                bucket = {column: float(sums[column][i, j]) for column in SUM_COLUMNS}
+                bucket.update(count=int(sums['count'][i, j]), min=float(mins[i, j]), max=float(maxs[i, j]))
+                row.update(describe(bucket))
+                row['readings'] = row.pop('count')
+                row['mean_user_time_in_range'] = round(float(sums['user_tir'][i, j]) / with_readings, 1)
+            rows.append(row)
+    return rows
+
+
+COHORT_COLUMNS = ('diabetes_type', 'age_band', 'users', 'users_with_readings', 'readings', 'mean', 'std_dev',
+                  'min', 'max', 'time_in_range', 'time_below_range', 'time_above_range',
+                  'mean_user_time_in_range', 'estimated_a1c')
+
+
+def write_cohorts(path, rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, COHORT_COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(rows)
+    atomic_write(path, buffer.getvalue().encode('utf-8'))
+
+
+def run(out_dir, workers=None, full=False):
+    """Refresh <out_dir>/users.npz and <out_dir>/cohorts.csv; returns the cohort rows"""
+    os.makedirs(out_dir, exist_ok=True)
+    users_path = os.path.join(out_dir, 'users.npz')
+    started = time.perf_counter()
+    previous = None if full else load_table(users_path)
+    table, reprocessed = build_users(previous, os.cpu_count() if workers is None else workers)
+    rows = cohorts(table)
+    _save_npz(users_path, table)
+    write_cohorts(os.path.join(out_dir, 'cohorts.csv'), rows)
+    print(f"{len(table['user_id'])} users, {reprocessed} re-read, "
+          f"{len(rows)} cohort rows in {time.perf_counter() - started:.1f}s -> {out_dir}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--out', default=os.getenv('REPORTS_DIR', 'diabeGuide/reports'))
+    parser.add_argument('--workers', type=int, help='Worker processes (default: one per CPU, 0 to run in-process)')
+    parser.add_argument('--full', action='store_true', help='Ignore the previous run and re-read every user')
+    args = parser.parse_args()
+
+    rows = run(args.out, args.workers, args.full)
+    for row in rows:
+        if ALL in (row['diabetes_type'], row['age_band']):
+            print(f"{row['diabetes_type']:>12} {row['age_band']:>8} users={row['users']:<8} "
+                  f"mean={row.get('mean', '-')} tir={row.get('time_in_range', '-')}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,10 @@
 import random
 import string
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
 from dotenv import load_dotenv
+from .mail_queue import Outbox, SMTPConnectionPool, get_mail_sender
 
 load_dotenv()
 
@@ -14,13 +14,43 @@ SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
 SMTP_USERNAME = os.getenv('SMTP_USERNAME', '')
 SMTP_PASSWORD = os.getenv('SMTP_PASSWORD', '')
 FROM_EMAIL = os.getenv('FROM_EMAIL', SMTP_USERNAME)
+# Set SMTP_STARTTLS=0 / SMTP_AUTH=0 for a plain local server such as utils/smtp_sink.py
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', '1') == '1'
+SMTP_AUTH = os.getenv('SMTP_AUTH', '1') == '1'
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', 2))
+# Durable queue of outgoing mail, drained by a background sender in each worker
+MAIL_OUTBOX_DB = os.getenv('MAIL_OUTBOX_DB', 'diabeGuide/mail_outbox.db')
+
+def smtp_configured():
+    return not SMTP_AUTH or bool(SMTP_USERNAME and SMTP_PASSWORD)
+
+def create_smtp_pool():
+    return SMTPConnectionPool(
+        SMTP_SERVER, SMTP_PORT,
+        username=SMTP_USERNAME if SMTP_AUTH else '',
+        password=SMTP_PASSWORD if SMTP_AUTH else '',
+        use_tls=SMTP_STARTTLS,
+        size=SMTP_POOL_SIZE
+    )
+
+def queue_email(msg):
+    """Store a message in the outbox and wake the sender; delivery happens in the background"""
+    sender = get_mail_sender(MAIL_OUTBOX_DB, create_smtp_pool)
+    sender.outbox.put(msg['To'], msg['From'], msg.as_string())
+    sender.notify()
+
+def resume_mail_sender():
+    """Start this process's sender now if the outbox still holds mail (say,
+    queued before a restart) instead of waiting for the next queue_email"""
+    if smtp_configured() and Outbox(MAIL_OUTBOX_DB).has_pending():
+        get_mail_sender(MAIL_OUTBOX_DB, create_smtp_pool)
 
 def generate_otp(length=6):
     """Generate a random OTP"""
     return ''.join(random.choices(string.digits, k=length))
 
 def send_otp_email(to_email, otp):
-    """Send OTP to user's email"""
+    """Queue the OTP email for the user; returns False if it could not be queued"""
     try:
         # Create message
         msg = MIMEMultipart()
@@ -50,13 +80,9 @@ def send_otp_email(to_email, otp):
         
         msg.attach(MIMEText(body, 'html'))
         
-        # Send email
-        if SMTP_USERNAME and SMTP_PASSWORD:
-            server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-            server.starttls()
-            server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            server.send_message(msg)
-            server.quit()
+        # Queue email
+        if smtp_configured():
+            queue_email(msg)
             return True
         else:
             # If no email credentials, print OTP to console (for development)
@@ -65,7 +91,7 @@ def send_otp_email(to_email, otp):
             print(f"{'='*50}\n")
             return True
     except Exception as e:
-        print(f"Error sending email: {e}")
+        print(f"Error queueing email: {e}")
         # For development, still print OTP
         print(f"\n{'='*50}")
         print(f"OTP for {to_email}: {otp}")
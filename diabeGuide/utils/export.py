@@ -0,0 +1,83 @@
+import csv
+import io
+import json
+import zlib
+
+EXPORT_FORMATS = {
+    'json': ('application/json', 'json'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+CSV_COLUMNS = ('month_year', 'timestamp', 'sugar_level', 'note')
+# Output is handed to the server in pieces of roughly this size
+CHUNK_BYTES = 64 * 1024
+
+
+def _entry(record):
+    return {k: v for k, v in record.items() if k not in ('seq', 'month_year')}
+
+
+def json_chunks(log, months):
+    """The {month_year: [entries]} document, written one month at a time.
+
+    Months are read back from their indexed ranges one after another, so
+    only a single reading is in memory at any point.
+    """
+    wanted = None if months is None else set(months)
+    selected = [m for m in log.months() if wanted is None or m in wanted]
+    yield '{'
+    for i, month_year in enumerate(selected):
+        yield ('' if i == 0 else ',') + json.dumps(month_year) + ':['
+        for j, record in enumerate(log.records([month_year])):
+            yield ('' if j == 0 else ',') + json.dumps(_entry(record))
+        yield ']'
+    yield '}'
+
+
+def ndjson_chunks(log, months):
+    for record in log.records(months):
+        yield json.dumps(dict(_entry(record), month_year=record['month_year'])) + '\n'
+
+
+def csv_chunks(log, months):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for record in log.records(months):
+        writer.writerow([record.get(column, '') for column in CSV_COLUMNS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+WRITERS = {'json': json_chunks, 'ndjson': ndjson_chunks, 'csv': csv_chunks}
+
+
+def _batched(pieces):
+    """Join small string pieces into ~CHUNK_BYTES byte chunks"""
+    batch, size = [], 0
+    for piece in pieces:
+        data = piece.encode('utf-8')
+        batch.append(data)
+        size += len(data)
+        if size >= CHUNK_BYTES:
+            yield b''.join(batch)
+            batch, size = [], 0
+    if batch:
+        yield b''.join(batch)
+
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_stream(log, months, fmt='json', compress=False):
+    """Byte chunks of the tracker export in `fmt`, optionally gzip-compressed"""
+    chunks = _batched(WRITERS[fmt](log, months))
+    return _gzipped(chunks) if compress else chunks
@@ -0,0 +1,90 @@
+import random
+import time
+
+# Messages for injected errors: ResourceExhausted, InternalServerError, ServiceUnavailable
+FAKE_ERRORS = {
+    429: 'Resource exhausted (fake model)',
+    500: 'Internal error (fake model)',
+    503: 'Service unavailable (fake model)',
+}
+
+
+class FakeModelError(Exception):
+    """Injected upstream failure; `code` is the HTTP status Gemini would use"""
+
+    def __init__(self, code, message=None):
+        super().__init__(message or FAKE_ERRORS.get(code, f'Error {code} (fake model)'))
+        self.code = code
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeStream:
+    """Streamed fake reply. cancel() ends it the way cancelling the real
+    gRPC call does: the next read fails instead of more chunks arriving."""
+
+    def __init__(self, model, chunks):
+        self.model = model
+        self.chunks = chunks
+        self.cancelled = False
+
+    def __iter__(self):
+        for i, text in enumerate(self.chunks):
+            if i:
+                time.sleep(self.model.chunk_delay)
+            if self.cancelled:
+                raise FakeModelError(499, 'Cancelled (fake model)')
+            yield FakeResponse(text)
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self.model.cancelled += 1
+
+
+class FakeModel:
+    """Offline stand-in for genai.GenerativeModel.
+
+    Sleeps for `latency` seconds (plus up to `latency_jitter` more) before
+    answering, and `chunk_delay` between streamed chunks, so load tests see
+    realistic worker occupancy without calling Gemini. With `error_rate` a
+    call fails with a random status from `error_codes` instead, and a call
+    that takes longer than request_options['timeout'] fails with 504 like
+    the real client. `cancelled` counts streams cancelled before they
+    finished. Enable with GEMINI_FAKE_MODEL=1.
+    """
+
+    def __init__(self, latency=2.0, chunk_delay=0.05, reply=None,
+                 latency_jitter=0.0, error_rate=0.0, error_codes=(429, 503)):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.calls = 0
+        self.cancelled = 0
+        self.reply = reply or (
+            "Aim for a balanced plate: half non-starchy vegetables, a quarter lean protein "
+            "and a quarter whole grains. Keep checking your sugar levels and stay hydrated."
+        )
+
+    def _chunks(self):
+        words = self.reply.split(' ')
+        return [' '.join(words[i:i + 4]) + ' ' for i in range(0, len(words), 4)]
+
+    def generate_content(self, prompt, stream=False, request_options=None, **kwargs):
+        self.calls += 1
+        latency = self.latency + random.uniform(0, self.latency_jitter)
+        timeout = (request_options or {}).get('timeout')
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise FakeModelError(504, 'Deadline exceeded (fake model)')
+        time.sleep(latency)
+        if self.error_codes and random.random() < self.error_rate:
+            raise FakeModelError(random.choice(self.error_codes))
+        if stream:
+            return FakeStream(self, self._chunks())
+        return FakeResponse(self.reply)
@@ -0,0 +1,26 @@
+import hashlib
+from flask import current_app, jsonify, request
+
+
+def make_etag(*parts):
+    """Strong ETag for a representation built from `parts` and the query string"""
+    query = hashlib.sha1(request.query_string).hexdigest()[:12]
+    return '-'.join(str(part) for part in parts) + f'-{query}'
+
+
+def not_modified(etag):
+    """Return a 304 response if the client already holds `etag`, else None"""
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return None
+
+
+def cacheable_json(payload, etag):
+    """jsonify `payload` with a validator the browser can revalidate against"""
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import g, has_app_context
+
+
+class LoaderCache:
+    """Memo for the data.py loaders, at two levels.
+
+    Within a request, results and the versions they are keyed on live on
+    flask.g, so a view and the helpers it calls read each file once. Across
+    requests each worker keeps results for `ttl` seconds, keyed on the
+    data's version: the version is still checked once per request, so a
+    write from any worker is seen right away and the TTL only bounds how
+    long results nobody asks for stay in memory.
+
+    Cached values are shared between requests - callers must not modify them.
+    """
+
+    def __init__(self, ttl=30, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.request_hits = 0
+        self.misses = 0
+
+    def _request_memo(self):
+        if not has_app_context():
+            return None
+        memo = g.get('_loader_memo')
+        if memo is None:
+            memo = g._loader_memo = {}
+        return memo
+
+    def request_value(self, key, load):
+        """load() once per request (e.g. a version stamp)"""
+        memo = self._request_memo()
+        if memo is None:
+            return load()
+        if key not in memo:
+            memo[key] = load()
+        return memo[key]
+
+    def get(self, key, version, load, keep=None):
+        """The cached result of load() for `key` at `version`.
+
+        If keep(value) is false the value is only remembered for the current
+        request (e.g. too large to hold on to).
+        """
+        key = key + (version,)
+        memo = self._request_memo()
+        if memo is not None and key in memo:
+            with self._lock:
+                self.request_hits += 1
+            return memo[key]
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                value = entry[1]
+            else:
+                entry = None
+        if entry is None:
+            value = load()
+            shared = keep is None or keep(value)
+            with self._lock:
+                self.misses += 1
+                if shared:
+                    self._entries[key] = (now, value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+        if memo is not None:
+            memo[key] = value
+        return value
+
+    def forget(self, user_id):
+        """Drop the current request's entries for a user after writing their data"""
+        memo = self._request_memo()
+        if memo:
+            for key in [key for key in memo if key[1] == user_id]:
+                del memo[key]
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits,
+                    'request_hits': self.request_hits, 'misses': self.misses}
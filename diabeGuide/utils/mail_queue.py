@@ -0,0 +1,268 @@
+import logging
+import os
+import random
+import smtplib
+import threading
+import time
+from ..storage.sqlite import ConnectionPerThread
+from .metrics import PHASE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def is_permanent(error):
+    """True for SMTP replies that retrying won't change (5xx, or every recipient refused with 5xx)"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return bool(error.recipients) and all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+class Outbox:
+    """Durable SQLite queue of outgoing mail.
+
+    Workers claim due messages with a lease, so several gunicorn processes
+    can drain the same outbox without sending a message twice, and messages
+    claimed by a worker that died are picked up again once the lease runs out.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            to_email TEXT NOT NULL,
+            from_email TEXT NOT NULL,
+            body TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt REAL NOT NULL,
+            claimed_until REAL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            last_error TEXT,
+            created REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt);
+    """
+
+    def __init__(self, path, max_attempts=5, base_backoff=5.0, lease=120):
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.lease = lease
+        self._connections = ConnectionPerThread(path)
+        conn = self._connections.get()
+        with conn:
+            conn.executescript(self.SCHEMA)
+
+    def put(self, to_email, from_email, body):
+        conn = self._connections.get()
+        now = time.time()
+        with conn:
+            conn.execute(
+                'INSERT INTO outbox (to_email, from_email, body, next_attempt, created) VALUES (?, ?, ?, ?, ?)',
+                (to_email, from_email, body, now, now)
+            )
+
+    def claim(self, limit):
+        """Lease up to `limit` due messages to the caller"""
+        conn = self._connections.get()
+        now = time.time()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute(
+                "SELECT id, to_email, from_email, body, attempts FROM outbox "
+                "WHERE status = 'pending' AND next_attempt <= ? AND (claimed_until IS NULL OR claimed_until < ?) "
+                "ORDER BY next_attempt LIMIT ?",
+                (now, now, limit)
+            ).fetchall()
+            conn.executemany(
+                'UPDATE outbox SET claimed_until = ? WHERE id = ?',
+                [(now + self.lease, row['id']) for row in rows]
+            )
+        return [dict(row) for row in rows]
+
+    def mark_sent(self, message_id):
+        conn = self._connections.get()
+        with conn:
+            conn.execute('DELETE FROM outbox WHERE id = ?', (message_id,))
+
+    def mark_failed(self, message, error, permanent=False):
+        """Schedule a retry with jittered exponential backoff, or give up
+        (straight away if the failure is `permanent`)"""
+        attempts = message['attempts'] + 1
+        delay = self.base_backoff * (2 ** (attempts - 1)) * random.uniform(0.5, 1.5)
+        status = 'failed' if permanent or attempts >= self.max_attempts else 'pending'
+        conn = self._connections.get()
+        with conn:
+            conn.execute(
+                'UPDATE outbox SET attempts = ?, next_attempt = ?, claimed_until = NULL, status = ?, last_error = ? WHERE id = ?',
+                (attempts, time.time() + delay, status, str(error), message['id'])
+            )
+
+    def release(self, messages):
+        """Hand claimed messages back untried: due again at once, no attempt counted"""
+        conn = self._connections.get()
+        with conn:
+            conn.executemany('UPDATE outbox SET claimed_until = NULL WHERE id = ?', [(m['id'],) for m in messages])
+
+    def has_pending(self):
+        row = self._connections.get().execute("SELECT 1 FROM outbox WHERE status = 'pending' LIMIT 1").fetchone()
+        return row is not None
+
+    def stats(self):
+        rows = self._connections.get().execute('SELECT status, COUNT(*) AS n FROM outbox GROUP BY status')
+        return {row['status']: row['n'] for row in rows}
+
+
+class SMTPConnectionPool:
+    """Keeps authenticated SMTP connections open between sends.
+
+    Connecting, STARTTLS and login cost several round trips; reusing a live
+    connection skips all of that. Connections idle for longer than
+    `idle_timeout` are closed.
+    """
+
+    def __init__(self, host, port, username='', password='', use_tls=True, size=2, idle_timeout=60, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            server.starttls()
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        return server
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, _ = self._idle.pop()
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._close(server)
+        return self._connect()
+
+    def release(self, server, broken=False):
+        with self._lock:
+            if not broken and len(self._idle) < self.size:
+                self._idle.append((server, time.time()))
+                return
+        self._close(server)
+
+    def close_idle(self):
+        now = time.time()
+        with self._lock:
+            stale = [server for server, since in self._idle if now - since > self.idle_timeout]
+            self._idle = [(server, since) for server, since in self._idle if now - since <= self.idle_timeout]
+        for server in stale:
+            self._close(server)
+
+    def _close(self, server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+
+class MailSender:
+    """Background thread that drains the outbox in batches over pooled connections"""
+
+    def __init__(self, outbox, pool, batch_size=20, poll_interval=5.0):
+        self.outbox = outbox
+        self.pool = pool
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='mail-sender', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+
+    def notify(self):
+        """Wake the sender now instead of at the next poll"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                sent = self.send_batch()
+            except Exception as e:
+                logger.exception("Mail sender error: %s", e)
+                sent = 0
+            if not sent:
+                self.pool.close_idle()
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def send_batch(self):
+        """Send one batch of due messages; returns how many were claimed"""
+        batch = self.outbox.claim(self.batch_size)
+        if not batch:
+            return 0
+        try:
+            with PHASE_SECONDS.time(phase='smtp_connect'):
+                server = self.pool.acquire()
+        except (smtplib.SMTPException, OSError) as e:
+            logger.error("Error connecting to SMTP server: %s", e)
+            for message in batch:
+                self.outbox.mark_failed(message, e)
+            return len(batch)
+
+        broken = False
+        for i, message in enumerate(batch):
+            try:
+                with PHASE_SECONDS.time(phase='smtp_send'):
+                    server.sendmail(message['from_email'], [message['to_email']], message['body'])
+                self.outbox.mark_sent(message['id'])
+            except (smtplib.SMTPException, OSError) as e:
+                permanent = is_permanent(e)
+                logger.error("Error sending email to %s%s: %s", message['to_email'],
+                             ' (giving up)' if permanent else '', e)
+                self.outbox.mark_failed(message, e, permanent=permanent)
+                # SMTPException subclasses OSError; only socket errors and disconnects break the connection
+                if isinstance(e, smtplib.SMTPServerDisconnected) or not isinstance(e, smtplib.SMTPException):
+                    # The rest of the batch wasn't tried; let the next round have it
+                    broken = True
+                    self.outbox.release(batch[i + 1:])
+                    break
+        self.pool.release(server, broken=broken)
+        return len(batch)
+
+
+_sender = None
+_sender_pid = None
+_sender_lock = threading.Lock()
+
+
+def current_sender():
+    """This process's sender if one has been started, else None"""
+    return _sender if _sender_pid == os.getpid() else None
+
+
+def get_mail_sender(outbox_path, pool_factory):
+    """This process's sender, started on first use (and again after a fork)"""
+    global _sender, _sender_pid
+    with _sender_lock:
+        if _sender is None or _sender_pid != os.getpid():
+            _sender = MailSender(Outbox(outbox_path), pool_factory())
+            _sender.start()
+            _sender_pid = os.getpid()
+        return _sender
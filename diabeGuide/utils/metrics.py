@@ -0,0 +1,255 @@
+import cProfile
+import functools
+import glob
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from ..storage.atomic import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers sub-millisecond file reads up to minute-long model calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram with labels, kept in process memory"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'documentation': self.documentation,
+                'labelnames': list(self.labelnames),
+                'buckets': list(self.buckets),
+                'series': [[list(key), list(counts), total, count] for key, (counts, total, count) in self._series.items()],
+            }
+
+
+_histograms = {}
+_collectors = []
+_registry_lock = threading.Lock()
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """Get or create the histogram registered under `name`"""
+    with _registry_lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram(name, documentation, labelnames, buckets)
+        return _histograms[name]
+
+
+def register_collector(fn):
+    """fn() -> [(name, documentation, {label: value}, value)] gauges read at scrape time"""
+    _collectors.append(fn)
+
+
+REQUEST_SECONDS = histogram(
+    'diabeguide_request_seconds', 'Time spent handling a request, by endpoint',
+    ('endpoint', 'method', 'status')
+)
+PHASE_SECONDS = histogram(
+    'diabeguide_phase_seconds', 'Time spent in internal phases (storage, model calls, SMTP)',
+    ('phase',)
+)
+
+
+def timed(phase):
+    """Decorator recording each call's duration under diabeguide_phase_seconds{phase=...}"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with PHASE_SECONDS.time(phase=phase):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- Multi-worker aggregation ---
+# Each gunicorn worker has its own histograms. With METRICS_DIR set, workers
+# write snapshots there and /metrics adds up every worker's file.
+METRICS_DIR = os.getenv('METRICS_DIR')
+FLUSH_INTERVAL = 1.0
+# Snapshots not rewritten for this long are ignored, in case their pid was
+# reused by an unrelated process after the worker died
+STALE_AFTER = float(os.getenv('METRICS_STALE_AFTER', 3600))
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def snapshot():
+    with _registry_lock:
+        histograms = list(_histograms.values())
+    return {h.name: h.snapshot() for h in histograms}
+
+
+def flush(force=False):
+    """Write this worker's snapshot to METRICS_DIR (at most once a second).
+    A failed write is logged rather than raised, so it can't fail a request."""
+    global _last_flush
+    if not METRICS_DIR:
+        return
+    with _flush_lock:
+        now = time.monotonic()
+        if not force and now - _last_flush < FLUSH_INTERVAL:
+            return
+        _last_flush = now
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        # Derived data, rewritten every second, so no fsync
+        atomic_write_json(worker_file(os.getpid()), snapshot(), fsync=False)
+    except OSError:
+        logger.exception('Could not write metrics snapshot to %s', METRICS_DIR)
+
+
+def worker_file(pid):
+    return os.path.join(METRICS_DIR, f'metrics_{pid}.json')
+
+
+def remove_worker_file(pid):
+    """Forget an exited worker's snapshot"""
+    if METRICS_DIR:
+        try:
+            os.remove(worker_file(pid))
+        except FileNotFoundError:
+            pass
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, owned by someone else
+    return True
+
+
+def _live_worker_files():
+    """Snapshot files of running workers; those of dead workers are deleted"""
+    now = time.time()
+    for path in glob.glob(os.path.join(METRICS_DIR, 'metrics_*.json')):
+        try:
+            pid = int(os.path.basename(path)[len('metrics_'):-len('.json')])
+            mtime = os.path.getmtime(path)
+        except (ValueError, OSError):
+            continue
+        if not _alive(pid):
+            remove_worker_file(pid)
+        elif pid == os.getpid() or now - mtime <= STALE_AFTER:
+            yield path
+
+
+def _merged():
+    if not METRICS_DIR:
+        return snapshot()
+    flush(force=True)
+    merged = {}
+    for path in _live_worker_files():
+        try:
+            with open(path) as f:
+                worker = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, data in worker.items():
+            target = merged.setdefault(name, dict(data, series=[]))
+            index = {tuple(s[0]): s for s in target['series']}
+            for labels, counts, total, count in data['series']:
+                existing = index.get(tuple(labels))
+                if existing is None:
+                    existing = [labels, [0] * len(counts), 0.0, 0]
+                    target['series'].append(existing)
+                    index[tuple(labels)] = existing
+                existing[1] = [a + b for a, b in zip(existing[1], counts)]
+                existing[2] += total
+                existing[3] += count
+    return merged
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for name, data in sorted(_merged().items()):
+        lines.append(f"# HELP {name} {data['documentation']}")
+        lines.append(f"# TYPE {name} histogram")
+        for values, counts, total, count in data['series']:
+            labels = _labels(data['labelnames'], values)
+            for bound, bucket_count in zip(data['buckets'] + ['+Inf'], counts + [count]):
+                bucket_labels = _labels(data['labelnames'], values, 'le="%s"' % bound)
+                lines.append(f"{name}_bucket{bucket_labels} {bucket_count}")
+            lines.append(f"{name}_sum{labels} {total}")
+            lines.append(f"{name}_count{labels} {count}")
+
+    # Gauges describe the worker that answered the scrape
+    gauges = {}
+    for collector in _collectors:
+        try:
+            for name, documentation, labels, value in collector():
+                gauges.setdefault(name, (documentation, []))[1].append((dict(labels, worker=os.getpid()), value))
+        except Exception as e:
+            logger.warning("Metrics collector failed: %s", e)
+    for name, (documentation, samples) in sorted(gauges.items()):
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            lines.append(f"{name}{_labels(labels.keys(), labels.values())} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+# --- Per-request profiling ---
+def start_profile():
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def finish_profile(profiler, label, profile_dir=None, limit=25):
+    """Stop profiling, log the top functions by cumulative time and
+    optionally save the raw stats for snakeviz/pstats"""
+    profiler.disable()
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+    logger.info("Profile for %s:\n%s", label, out.getvalue())
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        safe_label = label.replace('/', '_').replace('.', '_')
+        profiler.dump_stats(os.path.join(profile_dir, f'{safe_label}-{int(time.time() * 1000)}.prof'))
@@ -0,0 +1,288 @@
+import hashlib
+import math
+import random
+import threading
+import time
+from concurrent.futures import Future
+from ..storage.sqlite import ConnectionPerThread
+from .model_loader import is_deadline_exceeded, is_retryable, is_upstream_failure
+from .model_pool import ModelBusy
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+# Gauge values for /metrics
+STATES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """Fails model calls fast while the upstream looks unhealthy.
+
+    After `threshold` upstream failures in a row the circuit opens and calls
+    are refused for `reset_timeout` seconds. Then a single trial call is let
+    through (half-open): success closes the circuit, failure opens it again.
+    A call that takes the trial slot but is never made must release() it;
+    a trial that never reports back frees its slot after `reset_timeout`.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_at = None
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def allow(self):
+        """0 if a call may go ahead now, else seconds until the next one may"""
+        with self._lock:
+            if self.state == CLOSED:
+                return 0
+            now = time.monotonic()
+            if self.state == OPEN:
+                wait = self._opened_at + self.reset_timeout - now
+                if wait > 0:
+                    return wait
+                self.state = HALF_OPEN
+                self._trial_at = None
+            if self._trial_at is not None and now - self._trial_at < self.reset_timeout:
+                return self._trial_at + self.reset_timeout - now
+            self._trial_at = now
+            return 0
+
+    def release(self):
+        """Give back the trial slot taken by allow() for a call that was never made"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._trial_at = None
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self._failures = 0
+            self._trial_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._failures >= self.threshold):
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self._trial_at = None
+                self.opened += 1
+
+
+class _LeaderOverQuota(Exception):
+    """Set on a single-flight call whose leader was refused by its quota, so
+    the callers waiting on it start their own call instead"""
+
+
+class UserQuota:
+    """Model requests allowed per user per fixed window, counted in SQLite so
+    every worker draws on the same budget"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS model_quota (
+            user_id TEXT PRIMARY KEY,
+            count INTEGER NOT NULL,
+            window_start REAL NOT NULL
+        );
+    """
+
+    # Drop expired counters every this many requests
+    PRUNE_EVERY = 500
+
+    def __init__(self, path, limit=60, window=3600):
+        self.limit = limit
+        self.window = window
+        self._connections = ConnectionPerThread(path)
+        self._hits = 0
+        conn = self._connections.get()
+        with conn:
+            conn.executescript(self.SCHEMA)
+
+    def hit(self, user_id):
+        """Count one request; returns seconds to wait if it is over the limit, else 0"""
+        now = time.time()
+        conn = self._connections.get()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT count, window_start FROM model_quota WHERE user_id = ?', (str(user_id),)).fetchone()
+            count, start = (row['count'], row['window_start']) if row and row['window_start'] > now - self.window else (0, now)
+            if count >= self.limit:
+                return int(start + self.window - now) + 1
+            conn.execute(
+                'INSERT OR REPLACE INTO model_quota (user_id, count, window_start) VALUES (?, ?, ?)',
+                (str(user_id), count + 1, start)
+            )
+        self._hits += 1
+        if self._hits % self.PRUNE_EVERY == 0:
+            self.prune()
+        return 0
+
+    def prune(self):
+        conn = self._connections.get()
+        with conn:
+            conn.execute('DELETE FROM model_quota WHERE window_start <= ?', (time.time() - self.window,))
+
+
+class ModelClient:
+    """Resilient front for Gemini calls made through a ModelCallPool.
+
+    generate() joins an identical prompt that is already in flight in this
+    worker (single-flight) or charges the user's quota and makes the call
+    itself: each attempt passes the time left before the deadline on to
+    the SDK, ResourceExhausted/ServiceUnavailable are retried with full
+    jitter backoff while the deadline allows, and the circuit breaker
+    refuses attempts while the upstream keeps failing.
+
+    Refusals raise ModelBusy (429 for quota, 503 for an open circuit) and
+    running out of time raises TimeoutError.
+    """
+
+    def __init__(self, pool, timeout=60, retries=2, backoff=0.5, max_backoff=8,
+                 breaker=None, quota=None):
+        self.pool = pool
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.quota = quota
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._counts = {'calls': 0, 'retries': 0, 'coalesced': 0, 'failures': 0,
+                        'rejected_quota': 0, 'rejected_open': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def check_quota(self, user_id):
+        if self.quota is None:
+            return
+        wait = self.quota.hit(user_id)
+        if wait:
+            self._count('rejected_quota')
+            raise ModelBusy("You've sent a lot of messages recently. Please try again later.", wait, status=429)
+
+    def check_circuit(self):
+        wait = self.breaker.allow()
+        if wait:
+            self._count('rejected_open')
+            raise ModelBusy('The assistant is temporarily unavailable. Please try again shortly.',
+                            math.ceil(wait))
+
+    def admit(self, user_id):
+        """Circuit and quota checks for one call. The circuit goes first so a
+        call it refuses doesn't use up the user's quota. If an admitted call
+        is then not made after all, release() must be called."""
+        self.check_circuit()
+        try:
+            self.check_quota(user_id)
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self):
+        """Undo admit() for a call that was never made"""
+        self.breaker.release()
+
+    def record(self, error=None):
+        """Report how a call admitted with admit() ended"""
+        if error is not None and is_upstream_failure(error):
+            self._count('failures')
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def request_options(self, deadline):
+        return {'timeout': max(deadline - time.monotonic(), 0.001)}
+
+    def generate(self, user_id, model, prompt, timeout=None):
+        """model's response to `prompt`, within `timeout` seconds overall"""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        key = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        while True:
+            with self._lock:
+                future = self._inflight.get(key)
+                leader = future is None
+                if leader:
+                    future = self._inflight[key] = Future()
+            if leader:
+                break
+            # Followers don't reach the model, so they aren't charged quota
+            try:
+                response = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except _LeaderOverQuota:
+                continue
+            self._count('coalesced')
+            return response
+
+        try:
+            self.admit(user_id)
+        except BaseException as e:
+            # A quota refusal is the leader's alone; its followers try for themselves
+            over_quota = isinstance(e, ModelBusy) and e.status == 429
+            self._settle(key, future, error=_LeaderOverQuota() if over_quota else e)
+            raise
+        try:
+            response = self._call(user_id, model, prompt, deadline)
+        except BaseException as e:
+            self._settle(key, future, error=e)
+            raise
+        self._settle(key, future, response=response)
+        return response
+
+    def _settle(self, key, future, response=None, error=None):
+        # Unregister first so nobody joins a call that has finished
+        with self._lock:
+            del self._inflight[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(response)
+
+    def _call(self, user_id, model, prompt, deadline):
+        # The first attempt was let through by admit(); retries ask the circuit again
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if attempt == 0:
+                    self.release()
+                raise TimeoutError('Model call deadline exceeded')
+            if attempt:
+                self.check_circuit()
+            self._count('calls')
+            try:
+                response = self.pool.call(
+                    user_id, model.generate_content, prompt,
+                    request_options=self.request_options(deadline), timeout=remaining
+                )
+            except ModelBusy:
+                # Refused by the pool before reaching the model
+                self.release()
+                raise
+            except Exception as e:
+                self.record(e)
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                if not is_retryable(e) or attempt >= self.retries or time.monotonic() + delay >= deadline:
+                    if is_deadline_exceeded(e) and not isinstance(e, TimeoutError):
+                        raise TimeoutError('Model call deadline exceeded') from e
+                    raise
+                attempt += 1
+                self._count('retries')
+                time.sleep(delay)
+            else:
+                self.record()
+                return response
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts, inflight=len(self._inflight))
+        stats['circuit_state'] = STATES[self.breaker.state]
+        stats['circuit_opened'] = self.breaker.opened
+        return stats
@@ -0,0 +1,95 @@
+import sys
+import threading
+from .fake_model import FakeModelError
+
+GEMINI_MODEL = 'gemini-2.5-flash'
+# HTTP statuses worth retrying: ResourceExhausted (quota) and ServiceUnavailable
+RETRYABLE_CODES = (429, 503)
+
+
+class LazyModel:
+    """Stands in for the Gemini model until the first chat needs it.
+
+    Importing google.generativeai pulls in grpc and protobuf, which dominates
+    worker start-up; deferring it keeps boot and reload fast and means
+    workers that never serve a chat never pay for it.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def get(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._factory()
+        return self._model
+
+    def generate_content(self, *args, **kwargs):
+        return self.get().generate_content(*args, **kwargs)
+
+
+def gemini_factory(api_key, model_name=GEMINI_MODEL):
+    def build():
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        return genai.GenerativeModel(model_name)
+    return build
+
+
+def import_sdk():
+    """Import the Gemini SDK now, e.g. in the gunicorn master before workers fork"""
+    import google.api_core.exceptions  # noqa: F401
+    import google.generativeai  # noqa: F401
+
+
+def is_permission_denied(e):
+    # If the SDK was never imported, it can't have raised this
+    exceptions = sys.modules.get('google.api_core.exceptions')
+    return exceptions is not None and isinstance(e, exceptions.PermissionDenied)
+
+
+def cancel_stream(stream):
+    """Cancel a streaming generate_content call now rather than leaving its
+    connection to garbage collection. The SDK's response keeps the gRPC call
+    (which has cancel()) in `_iterator`; the fake model's stream has its own."""
+    for target in (stream, getattr(stream, '_iterator', None)):
+        for name in ('cancel', 'close'):
+            method = getattr(target, name, None)
+            if callable(method):
+                method()
+                return True
+    return False
+
+
+def upstream_code(e):
+    """HTTP status of an error raised by the Gemini SDK (or the fake model), else None"""
+    exceptions = sys.modules.get('google.api_core.exceptions')
+    if exceptions is not None and isinstance(e, exceptions.GoogleAPICallError):
+        return e.code
+    if isinstance(e, FakeModelError):
+        return e.code
+    return None
+
+
+def is_retryable(e):
+    return upstream_code(e) in RETRYABLE_CODES
+
+
+def is_deadline_exceeded(e):
+    return isinstance(e, TimeoutError) or upstream_code(e) == 504
+
+
+def is_upstream_failure(e):
+    """True for errors that say the upstream is unhealthy (as opposed to a bad
+    request or key), which is what the circuit breaker counts"""
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    code = upstream_code(e)
+    return code is not None and (code == 429 or code >= 500)
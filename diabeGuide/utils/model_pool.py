@@ -0,0 +1,63 @@
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ModelBusy(Exception):
+    """Raised when a model call is refused to protect the worker (or the
+    upstream); served with `status` and a Retry-After header"""
+
+    def __init__(self, message, retry_after, status=503):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status = status
+
+
+class ModelCallPool:
+    """Bounded thread pool for Gemini calls with admission control.
+
+    At most `max_workers` calls run at once and at most `max_pending` are
+    running or queued; each user may have `per_user` calls in flight. Calls
+    beyond that are refused with ModelBusy (served as 503 + Retry-After)
+    instead of piling up and starving logins and tracker writes.
+    """
+
+    def __init__(self, max_workers=4, max_pending=16, per_user=1, retry_after=5):
+        self.max_pending = max_pending
+        self.per_user = per_user
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='model-call')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._per_user_pending = Counter()
+
+    def acquire(self, user_id):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise ModelBusy('The assistant is busy right now. Please try again shortly.', self.retry_after)
+            if self._per_user_pending[user_id] >= self.per_user:
+                raise ModelBusy('Please wait for your previous message to finish.', self.retry_after)
+            self._pending += 1
+            self._per_user_pending[user_id] += 1
+
+    def release(self, user_id):
+        with self._lock:
+            self._pending -= 1
+            self._per_user_pending[user_id] -= 1
+            if self._per_user_pending[user_id] <= 0:
+                del self._per_user_pending[user_id]
+
+    def call(self, user_id, fn, *args, timeout=None, **kwargs):
+        """Run fn(*args, **kwargs) on the pool and wait up to `timeout` seconds"""
+        self.acquire(user_id)
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self.release(user_id)
+            raise
+        future.add_done_callback(lambda _: self.release(user_id))
+        return future.result(timeout=timeout)
+
+    def stats(self):
+        with self._lock:
+            return {'pending': self._pending, 'users': len(self._per_user_pending)}
@@ -0,0 +1,140 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+from ..storage.sqlite import ConnectionPerThread
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool is full; served as 503 + Retry-After"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """Password hashing on a small bounded thread pool.
+
+    scrypt and PBKDF2 release the GIL, so `max_workers` caps how many cores
+    hashing can occupy per worker process; requests beyond `max_pending` are
+    refused instead of queueing behind a login flood. `method` is any
+    werkzeug method string (e.g. 'scrypt:32768:8:1', 'pbkdf2:sha256:600000');
+    hashes made with other parameters are upgraded on the next login.
+    """
+
+    def __init__(self, method='scrypt', max_workers=2, max_pending=8, timeout=30, retry_after=2):
+        self.method = method
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='password-hash')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._prefix = None
+
+    def _run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise HashingBusy('Too many sign-ins right now. Please try again shortly.', self.retry_after)
+            self._pending += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Still queued behind slow hashes: drop it rather than leave it to run for nobody
+            future.cancel()
+            raise HashingBusy('Sign-in is taking too long right now. Please try again shortly.', self.retry_after)
+
+    def _done(self, _):
+        with self._lock:
+            self._pending -= 1
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with a different algorithm or cost"""
+        if self._prefix is None:
+            # werkzeug fills in default parameters ('scrypt' -> 'scrypt:32768:8:1'),
+            # so take the canonical prefix from a real hash
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._prefix
+
+
+class LoginThrottle:
+    """Fixed-window login attempt counters shared by all workers through SQLite.
+
+    Each attempt is counted before the password is checked, so a burst
+    against one account (or from one address) is turned away without paying
+    for a hash. A successful login resets the account's counter.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS login_attempts (
+            key TEXT PRIMARY KEY,
+            count INTEGER NOT NULL,
+            window_start REAL NOT NULL
+        );
+    """
+
+    # Drop expired counters every this many attempts
+    PRUNE_EVERY = 500
+
+    def __init__(self, path, max_attempts=10, max_attempts_per_ip=50, window=300):
+        self.max_attempts = max_attempts
+        self.max_attempts_per_ip = max_attempts_per_ip
+        self.window = window
+        self._connections = ConnectionPerThread(path)
+        self._hits = 0
+        conn = self._connections.get()
+        with conn:
+            conn.executescript(self.SCHEMA)
+
+    def hit(self, identifier, remote_addr=None):
+        """Count one attempt; returns seconds to wait if it is over the limit, else 0"""
+        limits = [(f"id:{(identifier or '').strip().lower()}", self.max_attempts)]
+        if remote_addr:
+            limits.append((f"ip:{remote_addr}", self.max_attempts_per_ip))
+
+        now = time.time()
+        wait = 0
+        conn = self._connections.get()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for key, limit in limits:
+                row = conn.execute('SELECT count, window_start FROM login_attempts WHERE key = ?', (key,)).fetchone()
+                count, start = (row['count'], row['window_start']) if row and row['window_start'] > now - self.window else (0, now)
+                if count >= limit:
+                    wait = max(wait, int(start + self.window - now) + 1)
+                else:
+                    conn.execute(
+                        'INSERT OR REPLACE INTO login_attempts (key, count, window_start) VALUES (?, ?, ?)',
+                        (key, count + 1, start)
+                    )
+        self._hits += 1
+        if self._hits % self.PRUNE_EVERY == 0:
+            self.prune()
+        return wait
+
+    def reset(self, identifier):
+        conn = self._connections.get()
+        with conn:
+            conn.execute('DELETE FROM login_attempts WHERE key = ?', (f"id:{(identifier or '').strip().lower()}",))
+
+    def prune(self):
+        conn = self._connections.get()
+        with conn:
+            conn.execute('DELETE FROM login_attempts WHERE window_start <= ?', (time.time() - self.window,))
@@ -0,0 +1,15 @@
+from ..storage.tracker_summary import parse_level
+
+# Upper age bound (exclusive) and label of each band
+AGE_BANDS = ((18, '<18'), (30, '18-29'), (45, '30-44'), (60, '45-59'), (75, '60-74'), (None, '75+'))
+UNKNOWN = 'unknown'
+
+
+def age_band(age):
+    """Coarse age group for a profile age ('30-44'), or 'unknown'"""
+    age = parse_level(age)
+    if age is None or age < 0:
+        return UNKNOWN
+    for upper, label in AGE_BANDS:
+        if upper is None or age < upper:
+            return label
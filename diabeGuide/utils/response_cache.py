@@ -0,0 +1,157 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from ..storage.sqlite import ConnectionPerThread
+
+
+def normalize_message(message):
+    """Lowercase, drop punctuation and collapse whitespace so trivially
+    different phrasings of the same question share a cache entry"""
+    message = re.sub(r'[^\w\s]', ' ', message.lower())
+    return ' '.join(message.split())
+
+
+# A question using any of these words (or a number) may be about the asker's
+# own readings, body or treatment, so it gets their tracker context and a
+# per-user cache entry. Matched after normalize_message, so "I'm" is "i m".
+PERSONAL_WORDS = frozenset((
+    # First person
+    'i', 'im', 'ive', 'id', 'me', 'my', 'mine', 'myself', 'we', 'us', 'our',
+    'am', 'was', 'were', 'been', 'did', 'had', 'doing', 'progress',
+    # Time relative to the asker
+    'now', 'today', 'tonight', 'yesterday', 'lately', 'recent', 'recently', 'week', 'month',
+    # Their data
+    'trend', 'trends', 'reading', 'readings', 'tracker', 'log', 'logged', 'numbers', 'results', 'data', 'history',
+    # Symptoms
+    'feel', 'feeling', 'feels', 'felt', 'shaky', 'shaking', 'dizzy', 'sweaty', 'sweating', 'faint',
+    'confused', 'tired', 'thirsty', 'blurry', 'numb', 'tingling', 'pain', 'sick', 'nausea', 'vomiting',
+    # Dosing and medication
+    'dose', 'doses', 'dosage', 'take', 'taking', 'took', 'units', 'inject', 'injection', 'bolus',
+    'insulin', 'medication', 'medicine', 'meds', 'missed', 'skip', 'skipped',
+))
+
+
+def is_generic(message):
+    """True for questions that don't depend on the asker's tracker data
+    ("what is a normal sugar level"), whose replies can be shared"""
+    return not any(word in PERSONAL_WORDS or any(c.isdigit() for c in word)
+                   for word in normalize_message(message).split())
+
+
+def cache_key(message, *context):
+    """Key on the normalized message plus everything else that shapes the reply"""
+    digest = hashlib.sha256(normalize_message(message).encode('utf-8'))
+    for part in context:
+        digest.update(b'\0' + str(part).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Two-tier cache of chatbot replies.
+
+    A small in-process LRU answers repeats within a worker; a shared SQLite
+    table lets every gunicorn worker reuse replies the others paid for. Both
+    tiers expire entries after `ttl` seconds and the SQLite tier is trimmed
+    back to `max_entries` by least recent use.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            reply TEXT NOT NULL,
+            created REAL NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+    """
+
+    # Only refresh last_used on a hit when it is older than this, to keep reads cheap
+    TOUCH_INTERVAL = 60
+    # Trim the shared tier every this many stores
+    PRUNE_EVERY = 100
+
+    def __init__(self, path, ttl=86400, max_entries=10000, memory_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._connections = ConnectionPerThread(path)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stores = 0
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        conn = self._connections.get()
+        with conn:
+            conn.executescript(self.SCHEMA)
+
+    def _remember(self, key, reply, created):
+        with self._lock:
+            self._memory[key] = (reply, created)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached and now - cached[1] < self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return cached[0]
+
+        conn = self._connections.get()
+        row = conn.execute('SELECT reply, created, last_used FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None or now - row['created'] >= self.ttl:
+            with self._lock:
+                self.misses += 1
+            return None
+        if now - row['last_used'] > self.TOUCH_INTERVAL:
+            with conn:
+                conn.execute('UPDATE responses SET last_used = ? WHERE key = ?', (now, key))
+        self._remember(key, row['reply'], row['created'])
+        with self._lock:
+            self.hits += 1
+        return row['reply']
+
+    def put(self, key, reply):
+        now = time.time()
+        self._remember(key, reply, now)
+        conn = self._connections.get()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO responses (key, reply, created, last_used) VALUES (?, ?, ?, ?)',
+                (key, reply, now, now)
+            )
+        with self._lock:
+            self._stores += 1
+            prune = self._stores % self.PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """Drop expired entries, then the least recently used beyond max_entries"""
+        conn = self._connections.get()
+        with conn:
+            conn.execute('DELETE FROM responses WHERE created < ?', (time.time() - self.ttl,))
+            excess = conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    'DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)',
+                    (excess,)
+                )
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'memory_hits': self.memory_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'memory_entries': len(self._memory)
+            }
@@ -0,0 +1,108 @@
+"""Minimal local SMTP server that accepts every message, for testing mail delivery.
+
+    python -m diabeGuide.utils.smtp_sink --port 8025 [--save-dir mail/] [--latency 0.5]
+
+Point the app at it with SMTP_SERVER=localhost SMTP_PORT=8025 SMTP_STARTTLS=0
+SMTP_AUTH=0. Received messages are printed (and optionally saved as .eml
+files); --latency delays every reply to imitate a slow mail server.
+"""
+import argparse
+import os
+import socketserver
+import threading
+import time
+from email import message_from_bytes
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.reply('220 diabeGuide smtp sink ready')
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command[:4].upper()
+            if verb == 'EHLO':
+                self.wfile.write(b'250-localhost\r\n')
+                self.reply('250 8BITMIME')
+            elif verb == 'HELO':
+                self.reply('250 localhost')
+            elif verb == 'MAIL':
+                sender, recipients = command.split(':', 1)[1].strip(), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command.split(':', 1)[1].strip())
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b'.\r\n', b'.\n'):
+                        break
+                    lines.append(data_line[1:] if data_line.startswith(b'..') else data_line)
+                self.server.deliver(sender, recipients, b''.join(lines))
+                self.reply('250 OK: queued')
+            elif verb in ('RSET', 'NOOP'):
+                if verb == 'RSET':
+                    sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, save_dir=None, latency=0.0, quiet=False):
+        super().__init__(address, SinkHandler)
+        self.save_dir = save_dir
+        self.latency = latency
+        self.quiet = quiet
+        self.received = 0
+        self._lock = threading.Lock()
+        if save_dir:
+            os.makedirs(save_dir, exist_ok=True)
+
+    def deliver(self, sender, recipients, content):
+        with self._lock:
+            self.received += 1
+            number = self.received
+        if self.save_dir:
+            with open(os.path.join(self.save_dir, f'{number:06d}.eml'), 'wb') as f:
+                f.write(content)
+        if not self.quiet:
+            msg = message_from_bytes(content)
+            print(f"[{number}] {sender} -> {', '.join(recipients)}: {msg['Subject']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--save-dir', help='Write each received message to this directory')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before every reply')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args()
+
+    with SmtpSink((args.host, args.port), args.save_dir, args.latency, args.quiet) as server:
+        print(f"SMTP sink listening on {args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
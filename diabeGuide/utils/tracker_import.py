@@ -0,0 +1,213 @@
+import csv
+import io
+import itertools
+import json
+import time
+from datetime import datetime
+from .. import data
+from ..storage.tracker_summary import parse_level
+
+# Readings written to the tracker log per append
+BATCH_SIZE = 1000
+# Plausible range for a meter or CGM reading, in mg/dL
+MIN_LEVEL = 20
+MAX_LEVEL = 600
+MMOL_TO_MGDL = 18.0
+# Row errors kept for the report (the rest are only counted)
+MAX_ERRORS = 20
+
+# Non-ISO timestamp layouts used by common meter/CGM exports
+TIMESTAMP_FORMATS = ('%m-%d-%Y %I:%M %p', '%m/%d/%Y %I:%M %p', '%m/%d/%Y %H:%M', '%Y/%m/%d %H:%M', '%d.%m.%Y %H:%M')
+
+TIMESTAMP_COLUMNS = ('timestamp', 'time', 'date', 'datetime', 'date time')
+LEVEL_COLUMNS = ('sugar_level', 'glucose', 'value', 'reading', 'sgv', 'bg')
+NOTE_COLUMNS = ('note', 'notes', 'comment', 'comments')
+# Exports often start with a title line or two before the header row
+MAX_PREAMBLE_LINES = 5
+
+
+def parse_timestamp(value):
+    """Normalize a timestamp to local 'YYYY-MM-DDTHH:MM:SS'"""
+    value = str(value or '').strip()
+    if not value:
+        raise ValueError('missing timestamp')
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        for fmt in TIMESTAMP_FORMATS:
+            try:
+                parsed = datetime.strptime(value, fmt)
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(f'unrecognised timestamp {value!r}')
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat(timespec='seconds')
+
+
+def parse_row(row):
+    """(month_year, entry) for one {'timestamp', 'sugar_level', 'note', 'mmol'} row"""
+    timestamp = parse_timestamp(row.get('timestamp'))
+    level = parse_level(row.get('sugar_level'))
+    if level is None:
+        raise ValueError(f"invalid glucose value {row.get('sugar_level')!r}")
+    if row.get('mmol'):
+        level *= MMOL_TO_MGDL
+    if not MIN_LEVEL <= level <= MAX_LEVEL:
+        raise ValueError(f'glucose value {level:g} mg/dL out of range')
+    entry = {
+        'sugar_level': f'{round(level, 1):g}',
+        'note': str(row.get('note') or 'Imported'),
+        'timestamp': timestamp,
+    }
+    return f'{timestamp[5:7]}-{timestamp[:4]}', entry
+
+
+def _match(name, candidates):
+    # 'Glucose Value (mg/dL)', 'Historic Glucose mg/dL' and 'Device Timestamp' all count
+    name = name.strip().lower()
+    return any(name == c or name.startswith(c + ' ') or name.startswith(c + '_') or
+               (c in ('glucose', 'timestamp') and c in name) for c in candidates)
+
+
+def _csv_columns(header):
+    """Column positions for timestamp, level and note, or None if this isn't the header row"""
+    columns = {}
+    for i, name in enumerate(header):
+        for field, candidates in (('timestamp', TIMESTAMP_COLUMNS), ('sugar_level', LEVEL_COLUMNS), ('note', NOTE_COLUMNS)):
+            if field not in columns and _match(name, candidates):
+                columns[field] = i
+                if field == 'sugar_level':
+                    columns['mmol'] = 'mmol' in name.lower()
+                break
+    if 'timestamp' in columns and 'sugar_level' in columns:
+        return columns
+    return None
+
+
+def csv_rows(lines):
+    """Rows from CSV text lines; the header is located before anything is yielded"""
+    reader = csv.reader(lines)
+    columns, line_no = None, 0
+    for header in itertools.islice(reader, MAX_PREAMBLE_LINES + 1):
+        line_no += 1
+        columns = _csv_columns(header)
+        if columns:
+            break
+    if not columns:
+        raise ValueError('No header row with a timestamp and a glucose column was found')
+
+    def rows():
+        for number, values in enumerate(reader, start=line_no + 1):
+            if not any(v.strip() for v in values):
+                continue
+            row = {'mmol': columns['mmol']}
+            for field in ('timestamp', 'sugar_level', 'note'):
+                if field in columns and columns[field] < len(values):
+                    row[field] = values[columns[field]]
+            yield number, row
+    return rows()
+
+
+def ndjson_rows(lines):
+    """Rows from newline-delimited JSON objects"""
+    def rows():
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                yield number, None
+                continue
+            if not isinstance(record, dict):
+                yield number, None
+                continue
+            units = str(record.get('units', '')).lower()
+            yield number, {
+                'timestamp': record.get('timestamp', record.get('time')),
+                'sugar_level': next((record[k] for k in LEVEL_COLUMNS if k in record), None),
+                'note': record.get('note'),
+                'mmol': 'mmol' in units,
+            }
+    return rows()
+
+
+def open_rows(stream, fmt):
+    """Wrap a binary upload stream and return its row iterator.
+
+    The body is decoded and parsed line by line as it arrives, so uploads of
+    any size are handled in constant memory. `fmt` is 'csv', 'ndjson' or
+    None to sniff it from the first line.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='')
+    first = text.readline()
+    if fmt is None:
+        fmt = 'ndjson' if first.lstrip().startswith('{') else 'csv'
+    lines = itertools.chain([first], text)
+    return csv_rows(lines) if fmt == 'csv' else ndjson_rows(lines)
+
+
+def existing_timestamps(user_id):
+    return {record['timestamp'] for record in data.get_user_tracker_log(user_id).records() if record.get('timestamp')}
+
+
+def import_readings(user_id, rows):
+    """Validate, dedupe and store rows in batches, yielding progress after each batch.
+
+    Readings whose timestamp is already in the tracker (or earlier in the
+    same upload) are skipped. Progress is also saved so any worker can
+    report it through GET /api/tracker/import.
+    """
+    seen = existing_timestamps(user_id)
+    status = {
+        'state': 'running', 'started': time.time(), 'processed': 0,
+        'imported': 0, 'duplicates': 0, 'rejected': 0, 'errors': [],
+    }
+    batch = []
+
+    def commit():
+        if batch:
+            data.append_user_data_batch(user_id, batch, compact=False)
+            status['imported'] += len(batch)
+            batch.clear()
+        status['updated'] = time.time()
+        data.save_import_status(user_id, status)
+
+    try:
+        for number, row in rows:
+            status['processed'] += 1
+            try:
+                if row is None:
+                    raise ValueError('not a JSON object')
+                month_year, entry = parse_row(row)
+            except ValueError as e:
+                status['rejected'] += 1
+                if len(status['errors']) < MAX_ERRORS:
+                    status['errors'].append({'line': number, 'error': str(e)})
+                continue
+            if entry['timestamp'] in seen:
+                status['duplicates'] += 1
+                continue
+            seen.add(entry['timestamp'])
+            batch.append((month_year, entry))
+            if len(batch) >= BATCH_SIZE:
+                commit()
+                yield dict(status)
+        commit()
+        status['state'] = 'done'
+    except GeneratorExit:
+        status['state'] = 'cancelled'
+        raise
+    except Exception as e:
+        status['state'] = 'failed'
+        status['error'] = str(e)
+    finally:
+        # Regroup everything appended by this import into the indexed body once
+        if status['imported']:
+            data.get_user_tracker_log(user_id).compact()
+        status['updated'] = time.time()
+        data.save_import_status(user_id, status)
+    yield dict(status)
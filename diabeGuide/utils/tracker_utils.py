@@ -0,0 +1,39 @@
+def month_key(month_year):
+    """(year, month) for a 'MM-YYYY' or 'YYYY-MM' string, or None if it can't be parsed"""
+    try:
+        first, second = (int(part) for part in month_year.split('-'))
+    except (AttributeError, ValueError):
+        return None
+    return (first, second) if first > 12 else (second, first)
+
+
+def day_bounds(start=None, end=None):
+    """('YYYY-MM-DD', 'YYYY-MM-DD') bounds covering the months `start` to
+    `end`; either is None when its month is missing or can't be parsed"""
+    start_key = month_key(start) if start else None
+    end_key = month_key(end) if end else None
+    return (f'{start_key[0]:04d}-{start_key[1]:02d}-01' if start_key else None,
+            f'{end_key[0]:04d}-{end_key[1]:02d}-31' if end_key else None)
+
+
+def months_in_range(months, start=None, end=None):
+    """Filter month_year keys to those between `start` and `end` (inclusive).
+
+    Raises ValueError if a bound is given but isn't a valid month.
+    """
+    start_key = month_key(start) if start else None
+    end_key = month_key(end) if end else None
+    if (start and start_key is None) or (end and end_key is None):
+        raise ValueError('Months must look like MM-YYYY or YYYY-MM')
+
+    selected = []
+    for month_year in months:
+        key = month_key(month_year)
+        if key is None:
+            continue
+        if start_key and key < start_key:
+            continue
+        if end_key and key > end_key:
+            continue
+        selected.append(month_year)
+    return selected